@@ -12,25 +12,43 @@
 """
 
 import math
+import re
 import numbers
 import sys
 import array
 import codecs
+import gc
+import operator
+import struct
+import zlib
 from collections import namedtuple
 from enum import Enum
-from itertools import groupby
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
 from io import IOBase
 
 try:
-    from PIL import Image, ImageDraw
+    from PIL import Image
 except ImportError:
-    Image = ImageDraw = None
+    Image = None
     missing_pil = sys.exc_info()
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    missing_numpy = sys.exc_info()
+
 Config = namedtuple('Config', ('layers', 'codewords', 'cw_bits'))
 
-configs = {
+# Module-level tables are immutable (read-only mappings, tuples and frozensets), and the cached
+# helpers below (gf_tables, mode_message_positions, data_positions, structure_template, placement_map)
+# return tuples, bytes or read-only memoryviews from thread-safe lru_caches. AztecCode construction
+# and rendering therefore share no mutable state, and may run concurrently in threads, including on
+# free-threaded (no-GIL) builds. See warmup() to build the caches before forking worker processes.
+
+configs = MappingProxyType({
     (15, True): Config(layers=1, codewords=17, cw_bits=6),
     (19, False): Config(layers=1, codewords=21, cw_bits=6),
     (19, True): Config(layers=2, codewords=40, cw_bits=6),
@@ -67,9 +85,9 @@ configs = {
     (143, False): Config(layers=30, codewords=1480, cw_bits=12),
     (147, False): Config(layers=31, codewords=1570, cw_bits=12),
     (151, False): Config(layers=32, codewords=1664, cw_bits=12),
-}
+})
 
-encoding_to_eci = {
+encoding_to_eci = MappingProxyType({
     'cp437': 0, # also 2
     'iso8859-1': 1, # (also 3) default interpretation, readers should assume if no ECI mark
     'iso8859-2': 4,
@@ -95,15 +113,18 @@ encoding_to_eci = {
     'big5': 28,
     'gb18030': 29,
     'euc_kr': 30,
-}
+})
 
-polynomials = {
+# the mode message holds the number of data codewords in 6 (compact) or 11 (full) bits
+max_data_codewords = MappingProxyType({True: 1 << 6, False: 1 << 11})
+
+polynomials = MappingProxyType({
     4: 19,
     6: 67,
     8: 301,
     10: 1033,
     12: 4201,
-}
+})
 
 Side = Enum('Side', ('left', 'right', 'bottom', 'top'))
 
@@ -112,19 +133,23 @@ Latch = Enum('Latch', Mode.__members__)
 Shift = Enum('Shift', Mode.__members__)
 Misc = Enum('Misc', ('FLG', 'SIZE', 'RESUME'))
 
-code_chars = {
+code_chars = MappingProxyType({k: tuple(v) for k, v in {
     Mode.UPPER: [Shift.PUNCT] + list(b' ABCDEFGHIJKLMNOPQRSTUVWXYZ') + [Latch.LOWER, Latch.MIXED, Latch.DIGIT, Shift.BINARY],
     Mode.LOWER: [Shift.PUNCT] + list(b' abcdefghijklmnopqrstuvwxyz') + [Shift.UPPER, Latch.MIXED, Latch.DIGIT, Shift.BINARY],
     Mode.MIXED: [Shift.PUNCT] + list(b' \x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x1b\x1c\x1d\x1e\x1f@\\^_`|~\x7f') + [Latch.LOWER, Latch.UPPER, Latch.PUNCT, Shift.BINARY],
     Mode.PUNCT: [Misc.FLG] + list(b'\r') + [b'\r\n', b'. ', b', ', b': '] + list(b'!"#$%&\'()*+,-./:;<=>?[]{}') + [Latch.UPPER],
     Mode.DIGIT: [Shift.PUNCT] + list(b' 0123456789,.') + [Latch.UPPER, Shift.UPPER],
-}
+}.items()})
+
+punct_2_chars = tuple(pc for pc in code_chars[Mode.PUNCT] if isinstance(pc, bytes))
 
-punct_2_chars = [pc for pc in code_chars[Mode.PUNCT] if isinstance(pc, bytes)]
+mode_chars = {m: frozenset(c for c in chars if isinstance(c, int)) for m, chars in code_chars.items()}
+mode_chars[Mode.BINARY] = frozenset(range(256))
+mode_chars = MappingProxyType(mode_chars)
 
 E = 99999  # some big number
 
-latch_len = {
+latch_len = MappingProxyType({
     Mode.UPPER: {
         Mode.UPPER: 0, Mode.LOWER: 5, Mode.MIXED: 5, Mode.PUNCT: 10, Mode.DIGIT: 5, Mode.BINARY: 10
     },
@@ -143,22 +168,56 @@ latch_len = {
     Mode.BINARY: {
         Mode.UPPER: 0, Mode.LOWER: 0, Mode.MIXED: 0, Mode.PUNCT: 0, Mode.DIGIT: 0, Mode.BINARY: 0
     },
-}
+})
+latch_len = MappingProxyType({k: MappingProxyType(v) for k, v in latch_len.items()})
 
-shift_len = {
+shift_len = MappingProxyType({
     (Mode.UPPER, Mode.PUNCT): 5,
     (Mode.LOWER, Mode.UPPER): 5,
     (Mode.LOWER, Mode.PUNCT): 5,
     (Mode.MIXED, Mode.PUNCT): 5,
     (Mode.DIGIT, Mode.UPPER): 4,
     (Mode.DIGIT, Mode.PUNCT): 4,
-}
+})
 
-char_size = {
+char_size = MappingProxyType({
     Mode.UPPER: 5, Mode.LOWER: 5, Mode.MIXED: 5, Mode.PUNCT: 5, Mode.DIGIT: 4, Mode.BINARY: 8,
-}
+})
+
+abbr_modes = MappingProxyType({m.name[0]:m for m in Mode})
 
-abbr_modes = {m.name[0]:m for m in Mode}
+
+@lru_cache(maxsize=None)
+def gf_tables(gf, pp):
+    """ Get log and anti-log tables for GF(gf)
+
+    The anti-log table is doubled in length, so that ``alog[log[x] + log[y]]``
+    needs no modulo.
+
+    The tables are read-only views of machine integers rather than
+    tuples of int objects, so that reading them doesn't write reference counts
+    (and processes forked after building them keep sharing their pages).
+
+    :param gf: Galois Field order
+    :param pp: prime modulus polynomial value
+    :return: (log, alog) tuple of read-only ``memoryview``
+    """
+    log = array.array('i', [1 - gf] * gf)
+    alog = array.array('i', [1] * (2 * gf))
+    for i in range(1, 2 * gf):
+        alog[i] = alog[i - 1] * 2
+        if alog[i] >= gf:
+            alog[i] ^= pp
+        if i < gf:
+            log[alog[i]] = i
+    if gf > 1:
+        log[1] = 0
+    return _read_only(log), _read_only(alog)
+
+
+def _read_only(values):
+    """ Get a read-only ``memoryview`` of an array (``memoryview.toreadonly`` needs Python 3.8) """
+    return memoryview(values.tobytes()).cast(values.typecode)
 
 
 def prod(x, y, log, alog, gf):
@@ -183,173 +242,404 @@ def reed_solomon(wd, nd, nc, gf, pp):
     :param gf: Galois Field order
     :param pp: prime modulus polynomial value
     """
-    # generate log and anti log tables
-    log = {0: 1 - gf}
-    alog = {0: 1}
-    for i in range(1, gf):
-        alog[i] = alog[i - 1] * 2
-        if alog[i] >= gf:
-            alog[i] ^= pp
-        log[alog[i]] = i
-    # generate polynomial coeffs
-    c = {0: 1}
-    for i in range(1, nc + 1):
-        c[i] = 0
-    for i in range(1, nc + 1):
-        c[i] = c[i - 1]
-        for j in range(i - 1, 0, -1):
-            c[j] = c[j - 1] ^ prod(c[j], alog[i], log, alog, gf)
-        c[0] = prod(c[0], alog[i], log, alog, gf)
-    # generate codewords
+    if not nc:
+        return
+    log, alog = gf_tables(gf, pp)
+    # logs of the generator polynomial's coefficients, highest degree first (-1 for zero)
+    generator = _rs_generator(nc, gf, pp)
     for i in range(nd, nd + nc):
         wd[i] = 0
     for i in range(nd):
         assert 0 <= wd[i] < gf
         k = wd[nd] ^ wd[i]
-        for j in range(nc):
-            wd[nd + j] = prod(k, c[nc - j - 1], log, alog, gf)
-            if j < nc - 1:
-                wd[nd + j] ^= wd[nd + j + 1]
-
+        if k:
+            log_k = log[k]
+            for j in range(nc - 1):
+                g = generator[j]
+                wd[nd + j] = wd[nd + j + 1] ^ (alog[log_k + g] if g >= 0 else 0)
+            g = generator[nc - 1]
+            wd[nd + nc - 1] = alog[log_k + g] if g >= 0 else 0
+        else:
+            for j in range(nc - 1):
+                wd[nd + j] = wd[nd + j + 1]
+            wd[nd + nc - 1] = 0
 
-def find_optimal_sequence(data, encoding=None):
-    """ Find optimal sequence, i.e. with minimum number of bits to encode data.
 
-    TODO: add support of FLG(n) processing
+@lru_cache(maxsize=None)
+def _rs_generator(nc, gf, pp):
+    """ Get the Reed-Solomon generator polynomial for nc check codewords in GF(gf)
 
-    :param data: string or bytes to encode
-    :param encoding: see :py:class:`AztecCode`
-    :return: optimal sequence
+    :return: read-only ``memoryview`` of the logs of its coefficients, for the
+      check codewords in order (i.e. from degree nc - 1 down to 0), with -1 for zero coefficients
     """
+    log, alog = gf_tables(gf, pp)
+    c = [1] + [0] * nc
+    for i in range(1, nc + 1):
+        c[i] = c[i - 1]
+        for j in range(i - 1, 0, -1):
+            c[j] = c[j - 1] ^ prod(c[j], alog[i], log, alog, gf)
+        c[0] = prod(c[0], alog[i], log, alog, gf)
+    return _read_only(array.array('i', (log[c[nc - j - 1]] if c[nc - j - 1] else -1 for j in range(nc))))
 
-    # standardize encoding name, ensure that it's valid for ECI, and encode string to bytes
-    if encoding:
-        encoding = codecs.lookup(encoding).name
-        eci = encoding_to_eci[encoding]
+
+def _extend_path(node, tokens):
+    """ Append tokens to a sequence path
+
+    A path is ``None`` (empty sequence) or a tuple of
+    ``(parent, tokens, length, last_mode)``, where ``length`` is the total
+    number of tokens and ``last_mode`` is the mode of the last latch or
+    shift token in the sequence. Paths share their prefixes, so extending
+    one is O(1) rather than a copy of the whole sequence.
+    """
+    if not tokens:
+        return node
+    length, last_mode = (node[2], node[3]) if node else (0, None)
+    for t in reversed(tokens):
+        if isinstance(t, (Latch, Shift)):
+            last_mode = t.value
+            break
+    return (node, tokens, length + len(tokens), last_mode)
+
+
+def _path_to_list(node):
+    """ Materialize a sequence path as a list of tokens """
+    chunks = []
+    while node:
+        chunks.append(node[1])
+        node = node[0]
+    return [t for chunk in reversed(chunks) for t in chunk]
+
+
+def _latch_tokens(x, y, back_to_x, started):
+    """ Get the sequence tokens for a change from mode x to mode y
+
+    :param x: mode to change from
+    :param y: mode to change to
+    :param back_to_x: mode to return to after x
+    :param started: whether the sequence for mode x is non-empty
+    :return: (tokens, mode to return to after y) tuple
+    """
+    back_to_y = y
+    if y == Mode.BINARY:
+        # for binary mode use B/S instead of B/L
+        if x in (Mode.PUNCT, Mode.DIGIT):
+            # if changing from punct or digit to binary mode use U/L as intermediate mode
+            # TODO: update for digit
+            return (Latch.UPPER, Shift.BINARY, Misc.SIZE), Mode.UPPER
+        else:
+            return (Shift.BINARY, Misc.SIZE), x
+    elif started:
+        # if changing from punct or digit mode - use U/L as intermediate mode
+        # TODO: update for digit
+        tokens = ()
+        if x == Mode.DIGIT and y == Mode.PUNCT:
+            tokens = (Misc.RESUME, Latch.UPPER, Latch.MIXED, Latch.PUNCT)
+        elif x in (Mode.PUNCT, Mode.DIGIT) and y != Mode.UPPER:
+            tokens = (Misc.RESUME, Latch.UPPER, Latch[y.name])
+        elif x == Mode.LOWER and y == Mode.UPPER:
+            tokens = (Latch.DIGIT, Latch.UPPER)
+        elif x in (Mode.UPPER, Mode.LOWER) and y == Mode.PUNCT:
+            tokens = (Latch.MIXED, Latch[y.name])
+        elif x == Mode.MIXED and y != Mode.UPPER:
+            if y == Mode.PUNCT:
+                tokens = (Latch.PUNCT,)
+                back_to_y = Mode.PUNCT
+            else:
+                tokens = (Latch.UPPER, Latch.DIGIT)
+                back_to_y = Mode.DIGIT
+        elif x == Mode.BINARY:
+            # TODO: review this
+            # Reviewed by jravallec
+            if y == back_to_x:
+                # when return from binary to previous mode, skip mode change
+                tokens = (Misc.RESUME,)
+            elif y == Mode.UPPER:
+                if back_to_x == Mode.LOWER:
+                    tokens = (Misc.RESUME, Latch.DIGIT, Latch.UPPER)
+                if back_to_x == Mode.MIXED:
+                    tokens = (Misc.RESUME, Latch.UPPER)
+            elif y == Mode.LOWER:
+                tokens = (Misc.RESUME, Latch.LOWER)
+            elif y == Mode.MIXED:
+                tokens = (Misc.RESUME, Latch.MIXED)
+            elif y == Mode.PUNCT:
+                if back_to_x == Mode.MIXED:
+                    tokens = (Misc.RESUME, Latch.PUNCT)
+                else:
+                    tokens = (Misc.RESUME, Latch.MIXED, Latch.PUNCT)
+            elif y == Mode.DIGIT:
+                if back_to_x == Mode.MIXED:
+                    tokens = (Misc.RESUME, Latch.UPPER, Latch.DIGIT)
+                else:
+                    tokens = (Misc.RESUME, Latch.DIGIT)
+        else:
+            tokens = (Misc.RESUME, Latch[y.name])
+        return tokens, back_to_y
     else:
-        encoding = 'iso8859-1'
-        eci = None
-    if isinstance(data, str):
-        data = data.encode(encoding)
-
-    back_to = {m: Mode.UPPER for m in Mode}
-    cur_len = {m: 0 if m==Mode.UPPER else E for m in Mode}
-    cur_seq = {m: [] for m in Mode}
+        # if changing from punct or digit mode - use U/L as intermediate mode
+        # TODO: update for digit
+        if x in (Mode.PUNCT, Mode.DIGIT):
+            return (Latch.UPPER, Latch[y.name]), back_to_y
+        elif x == Mode.LOWER and y == Mode.UPPER:
+            return (Latch.DIGIT, Latch.UPPER), back_to_y
+        elif x in (Mode.BINARY, Mode.UPPER, Mode.LOWER) and y == Mode.PUNCT:
+            return (Latch.MIXED, Latch[y.name]), back_to_y
+        else:
+            return (Latch[y.name],), back_to_y
+
+
+# Mode tables indexed by position in Mode, so that the optimisation's inner
+# loops don't need to hash Enum members
+_modes = tuple(Mode)
+_all_modes = range(len(_modes))
+_latch_table = tuple(tuple(latch_len[x][y] for y in _modes) for x in _modes)
+_char_table = tuple(char_size[x] for x in _modes)
+_shift_table = tuple(tuple((yi, shift_len[y, x] + char_size[x]) for yi, y in enumerate(_modes) if (y, x) in shift_len)
+                     for x in _modes)
+_shift_tokens = tuple(Shift[x.name] for x in _modes)
+_possible_modes = tuple(tuple(xi for xi, x in enumerate(_modes) if c in mode_chars[x]) for c in range(256))
+_UPPER, _LOWER, _MIXED, _PUNCT, _DIGIT, _BINARY = _all_modes
+
+
+def _optimal_path(data):
+    """ Run the mode optimisation over bytes, and return the path of the cheapest sequence
+
+    The returned sequence still contains ``Misc.SIZE`` and ``Misc.RESUME``
+    placeholders; see :py:func:`find_optimal_sequence`.
+
+    :param data: bytes to encode
+    :return: sequence path (see :py:func:`_extend_path`)
+    """
+    back_to = [Mode.UPPER] * len(_modes)
+    cur_len = [0 if m==Mode.UPPER else E for m in _modes]
+    cur_seq = [None] * len(_modes)
     prev_c = None
     for c in data:
-        for x in Mode:
-            for y in Mode:
-                if cur_len[x] + latch_len[x][y] < cur_len[y]:
-                    cur_len[y] = cur_len[x] + latch_len[x][y]
-                    cur_seq[y] = cur_seq[x][:]
-                    back_to[y] = y
-                    if y == Mode.BINARY:
-                        # for binary mode use B/S instead of B/L
-                        if x in (Mode.PUNCT, Mode.DIGIT):
-                            # if changing from punct or digit to binary mode use U/L as intermediate mode
-                            # TODO: update for digit
-                            back_to[y] = Mode.UPPER
-                            cur_seq[y] += [Latch.UPPER, Shift.BINARY, Misc.SIZE]
-                        else:
-                            back_to[y] = x
-                            cur_seq[y] += [Shift.BINARY, Misc.SIZE]
-                    elif cur_seq[x]:
-                        # if changing from punct or digit mode - use U/L as intermediate mode
-                        # TODO: update for digit
-                        if x == Mode.DIGIT and y == Mode.PUNCT:
-                            cur_seq[y] += [Misc.RESUME, Latch.UPPER, Latch.MIXED, Latch.PUNCT]
-                        elif x in (Mode.PUNCT, Mode.DIGIT) and y != Mode.UPPER:
-                            cur_seq[y] += [Misc.RESUME, Latch.UPPER, Latch[y.name]]
-                        elif x == Mode.LOWER and y == Mode.UPPER:
-                            cur_seq[y] += [Latch.DIGIT, Latch.UPPER]
-                        elif x in (Mode.UPPER, Mode.LOWER) and y == Mode.PUNCT:
-                            cur_seq[y] += [Latch.MIXED, Latch[y.name]]
-                        elif x == Mode.MIXED and y != Mode.UPPER:
-                            if y == Mode.PUNCT:
-                                cur_seq[y] += [Latch.PUNCT]
-                                back_to[y] = Mode.PUNCT
-                            else:
-                                cur_seq[y] += [Latch.UPPER, Latch.DIGIT]
-                                back_to[y] = Mode.DIGIT
-                            continue
-                        elif x == Mode.BINARY:
-                            # TODO: review this
-                            # Reviewed by jravallec
-                            if y == back_to[x]:
-                                # when return from binary to previous mode, skip mode change
-                                cur_seq[y] += [Misc.RESUME]
-                            elif y == Mode.UPPER:
-                                if back_to[x] == Mode.LOWER:
-                                    cur_seq[y] += [Misc.RESUME, Latch.DIGIT, Latch.UPPER]
-                                if back_to[x] == Mode.MIXED:
-                                    cur_seq[y] += [Misc.RESUME, Latch.UPPER]
-                            elif y == Mode.LOWER:
-                                cur_seq[y] += [Misc.RESUME, Latch.LOWER]
-                            elif y == Mode.MIXED:
-                                cur_seq[y] += [Misc.RESUME, Latch.MIXED]
-                            elif y == Mode.PUNCT:
-                                if back_to[x] == Mode.MIXED:
-                                    cur_seq[y] += [Misc.RESUME, Latch.PUNCT]
-                                else:
-                                    cur_seq[y] += [Misc.RESUME, Latch.MIXED, Latch.PUNCT]
-                            elif y == Mode.DIGIT:
-                                if back_to[x] == Mode.MIXED:
-                                    cur_seq[y] += [Misc.RESUME, Latch.UPPER, Latch.DIGIT]
-                                else:
-                                    cur_seq[y] += [Misc.RESUME, Latch.DIGIT]
-                        else:
-                            cur_seq[y] += [Misc.RESUME, Latch[y.name]]
-                    else:
-                        # if changing from punct or digit mode - use U/L as intermediate mode
-                        # TODO: update for digit
-                        if x in (Mode.PUNCT, Mode.DIGIT):
-                            cur_seq[y] = [Latch.UPPER, Latch[y.name]]
-                        elif x == Mode.LOWER and y == Mode.UPPER:
-                            cur_seq[y] = [Latch.DIGIT, Latch.UPPER]
-                        elif x in (Mode.BINARY, Mode.UPPER, Mode.LOWER) and y == Mode.PUNCT:
-                            cur_seq[y] = [Latch.MIXED, Latch[y.name]]
-                        else:
-                            cur_seq[y] = [Latch[y.name]]
-        next_len = {m:E for m in Mode}
-        next_seq = {m:[] for m in Mode}
-        possible_modes = [m for m in Mode if m == Mode.BINARY or c in code_chars[m]]
-        for x in possible_modes:
+        for xi in _all_modes:
+            x_len = cur_len[xi]
+            latch_row = _latch_table[xi]
+            for yi in _all_modes:
+                if x_len + latch_row[yi] < cur_len[yi]:
+                    cur_len[yi] = x_len + latch_row[yi]
+                    tokens, back_to[yi] = _latch_tokens(_modes[xi], _modes[yi], back_to[xi], cur_seq[xi] is not None)
+                    cur_seq[yi] = _extend_path(cur_seq[xi], tokens)
+        next_len = [E] * len(_modes)
+        next_seq = [None] * len(_modes)
+        for xi in _possible_modes[c]:
             # TODO: review this!
-            if back_to[x] == Mode.DIGIT and x == Mode.LOWER:
-                cur_seq[x] += [Latch.UPPER, Latch.LOWER]
-                cur_len[x] += latch_len[back_to[x]][x]
-                back_to[x] = Mode.LOWER
+            if back_to[xi] == Mode.DIGIT and xi == _LOWER:
+                cur_seq[xi] = _extend_path(cur_seq[xi], (Latch.UPPER, Latch.LOWER))
+                cur_len[xi] += latch_len[Mode.DIGIT][Mode.LOWER]
+                back_to[xi] = Mode.LOWER
             # add char to current sequence
-            if cur_len[x] + char_size[x] < next_len[x]:
-                next_len[x] = cur_len[x] + char_size[x]
-                next_seq[x] = cur_seq[x] + [c]
-            for y in Mode:
-                if (y, x) in shift_len and cur_len[y] + shift_len[(y, x)] + char_size[x] < next_len[y]:
-                    next_len[y] = cur_len[y] + shift_len[y, x] + char_size[x]
-                    next_seq[y] = cur_seq[y] + [Shift[x.name], c]
+            if cur_len[xi] + _char_table[xi] < next_len[xi]:
+                next_len[xi] = cur_len[xi] + _char_table[xi]
+                next_seq[xi] = _extend_path(cur_seq[xi], (c,))
+            for yi, shift_cost in _shift_table[xi]:
+                if cur_len[yi] + shift_cost < next_len[yi]:
+                    next_len[yi] = cur_len[yi] + shift_cost
+                    next_seq[yi] = _extend_path(cur_seq[yi], (_shift_tokens[xi], c))
         # TODO: review this!!!
         if prev_c and bytes((prev_c, c)) in punct_2_chars:
-            for x in Mode:
-                # Will never StopIteration because we must have one S/L already since prev_c is PUNCT
-                last_mode = next(s.value for s in reversed(cur_seq[x]) if isinstance(s, Latch) or isinstance(s, Shift))
-                if last_mode == Mode.PUNCT:
-                    last_c = cur_seq[x][-1]
+            for xi in _all_modes:
+                # We must have one S/L already since prev_c is PUNCT
+                node = cur_seq[xi]
+                if node and node[3] == Mode.PUNCT:
+                    last_c = node[1][-1]
                     if isinstance(last_c, int) and bytes((last_c, c)) in punct_2_chars:
-                        if x != Mode.MIXED:  # we need to avoid this because it contains '\r', '\n' individually, but not combined
-                            if cur_len[x] < next_len[x]:
-                                next_len[x] = cur_len[x]
-                                next_seq[x] = cur_seq[x][:-1] + [ bytes((last_c, c)) ]
-        if len(next_seq[Mode.BINARY]) - 2 == 32:
-            next_len[Mode.BINARY] += 11
-        cur_len = next_len.copy()
-        cur_seq = next_seq.copy()
+                        if xi != _MIXED:  # we need to avoid this because it contains '\r', '\n' individually, but not combined
+                            if cur_len[xi] < next_len[xi]:
+                                next_len[xi] = cur_len[xi]
+                                next_seq[xi] = (node[0], node[1][:-1] + (bytes((last_c, c)),), node[2], node[3])
+        node = next_seq[_BINARY]
+        if node and node[2] - 2 == 32:
+            next_len[_BINARY] += 11
+        cur_len = next_len
+        cur_seq = next_seq
         prev_c = c
-    # sort in ascending order and get shortest sequence
-    result_seq = []
-    sorted_cur_len = sorted(cur_len, key=cur_len.__getitem__)
-    if sorted_cur_len:
-        min_length = sorted_cur_len[0]
-        result_seq = cur_seq[min_length]
+    # get shortest sequence (first mode wins ties)
+    return cur_seq[min(_all_modes, key=cur_len.__getitem__)]
+
+
+_code_sets = MappingProxyType({m: frozenset(chars) for m, chars in code_chars.items()})
+
+
+@lru_cache(maxsize=None)
+def _walk_tokens(tokens, mode):
+    """ Follow the latch and shift tokens of a mode change, as :py:func:`_sequence_fields` would
+
+    :param tokens: tokens from :py:func:`_latch_tokens`
+    :param mode: mode in which the first token is encoded
+    :return: (bits, mode after the tokens, whether every token can be encoded) tuple;
+      a ``Misc.SIZE`` placeholder counts as a 5 bit binary length
+    """
+    bits = 0
+    valid = True
+    for t in tokens:
+        if t == Misc.SIZE:
+            bits += 5
+        elif t != Misc.RESUME:
+            valid = valid and t in _code_sets[mode]
+            bits += char_size[mode]
+            if isinstance(t, Latch):
+                mode = t.value
+    return bits, mode, valid
+
+
+@lru_cache(maxsize=None)
+def _mode_change(xi, yi, back_to_x, started, mode):
+    """ The effect of :py:func:`_latch_tokens` on a state of :py:func:`_optimal_bits`
+
+    :return: (number of tokens, mode of their last latch or shift, last token, mode to return to after y,
+      bits, mode after the tokens, validity) tuple
+    """
+    tokens, back_to_y = _latch_tokens(_modes[xi], _modes[yi], back_to_x, started)
+    last_mode = next((t.value for t in reversed(tokens) if isinstance(t, (Latch, Shift))), None)
+    return (len(tokens), last_mode, tokens[-1] if tokens else None, back_to_y) + _walk_tokens(tokens, mode)
+
+
+# (bits, path length, mode of last latch or shift, last token, current mode,
+#  bytes in the open binary run, started, valid, mode of last token)
+_no_path = (0, 0, None, None, Mode.UPPER, 0, False, True, None)
+
+
+def _optimal_bits(data):
+    """ Count the bits of the optimal sequence for bytes, without building it
+    Raise ValueError if that sequence can't be encoded (see :py:func:`_sequence_fields`)
+
+    Makes the same choices as :py:func:`_optimal_path`, but each mode only keeps
+    what those choices and the final bit count depend on, instead of a path.
+
+    :param data: bytes to encode
+    :return: number of bits
+    """
+    back_to = [Mode.UPPER] * len(_modes)
+    cur_len = [0 if m==Mode.UPPER else E for m in _modes]
+    cur = [_no_path] * len(_modes)
+    prev_c = None
+    for c in data:
+        for xi in _all_modes:
+            x_len = cur_len[xi]
+            if x_len >= E:
+                continue
+            latch_row = _latch_table[xi]
+            for yi in _all_modes:
+                if x_len + latch_row[yi] < cur_len[yi]:
+                    cur_len[yi] = x_len + latch_row[yi]
+                    bits, length, last_mode, _, mode, run, started, valid, _ = cur[xi]
+                    ntokens, t_mode, t_last, back_to[yi], t_bits, mode, t_valid = _mode_change(
+                        xi, yi, back_to[xi], started, mode)
+                    if ntokens:
+                        # an empty binary run would have a length of 0, i.e. a long run
+                        valid = valid and t_valid and (xi != _BINARY or run > 0)
+                        cur[yi] = (bits + t_bits, length + ntokens, t_mode or last_mode, t_last, mode, 0, True, valid, None)
+                    else:
+                        cur[yi] = cur[xi]
+        next_len = [E] * len(_modes)
+        nxt = [_no_path] * len(_modes)
+        for xi in _possible_modes[c]:
+            if back_to[xi] == Mode.DIGIT and xi == _LOWER:
+                bits, length, _, _, mode, run, _, valid, _ = cur[xi]
+                t_bits, mode, t_valid = _walk_tokens((Latch.UPPER, Latch.LOWER), mode)
+                cur[xi] = (bits + t_bits, length + 2, Mode.LOWER, Latch.LOWER, mode, run, True, valid and t_valid, None)
+                cur_len[xi] += latch_len[Mode.DIGIT][Mode.LOWER]
+                back_to[xi] = Mode.LOWER
+            if cur_len[xi] + _char_table[xi] < next_len[xi]:
+                next_len[xi] = cur_len[xi] + _char_table[xi]
+                bits, length, last_mode, _, mode, run, _, valid, _ = cur[xi]
+                if xi == _BINARY:
+                    # binary runs of 32 bytes or more have 11 more length bits
+                    run += 1
+                    bits += 8 if run != 32 else 19
+                    nxt[xi] = (bits, length + 1, last_mode, c, mode, run, True, valid, Mode.BINARY)
+                else:
+                    nxt[xi] = (bits + char_size[mode], length + 1, last_mode, c, mode, run, True,
+                               valid and c in _code_sets[mode], mode)
+            for yi, shift_cost in _shift_table[xi]:
+                if cur_len[yi] + shift_cost < next_len[yi]:
+                    next_len[yi] = cur_len[yi] + shift_cost
+                    bits, length, _, _, mode, run, _, valid, _ = cur[yi]
+                    nxt[yi] = (bits + char_size[mode] + _char_table[xi], length + 2, _modes[xi], c, mode, run, True,
+                               valid and _shift_tokens[xi] in _code_sets[mode], _modes[xi])
+        if prev_c and bytes((prev_c, c)) in punct_2_chars:
+            for xi in _all_modes:
+                bits, length, last_mode, last_c, mode, run, started, valid, last_c_mode = cur[xi]
+                if started and last_mode == Mode.PUNCT:
+                    if isinstance(last_c, int) and bytes((last_c, c)) in punct_2_chars:
+                        if xi != _MIXED:
+                            if cur_len[xi] < next_len[xi]:
+                                next_len[xi] = cur_len[xi]
+                                # the pair replaces the last character, in the same mode
+                                nxt[xi] = (bits, length, last_mode, None, mode, run, started,
+                                           valid and bytes((last_c, c)) in _code_sets[last_c_mode], last_c_mode)
+        if nxt[_BINARY][1] - 2 == 32:
+            next_len[_BINARY] += 11
+        cur_len = next_len
+        cur = nxt
+        prev_c = c
+    bits, *_, valid, _ = cur[min(_all_modes, key=cur_len.__getitem__)]
+    if not valid:
+        raise ValueError('Optimal sequence cannot be encoded')
+    return bits
+
+
+def find_optimal_sequence(data, encoding=None, strategy='optimal'):
+    """ Find optimal sequence, i.e. with minimum number of bits to encode data.
+
+    TODO: add support of FLG(n) processing
+
+    :param data: string, bytes or other buffer (bytearray, memoryview, mmap, ...) to encode
+    :param encoding: see :py:class:`AztecCode`
+    :param strategy: see :py:class:`AztecCode`
+    :return: optimal sequence
+    """
+
+    bytes_sequence = _strategy(strategy)
+    if _is_auto(encoding):
+        return select_encoding(data, encoding, strategy=strategy)[1]
+
+    # standardize encoding name, ensure that it's valid for ECI, and encode string to bytes
+    (_, raw, eci), = _encoded_candidates(data, encoding)
+    return _with_eci(bytes_sequence(raw), eci)
+
+
+def _is_auto(encoding):
+    """ Whether encoding asks for the encoding to be chosen (see :py:func:`select_encoding`) """
+    return encoding == 'auto' or isinstance(encoding, (list, tuple))
+
+
+def _byte_view(data):
+    """ Get bytes-like data as bytes or a flat memoryview of unsigned bytes, without copying it """
+    return data if isinstance(data, bytes) else memoryview(data).cast('B')
+
+
+def _strategy(strategy):
+    """ Get the function finding a sequence for bytes with a strategy ('optimal' or 'fast') """
+    try:
+        return _strategies[strategy]
+    except KeyError:
+        raise ValueError("Unknown strategy %r (expected 'optimal' or 'fast')" % (strategy,)) from None
+
+
+def _eci_bits(eci):
+    """ Number of bits of the ECI mark added by :py:func:`_with_eci` """
+    return 0 if eci is None else 13 + 4 * len(str(eci))
+
+
+def _with_eci(sequence, eci):
+    """ Prefix an optimal sequence with an ECI mark, unless eci is None """
+    if eci is None:
+        return sequence
+    return [ Shift.PUNCT, Misc.FLG, len(str(eci)), eci ] + sequence
+
+
+def _bytes_sequence(data):
+    """ Find optimal sequence for bytes, without any ECI mark
+
+    :param data: bytes to encode
+    :return: optimal sequence
+    """
+    result_seq = _path_to_list(_optimal_path(data))
     # update binary sequences' sizes
     sizes = {}
     result_seq_len = len(result_seq)
@@ -381,27 +671,166 @@ def find_optimal_sequence(data, encoding=None):
         if c == Shift.BINARY:
             is_binary_length = True
 
-    if eci is not None:
-        updated_result_seq = [ Shift.PUNCT, Misc.FLG, len(str(eci)), eci ] + updated_result_seq
-
     return updated_result_seq
 
 
-def optimal_sequence_to_bits(optimal_sequence):
-    """ Convert optimal sequence to bits
+def _binary_bits(n):
+    """ Number of bits to encode n bytes in binary shifts from UPPER mode """
+    shifts, last = divmod(n, 2078)
+    return 8 * n + 21 * shifts + (0 if not last else 10 if last <= 31 else 21)
+
+
+def _binary_sequence(data):
+    """ Sequence encoding bytes entirely in binary shifts (of at most 2078 bytes each) from UPPER mode """
+    sequence = []
+    for pos in range(0, len(data), 2078):
+        chunk = data[pos:pos + 2078]
+        sequence.append(Shift.BINARY)
+        sequence += [len(chunk)] if len(chunk) <= 31 else [0, len(chunk) - 31]
+        sequence += chunk
+    return sequence
+
+
+def _shortest_latches():
+    """ Shortest sequences of latch tokens between the text modes, found from the latches in code_chars """
+    paths = {}
+    for x in _modes[:-1]:
+        best = {x: (0, ())}
+        changed = True
+        while changed:
+            changed = False
+            for mode, (cost, tokens) in list(best.items()):
+                for t in code_chars[mode]:
+                    if isinstance(t, Latch) and (t.value not in best or cost + char_size[mode] < best[t.value][0]):
+                        best[t.value] = (cost + char_size[mode], tokens + (t,))
+                        changed = True
+        for y, path in best.items():
+            paths[x, y] = path
+    return MappingProxyType(paths)
+
+
+# (cost in bits, latch tokens) from each text mode to each other one
+_latch_paths = _shortest_latches()
+_single_mode_prefixes = tuple((re.compile(b'[%s]*' % re.escape(bytes(sorted(mode_chars[mode])))), prefix)
+                              for mode, prefix in ((Mode.UPPER, []), (Mode.DIGIT, [Latch.DIGIT]), (Mode.LOWER, [Latch.LOWER])))
+_text_possible_modes = tuple(tuple(_modes[xi] for xi in modes if xi != _BINARY) for modes in _possible_modes)
+_greedy_lookahead = 16
+
+
+def _fast_sequence(data):
+    """ Find a short (but not necessarily optimal) sequence for bytes, in a single pass
+
+    Payloads which fit in the UPPER, DIGIT or LOWER mode, and payloads with many
+    bytes which only binary shifts can encode, are encoded directly; others are
+    encoded greedily by :py:func:`_greedy_sequence`.
+
+    :param data: bytes (or memoryview) to encode
+    :return: sequence
+    """
+    for pattern, prefix in _single_mode_prefixes:
+        if pattern.fullmatch(data):
+            return prefix + list(data)
+    if 4 * _byte_classes_of(data).count('3') >= len(data):
+        return _binary_sequence(data)
+    return _greedy_sequence(data)
+
+
+def _greedy_sequence(data):
+    """ Encode bytes greedily: stay in the current mode while possible, and otherwise
+    shift for a single character or latch to the mode which encodes the most of the
+    following characters; put runs of characters which no text mode (or not the
+    current one) encodes in binary shifts
+
+    Never longer than encoding everything in binary.
+
+    :param data: bytes to encode
+    :return: sequence
+    """
+    sequence = []
+    bits = 0
+    mode = Mode.UPPER
+    n = len(data)
+    ii = 0
+    while ii < n:
+        c = data[ii]
+        pair = bytes((c, data[ii + 1])) if ii + 1 < n else None
+        if pair not in punct_2_chars:
+            pair = None
+        if pair and mode == Mode.PUNCT:
+            sequence.append(pair)
+            bits += char_size[mode]
+            ii += 2
+            continue
+        if c in mode_chars[mode]:
+            sequence.append(c)
+            bits += char_size[mode]
+            ii += 1
+            continue
+
+        candidates = (Mode.PUNCT,) if pair else _text_possible_modes[c]
+        if not candidates:
+            # binary shifts can't start in PUNCT or DIGIT
+            if mode in (Mode.PUNCT, Mode.DIGIT):
+                sequence += _latch_paths[mode, Mode.UPPER][1]
+                bits += _latch_paths[mode, Mode.UPPER][0]
+                mode = Mode.UPPER
+            # end the run where it becomes cheaper to encode the following characters in the current mode
+            chars = mode_chars[mode]
+            end = ii + 1
+            while end < n and not all(c in chars for c in data[end:end + 4]):
+                end += 1
+            for pos in range(ii, end, 2078):
+                chunk = data[pos:min(end, pos + 2078)]
+                sequence.append(Shift.BINARY)
+                sequence += [len(chunk)] if len(chunk) <= 31 else [0, len(chunk) - 31]
+                sequence += chunk
+                bits += char_size[mode] + (5 if len(chunk) <= 31 else 16) + 8 * len(chunk)
+            ii = end
+            continue
+
+        def run(target):
+            chars = mode_chars[target]
+            end = ii
+            while end < min(n, ii + _greedy_lookahead) and data[end] in chars:
+                end += 1
+            return end - ii
+        target = max(candidates, key=lambda m: (run(m), -_latch_paths[mode, m][0]))
+        token = pair or c
+        length = 1 if pair else run(target)
+        # shift for each character of the run if that is cheaper than latching there
+        # (and, from PUNCT, back to UPPER)
+        latch_cost = _latch_paths[mode, target][0] + (5 if target == Mode.PUNCT else 0)
+        if (mode, target) in shift_len and length * shift_len[mode, target] <= latch_cost:
+            sequence += (Shift[target.name], token)
+            bits += shift_len[mode, target] + char_size[target]
+        else:
+            cost, latches = _latch_paths[mode, target]
+            sequence += latches
+            sequence.append(token)
+            bits += cost + char_size[target]
+            mode = target
+        ii += 2 if pair else 1
+
+    if bits > _binary_bits(n):
+        return _binary_sequence(data)
+    return sequence
+
+
+_strategies = MappingProxyType({'optimal': _bytes_sequence, 'fast': _fast_sequence})
+
+
+def _sequence_fields(optimal_sequence):
+    """ Generate the bit fields of an optimal sequence
 
     :param optimal_sequence: input optimal sequence
-    :return: string with bits
+    :return: iterator of (value, bit width) tuples
     """
-    out_bits = ''
     mode = prev_mode = Mode.UPPER
     shift = False
-    sequence = optimal_sequence[:]
-    while sequence:
-        # read one item from sequence
-        ch = sequence.pop(0)
+    sequence = iter(optimal_sequence)
+    for ch in sequence:
         index = code_chars[mode].index(ch)
-        out_bits += bin(index)[2:].zfill(char_size[mode])
+        yield index, char_size[mode]
         # resume previous mode for shift
         if shift:
             mode = prev_mode
@@ -411,50 +840,70 @@ def optimal_sequence_to_bits(optimal_sequence):
             mode = ch.value
         # handle FLG(n)
         elif ch == Misc.FLG:
-            if not sequence:
+            flg_n = next(sequence, None)
+            if flg_n is None:
                 raise Exception('Expected FLG(n) value')
-            flg_n = sequence.pop(0)
             if not isinstance(flg_n, numbers.Number) or not 0 <= flg_n <= 7:
                 raise Exception('FLG(n) value must be a number from 0 to 7')
             if flg_n == 7:
                 raise Exception('FLG(7) is reserved and currently illegal')
 
-            out_bits += bin(flg_n)[2:].zfill(3)
+            yield flg_n, 3
             if flg_n >= 1:
                 # ECI
-                if not sequence:
+                eci_code = next(sequence, None)
+                if eci_code is None:
                     raise Exception('Expected FLG({}) to be followed by ECI code'.format(flg_n))
-                eci_code = sequence.pop(0)
                 if not isinstance(eci_code, numbers.Number) or not 0 <= eci_code < (10**flg_n):
                     raise Exception('Expected FLG({}) ECI code to be a number from 0 to {}'.format(flg_n, (10**flg_n) - 1))
                 out_digits = str(eci_code).zfill(flg_n).encode()
                 for ch in out_digits:
                     index = code_chars[Mode.DIGIT].index(ch)
-                    out_bits += bin(index)[2:].zfill(char_size[Mode.DIGIT])
+                    yield index, char_size[Mode.DIGIT]
         # handle binary run
         elif ch == Shift.BINARY:
-            if not sequence:
-                raise Exception('Expected binary sequence length')
             # followed by a 5 bit length
-            seq_len = sequence.pop(0)
+            seq_len = next(sequence, None)
+            if seq_len is None:
+                raise Exception('Expected binary sequence length')
             if not isinstance(seq_len, numbers.Number):
                 raise Exception('Binary sequence length must be a number')
-            out_bits += bin(seq_len)[2:].zfill(5)
+            yield seq_len, 5
             # if length is zero - 11 additional length bits are used for length
             if not seq_len:
-                seq_len = sequence.pop(0)
+                seq_len = next(sequence)
                 if not isinstance(seq_len, numbers.Number):
                     raise Exception('Binary sequence length must be a number')
-                out_bits += bin(seq_len)[2:].zfill(11)
+                yield seq_len, 11
                 seq_len += 31
             for binary_index in range(seq_len):
-                ch = sequence.pop(0)
-                out_bits += bin(ch)[2:].zfill(char_size[Mode.BINARY])
+                yield next(sequence), char_size[Mode.BINARY]
         # handle other shift
         elif isinstance(ch, Shift):
             mode, prev_mode = ch.value, mode
             shift = True
-    return out_bits
+
+
+def optimal_sequence_to_bits(optimal_sequence):
+    """ Convert optimal sequence to bits
+
+    :param optimal_sequence: input optimal sequence
+    :return: string with bits
+    """
+    return ''.join(bin(value)[2:].zfill(width) for value, width in _sequence_fields(optimal_sequence))
+
+
+def _sequence_to_int(optimal_sequence):
+    """ Convert optimal sequence to bits packed into an integer
+
+    :param optimal_sequence: input optimal sequence
+    :return: (value, number of bits) tuple, with the first bit as the most significant
+    """
+    value = nbits = 0
+    for field, width in _sequence_fields(optimal_sequence):
+        value = (value << width) | field
+        nbits += width
+    return value, nbits
 
 
 def get_data_codewords(bits, codeword_size):
@@ -490,67 +939,1026 @@ def get_data_codewords(bits, codeword_size):
     return codewords
 
 
-def find_suitable_matrix_size(data, ec_percent=23, encoding=None):
+def count_data_codewords(value, nbits, codeword_size):
+    """ Count the data codewords that :py:func:`get_data_codewords` would produce
+
+    Works on bits packed into an integer, without building any strings.
+
+    :param value: input data bits, packed into an integer (first bit most significant)
+    :param nbits: number of input data bits
+    :param codeword_size: codeword size in bits
+    :return: number of data codewords, including stuffed bits and padding
+    """
+    k = codeword_size - 1
+    mask = (1 << k) - 1
+    count = pos = 0
+    while pos < nbits:
+        count += 1
+        remaining = nbits - pos
+        if remaining < k:
+            # padded final codeword
+            break
+        head = (value >> (remaining - k)) & mask
+        if head == 0 or head == mask:
+            # stuffed bit completes the codeword
+            pos += k
+        elif remaining == k:
+            # padded final codeword
+            break
+        else:
+            pos += codeword_size
+    return count
+
+
+SymbolEstimate = namedtuple('SymbolEstimate', ('size', 'compact', 'bits', 'spare_codewords'))
+
+
+def _fits(data_cw_count, compact, config, ec_percent):
+    """ Whether data codewords fit in a symbol with the given percentage of error correction """
+    if data_cw_count > max_data_codewords[compact]:
+        return False
+    # calculate minimum required number of codewords to reach
+    # the desired level of error-correction
+    required_cw_count = (data_cw_count + 3) * 100.0 / (100 - ec_percent)
+    return required_cw_count < config.codewords
+
+
+class DataTooBigError(Exception):
+    """ Data too big to fit in an Aztec code
+
+    :ivar bits: number of data bits needed (a lower bound, if the data wasn't encoded)
+    :ivar capacity: number of data bits that fit in the largest (or the given) symbol, without stuffing
+    """
+
+    def __init__(self, message, bits=None, capacity=None):
+        super().__init__(message)
+        self.bits, self.capacity = bits, capacity
+
+
+@lru_cache(maxsize=128)
+def _capacities(ec_percent):
+    """ The maximum number of data codewords in each symbol with the given percentage of error correction
+
+    :return: tuple of ((size, compact), cw_bits, maximum data codewords) in the order of :py:data:`configs`
+    """
+    result = []
+    for (size, compact), config in configs.items():
+        max_cw_count = min(max_data_codewords[compact], max(0, math.ceil(config.codewords * (100 - ec_percent) / 100.0) - 3))
+        while max_cw_count and not _fits(max_cw_count, compact, config, ec_percent):
+            max_cw_count -= 1
+        result.append(((size, compact), config.cw_bits, max_cw_count))
+    return tuple(result)
+
+
+def _max_capacity(ec_percent):
+    return max(cw_bits * max_cw_count for _, cw_bits, max_cw_count in _capacities(ec_percent))
+
+
+def _smallest_symbol(value, nbits, ec_percent, data_cw_counts):
+    """ Find the smallest symbol for an optimal sequence
+
+    Stuffed data codewords are only counted once per codeword size.
+
+    :param value: optimal sequence bits, packed into an integer (see :py:func:`_sequence_to_int`)
+    :param nbits: number of optimal sequence bits
+    :param ec_percent: percentage of symbol capacity for error correction
+    :param data_cw_counts: dict caching the number of data codewords by codeword size, filled in as needed
+    :return: :py:class:`SymbolEstimate`
+    """
+    for (size, compact), config in configs.items():
+        # calculate data codewords
+        data_cw_count = data_cw_counts.get(config.cw_bits)
+        if data_cw_count is None:
+            data_cw_count = data_cw_counts[config.cw_bits] = count_data_codewords(value, nbits, config.cw_bits)
+
+        # if they fit in this size symbol, we're done
+        if _fits(data_cw_count, compact, config, ec_percent):
+            spare = max(0, math.ceil(config.codewords * (100 - ec_percent) / 100.0) - 4 - data_cw_count)
+            while spare and not _fits(data_cw_count + spare, compact, config, ec_percent):
+                spare -= 1
+            while _fits(data_cw_count + spare + 1, compact, config, ec_percent):
+                spare += 1
+            return SymbolEstimate(size, compact, nbits, spare)
+    raise DataTooBigError('Data too big to fit in one Aztec code!', nbits, _max_capacity(ec_percent))
+
+
+Admission = namedtuple('Admission', ('min_bits', 'max_bits', 'min_symbol', 'max_symbol'))
+
+# lower bound on the cost of each byte, in half bits: 2.5 bits for characters of PUNCT pairs,
+# 4 for other DIGIT characters, 5 for other characters of any mode but BINARY, and 8 for the rest
+_min_half_bits = (5, 8, 10, 16)
+_byte_classes = ''.join(
+    '0' if c in b'\r\n.,: ' else '1' if c in mode_chars[Mode.DIGIT] else '2' if any(c in mode_chars[m] for m in _modes[:-1]) else '3'
+    for c in range(256))
+
+
+def _byte_classes_of(data):
+    """ Classify bytes (see :py:data:`_min_half_bits`) into a string of '0' to '3', reading any buffer in place """
+    return codecs.charmap_decode(data, 'strict', _byte_classes)[0]
+
+
+def _max_sequence_bits(n):
+    """ Upper bound on the number of bits of the sequence for n bytes, with either strategy
+
+    The mode optimisation never counts more than encoding everything in one
+    binary shift (8n + 10 bits, and 11 more from 32 bytes on). It doesn't
+    count returning from a binary shift to a text mode, which takes up to 10
+    bits and happens at most once for every two bytes, nor the 11 extra length
+    bits of binary runs of 32 bytes or more, of which there are at most n / 32.
+    The fast strategy never exceeds :py:func:`_binary_bits`, which is lower.
+    """
+    return 8 * n + 21 + 10 * (n // 2) + 11 * (n // 32)
+
+
+def _bits_bounds(data, eci):
+    """ Bounds on the number of bits of the sequence for bytes, in O(n)
+
+    The upper bound is :py:func:`_max_sequence_bits`.
+    """
+    eci_bits = _eci_bits(eci)
+    classes = _byte_classes_of(data)
+    min_half_bits = sum(half_bits * classes.count(str(cls)) for cls, half_bits in enumerate(_min_half_bits))
+    return eci_bits + (min_half_bits + 1) // 2, eci_bits + _max_sequence_bits(len(data))
+
+
+def _encoded_candidates(data, encoding):
+    """ Encode data once in each candidate encoding which can represent it
+
+    Strings are encoded (once per distinct encoding); bytes-like data is used in place.
+
+    :return: list of (encoding name or None, bytes or memoryview, ECI or None)
+    """
+    auto = _is_auto(encoding)
+    candidates = ((None,) + tuple(encoding_to_eci)) if encoding == 'auto' else encoding if auto else (encoding,)
+    if not isinstance(data, str):
+        data = _byte_view(data)
+    result = []
+    for candidate in candidates:
+        candidate = candidate and codecs.lookup(candidate).name
+        eci = None if candidate is None else encoding_to_eci[candidate]
+        try:
+            result.append((candidate, data.encode(candidate or 'iso8859-1') if isinstance(data, str) else data, eci))
+        except UnicodeEncodeError:
+            if not auto:
+                raise
+    return result
+
+
+def check_admission(data, ec_percent=23, encoding=None, max_bytes=None):
+    """ Cheaply check whether data can fit in an Aztec code, without optimizing its encoding
+    Raise :py:class:`DataTooBigError` if it certainly cannot, or if it is longer than max_bytes
+
+    The number of bits is bounded in O(n), from the best case for each byte
+    (2.5 bits for PUNCT pairs, 4 for digits, 5 for other characters of the
+    text modes, and 8 for others) and the worst case of the mode optimisation
+    (encoding everything in binary, plus the mode changes it doesn't count).
+
+    :param data: string or bytes-like data to encode
+    :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+    :param encoding: see :py:class:`AztecCode`
+    :param max_bytes: if set, the maximum length of the encoded data in bytes
+    :return: :py:class:`Admission` with bounds on the number of data bits, the smallest
+      (size, compact) symbol the data might fit in, and the smallest one it certainly
+      fits in (or None if that can't be known without encoding it)
+    """
+    return _admission(_encoded_candidates(data, encoding), ec_percent, max_bytes)
+
+
+def _admission(candidates, ec_percent=23, max_bytes=None):
+    """ See :py:func:`check_admission`; candidates from :py:func:`_encoded_candidates` """
+    bounds = []
+    lengths = []
+    for _, raw, eci in candidates:
+        lengths.append(len(raw))
+        if max_bytes is None or len(raw) <= max_bytes:
+            bounds.append(_bits_bounds(raw, eci))
+    if not lengths:
+        raise ValueError('None of the candidate encodings can represent the data')
+    if not bounds:
+        raise DataTooBigError('Data is longer than %d bytes' % max_bytes, None, 8 * max_bytes)
+    min_bits = min(low for low, high in bounds)
+    max_bits = min(high for low, high in bounds)
+
+    min_symbol = max_symbol = None
+    for key, cw_bits, max_cw_count in _capacities(ec_percent):
+        if min_symbol is None and -(-min_bits // cw_bits) <= max_cw_count:
+            min_symbol = key
+        # every data codeword holds at least cw_bits - 1 bits
+        if -(-max_bits // (cw_bits - 1)) <= max_cw_count:
+            max_symbol = key
+            break
+    if min_symbol is None:
+        raise DataTooBigError('Data too big to fit in one Aztec code! (at least %d bits)' % min_bits,
+                              min_bits, _max_capacity(ec_percent))
+    return Admission(min_bits, max_bits, min_symbol, max_symbol)
+
+
+_config_order = MappingProxyType({key: ii for ii, key in enumerate(configs)})
+
+
+def select_encoding(data, candidates='auto', ec_percent=23, strategy='optimal'):
+    """ Choose the encoding which gives the smallest symbol (and then the fewest bits)
+
+    Candidates which cannot represent the string are skipped. Candidates which
+    encode it to the same bytes share a single mode optimisation, and differ
+    only in their ECI marks.
+
+    :param data: string or bytes-like data to encode
+    :param candidates: sequence of encodings (see :py:data:`encoding_to_eci`; None for no ECI mark,
+      i.e. ISO-8859-1), or 'auto' for no ECI mark and every encoding in :py:data:`encoding_to_eci`
+    :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+    :param strategy: see :py:class:`AztecCode`
+    :return: (encoding, optimal sequence) tuple
+    """
+    return _select(_encoded_candidates(data, candidates if _is_auto(candidates) else list(candidates)),
+                   ec_percent, _strategy(strategy))
+
+
+def _select(candidates, ec_percent, bytes_sequence):
+    """ See :py:func:`select_encoding`; candidates from :py:func:`_encoded_candidates` """
+    sequences = {}
+    best = None
+    for encoding, raw, eci in candidates:
+        # bytes-like data is the same for every candidate
+        key = raw if isinstance(raw, bytes) else None
+        if key not in sequences:
+            sequences[key] = bytes_sequence(raw)
+        sequence = _with_eci(sequences[key], eci)
+
+        value, nbits = _sequence_to_int(sequence)
+        try:
+            estimate = _smallest_symbol(value, nbits, ec_percent, {})
+            rank = (_config_order[estimate.size, estimate.compact], nbits)
+        except DataTooBigError:
+            rank = (len(configs), nbits)
+        if best is None or rank < best[0]:
+            best = rank, encoding, sequence
+    if best is None:
+        raise ValueError('None of the candidate encodings can represent the data')
+    return best[1:]
+
+
+def _any_sequence(data, encoding, ec_percent, strategy='optimal'):
+    """ Find optimal sequence, selecting the encoding for the smallest symbol if encoding is 'auto' or a list
+
+    Rejects data which certainly cannot fit before optimizing it (see :py:func:`check_admission`).
+    """
+    return _planned_sequence(data, encoding, ec_percent, strategy, True)[1]
+
+
+def _planned_sequence(data, encoding, ec_percent, strategy, admit):
+    """ Encode data once, optionally check its admission, and find its sequence
+
+    :return: (encoding, sequence) tuple; encoding is the chosen one if it was 'auto' or a list
+    """
+    bytes_sequence = _strategy(strategy)
+    candidates = _encoded_candidates(data, encoding)
+    if admit:
+        _admission(candidates, ec_percent)
+    if _is_auto(encoding):
+        return _select(candidates, ec_percent, bytes_sequence)
+    (_, raw, eci), = candidates
+    return encoding, _with_eci(bytes_sequence(raw), eci)
+
+
+def estimate_symbol(data, ec_percent=23, encoding=None, strategy='optimal'):
+    """ Find the symbol needed to encode data, building it only if necessary
+    Raise an exception if suitable size is not found, or if data is empty
+
+    The number of data bits is counted exactly, but without the sequence
+    (see :py:func:`_optimal_bits`), so bit stuffing isn't known. If the
+    smallest symbol the bits fit in without any stuffed bit is also the
+    smallest one they fit in with a stuffed bit in every codeword, that's the
+    symbol. Otherwise the sequence is built and its stuffed codewords are
+    counted, as with ``strategy='fast'``, whose sequence is cheap to build.
+    Either way the symbol is the one :py:func:`find_suitable_matrix_size` finds.
+
+    :param data: string or bytes-like data to encode
+    :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+    :param encoding: see :py:class:`AztecCode`
+    :param strategy: see :py:class:`AztecCode`
+    :return: :py:class:`SymbolEstimate` with the symbol size and compactness,
+      the number of data bits, and the number of additional data codewords
+      that would still fit at the same error correction level (exact if the
+      sequence was built, and otherwise the number that would fit even if
+      every codeword had a stuffed bit)
+    """
+    if strategy == 'optimal':
+        estimate = _bounded_symbol(_encoded_candidates(data, encoding), ec_percent)
+        if estimate is not None:
+            return estimate
+    value, nbits = _sequence_to_int(_any_sequence(data, encoding, ec_percent, strategy))
+    return _smallest_symbol(value, nbits, ec_percent, {})
+
+
+def _bounded_symbol(candidates, ec_percent):
+    """ Find the smallest symbol from the bounds on the number of data codewords of each candidate
+
+    :param candidates: candidates from :py:func:`_encoded_candidates`
+    :return: :py:class:`SymbolEstimate`, or None if stuffed bits might change the symbol
+      (or the candidate whose symbol is smallest)
+    """
+    _admission(candidates, ec_percent)
+    counts = {}
+    best = None
+    for _, raw, eci in candidates:
+        # bytes-like data is the same for every candidate
+        key = raw if isinstance(raw, bytes) else None
+        if key not in counts:
+            counts[key] = _optimal_bits(raw)
+        nbits = _eci_bits(eci) + counts[key]
+        if not nbits:
+            # the mode message can't encode an empty symbol
+            raise ValueError('Cannot encode empty data')
+        low = estimate = None
+        for rank, ((size, compact), cw_bits, max_cw_count) in enumerate(_capacities(ec_percent)):
+            # every data codeword holds at most cw_bits data bits, and all but the last at least cw_bits - 1
+            if low is None and -(-nbits // cw_bits) <= max_cw_count:
+                low = rank
+            most_cw_count = -(-nbits // (cw_bits - 1))
+            if most_cw_count <= max_cw_count:
+                estimate = SymbolEstimate(size, compact, nbits, max_cw_count - most_cw_count)
+                break
+        if low is None:
+            # too big for any symbol, unless another candidate fits
+            continue
+        if estimate is None or low != rank:
+            return None
+        if best is None or (rank, nbits) < best[0]:
+            best = (rank, nbits), estimate
+    return best and best[1]
+
+
+class FeasibilityTable(object):
+    """
+    Error correction capacity of every symbol size for some data
+
+    The optimal sequence and the number of data codewords for each codeword
+    size are computed once, so that trading error correction against symbol
+    size costs no further encoding.
+    """
+
+    def __init__(self, data, encoding=None, strategy='optimal'):
+        """ Compute the table for data
+
+        :param data: string or bytes-like data to encode
+        :param encoding: see :py:class:`AztecCode`
+        :param strategy: see :py:class:`AztecCode`
+        """
+        self.sequence = find_optimal_sequence(data, encoding, strategy)
+        self._value, self.bits = _sequence_to_int(self.sequence)
+        self.data_cw_counts = {}
+        for cw_bits in sorted({config.cw_bits for config in configs.values()}):
+            self.data_cw_counts[cw_bits] = count_data_codewords(self._value, self.bits, cw_bits)
+
+    def max_ec_percent(self, size, compact):
+        """ Maximum whole percentage of error correction for the data in a symbol
+
+        :param size: size of matrix
+        :param compact: compactness flag
+        :return: percentage of symbol capacity for error correction, or None if the data doesn't fit at all
+        """
+        config = configs[(size, compact)]
+        data_cw_count = self.data_cw_counts[config.cw_bits]
+        if data_cw_count > max_data_codewords[compact]:
+            return None
+        # largest ec_percent with (data_cw_count + 3) * 100 < codewords * (100 - ec_percent)
+        ec_percent = (100 * (config.codewords - data_cw_count - 3) - 1) // config.codewords
+        return ec_percent if ec_percent >= 0 else None
+
+    def max_ec_percents(self):
+        """ Maximum whole percentage of error correction for the data in every symbol
+
+        :return: dict mapping each (size, compact) in :py:data:`configs` to the percentage, or None
+        """
+        return {key: self.max_ec_percent(*key) for key in configs}
+
+    def smallest_symbol(self, ec_percent=23):
+        """ Find the smallest symbol for the data
+        Raise an exception if suitable size is not found
+
+        Agrees with :py:func:`find_suitable_matrix_size` and :py:func:`estimate_symbol`.
+
+        :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+        :return: :py:class:`SymbolEstimate`
+        """
+        return _smallest_symbol(self._value, self.bits, ec_percent, self.data_cw_counts)
+
+    def smallest_symbols(self, ec_percents):
+        """ Find the smallest symbol for the data at each of several error correction levels
+
+        :param ec_percents: iterable of percentages of symbol capacity for error correction
+        :return: dict mapping each percentage to a :py:class:`SymbolEstimate`, or None if the data doesn't fit
+        """
+        result = {}
+        for ec_percent in ec_percents:
+            try:
+                result[ec_percent] = self.smallest_symbol(ec_percent)
+            except DataTooBigError:
+                result[ec_percent] = None
+        return result
+
+
+def find_suitable_matrix_size(data, ec_percent=23, encoding=None, strategy='optimal'):
     """ Find suitable matrix size
     Raise an exception if suitable size is not found
 
-    :param data: string or bytes to encode
+    :param data: string or bytes-like data to encode
     :param ec_percent: percentage of symbol capacity for error correction (default 23%)
     :param encoding: see :py:class:`AztecCode`
+    :param strategy: see :py:class:`AztecCode`
     :return: (size, compact) tuple
     """
-    optimal_sequence = find_optimal_sequence(data, encoding)
+    optimal_sequence = _any_sequence(data, encoding, ec_percent, strategy)
+    value, nbits = _sequence_to_int(optimal_sequence)
+    size, compact, _, _ = _smallest_symbol(value, nbits, ec_percent, {})
+    return size, compact, optimal_sequence
+
+
+def get_codewords(optimal_sequence, size, compact):
+    """ Get all codewords of a symbol: data codewords followed by Reed-Solomon check codewords
+    Raise an exception if the data doesn't fit
+
+    :param optimal_sequence: input optimal sequence
+    :param size: size of matrix
+    :param compact: compactness flag
+    :return: (codewords, number of data codewords) tuple
+    """
+    config = configs[(size, compact)]
+    cw_count = config.codewords
+    cw_bits = config.cw_bits
+    data_codewords = _fitting_data_codewords(optimal_sequence, size, compact)
+    data_cw_count = len(data_codewords)
+
+    # add Reed-Solomon codewords to init data codewords
+    codewords = (data_codewords + [0] * (cw_count - data_cw_count))[:cw_count]
+    reed_solomon(codewords, data_cw_count, cw_count - data_cw_count, 2 ** cw_bits, polynomials[cw_bits])
+    return codewords, data_cw_count
+
+
+def _fitting_data_codewords(optimal_sequence, size, compact):
+    """ Get the data codewords of a sequence, ensuring that they fit in a symbol """
     out_bits = optimal_sequence_to_bits(optimal_sequence)
-    for (size, compact), config in configs.items():
-        # calculate data codewords
-        data_codewords = get_data_codewords(out_bits, config.cw_bits)
-        data_cw_count = len(data_codewords)
+    config = configs[(size, compact)]
+    data_codewords = get_data_codewords(out_bits, config.cw_bits)
+    capacity = min(config.codewords, max_data_codewords[compact])
+    if len(data_codewords) > capacity:
+        raise DataTooBigError('Data too big to fit in Aztec code with current size!',
+                              len(out_bits), config.cw_bits * capacity)
+    return data_codewords
 
-        # calculate minimum required number of codewords to reach
-        # the desired level of error-correction
-        required_cw_count = (data_cw_count + 3) * 100.0 / (100 - ec_percent)
 
-        # if they fit in this size symbol, we're done
-        if required_cw_count < config.codewords:
-            return size, compact, optimal_sequence
-    raise Exception('Data too big to fit in one Aztec code!')
+class Plan(namedtuple('Plan', ('sequence', 'size', 'compact', 'ec_percent', 'encoding'))):
+    """
+    First stage of encoding: the sequence for some data, and the symbol to place it in
+
+    Plans (like the :py:class:`SymbolCodewords` computed from them) are immutable,
+    hashable and picklable, so they can be cached, or computed in one process and
+    placed in another.
+    """
+    __slots__ = ()
+
+    def bits(self):
+        """ Get the data bits, as a string of '0' and '1' """
+        return optimal_sequence_to_bits(self.sequence)
+
+    def codewords(self):
+        """ Get the data codewords (with bit stuffing and padding)
+        Raise :py:class:`DataTooBigError` if they don't fit in the symbol
+
+        :return: tuple of codewords
+        """
+        return tuple(_fitting_data_codewords(self.sequence, self.size, self.compact))
+
+    def with_ec(self):
+        """ Get all codewords of the symbol, completed with Reed-Solomon check codewords
+
+        :return: :py:class:`SymbolCodewords`
+        """
+        codewords, data_cw_count = get_codewords(self.sequence, self.size, self.compact)
+        return SymbolCodewords(self.size, self.compact, tuple(codewords), data_cw_count)
+
+
+_codewords_header = struct.Struct('<BBH')  # size, compact, number of data codewords
+
+
+class SymbolCodewords(namedtuple('SymbolCodewords', ('size', 'compact', 'codewords', 'data_cw_count'))):
+    """
+    Second stage of encoding: all codewords of a symbol, ready to be placed
+    with :py:meth:`AztecCode.from_codewords`
+    """
+    __slots__ = ()
+
+    def to_bytes(self):
+        """ Pack into bytes: a 4-byte header, then the codewords bit-packed at the symbol's codeword size """
+        cw_bits = configs[(self.size, self.compact)].cw_bits
+        value = 0
+        for cw in self.codewords:
+            value = value << cw_bits | cw
+        nbits = cw_bits * len(self.codewords)
+        packed = (value << (-nbits % 8)).to_bytes((nbits + 7) // 8, 'big')
+        return _codewords_header.pack(self.size, self.compact, self.data_cw_count) + packed
+
+    @classmethod
+    def from_bytes(cls, packed):
+        """ Unpack bytes from :py:meth:`to_bytes` """
+        size, compact, data_cw_count = _codewords_header.unpack_from(packed)
+        config = configs[(size, bool(compact))]
+        nbits = config.cw_bits * config.codewords
+        value = int.from_bytes(packed[_codewords_header.size:], 'big') >> (-nbits % 8)
+        mask = (1 << config.cw_bits) - 1
+        codewords = tuple(value >> (config.cw_bits * ii) & mask for ii in range(config.codewords - 1, -1, -1))
+        return cls(size, bool(compact), codewords, data_cw_count)
+
+    def aztec_code(self, data=None, ec_percent=None, encoding=None):
+        """ Place the codewords into an :py:class:`AztecCode` """
+        return AztecCode.from_codewords(self.size, self.compact, self.codewords, self.data_cw_count,
+                                        data, ec_percent, encoding)
+
+
+def plan(data, size=None, compact=None, ec_percent=23, encoding=None, strategy='optimal'):
+    """ Plan the encoding of data: find its sequence, and the symbol to place it in
+    Raise an exception if suitable size is not found
+
+    Takes the same arguments as :py:class:`AztecCode`, which is equivalent to
+    ``AztecCode.from_codewords(*plan(data, ...).with_ec())``.
+
+    :return: :py:class:`Plan`; if encoding is 'auto' or a list, its ``encoding`` is the chosen one
+    """
+    fixed = size is not None and compact is not None
+    if fixed and (size, compact) not in configs:
+        raise Exception(
+            'Given size and compact values (%s, %s) are not found in sizes table!' % (size, compact))
+    encoding, sequence = _planned_sequence(data, encoding, ec_percent, strategy, not fixed)
+    if not fixed:
+        value, nbits = _sequence_to_int(sequence)
+        size, compact, _, _ = _smallest_symbol(value, nbits, ec_percent, {})
+    return Plan(tuple(sequence), size, compact, ec_percent, encoding)
+
+
+@lru_cache(maxsize=None)
+def mode_message_positions(size, compact):
+    """ Get the matrix positions of the mode message bits
+
+    :param size: size of matrix
+    :param compact: compactness flag
+    :return: tuple of (y, x) positions, in bit order
+    """
+    center = size // 2
+    ring_radius = 5 if compact else 7
+    side_size = 7 if compact else 11
+    positions = []
+    x = 0
+    y = 0
+    index = 0
+    for bit_index in range(28 if compact else 40):
+        # for full mode take a reference grid into account
+        if not compact:
+            if (index % side_size) == 5:
+                index += 1
+        if 0 <= index < side_size:
+            # top
+            x = index + 2 - ring_radius
+            y = -ring_radius
+        elif side_size <= index < side_size * 2:
+            # right
+            x = ring_radius
+            y = index % side_size + 2 - ring_radius
+        elif side_size * 2 <= index < side_size * 3:
+            # bottom
+            x = ring_radius - index % side_size - 2
+            y = ring_radius
+        elif side_size * 3 <= index < side_size * 4:
+            # left
+            x = -ring_radius
+            y = ring_radius - index % side_size - 2
+        positions.append((center + y, center + x))
+        index += 1
+    return tuple(positions)
+
+
+@lru_cache(maxsize=None)
+def data_positions(size, compact):
+    """ Get the matrix positions of the data bits
+
+    Data bits are laid out in pairs, in a spiral starting from the innermost
+    layer; the bit string placed along the spiral is the codewords' bits
+    in reverse order.
+
+    :param size: size of matrix
+    :param compact: compactness flag
+    :return: tuple of (y, x) positions, in spiral order
+    """
+    config = configs[(size, compact)]
+    layers_count = config.layers
+    center = size // 2
+    ring_radius = 5 if compact else 7
+
+    positions = []
+    num = 2
+    side = Side.top
+    layer_index = 0
+    pos_x = center - ring_radius
+    pos_y = center - ring_radius - 1
+    for i in range(0, config.codewords * config.cw_bits, 2):
+        num += 1
+        max_num = ring_radius * 2 + layer_index * 4 + (4 if compact else 3)
+        if layer_index >= layers_count:
+            raise Exception('Maximum layer count for current size is exceeded!')
+        if side == Side.top:
+            # move right
+            dy0 = 1 if not compact and (center - pos_y) % 16 == 0 else 0
+            dy1 = 2 if not compact and (center - pos_y + 1) % 16 == 0 else 1
+            positions += ((pos_y - dy0, pos_x), (pos_y - dy1, pos_x))
+            pos_x += 1
+            if num > max_num:
+                num = 2
+                side = Side.right
+                pos_x -= 1
+                pos_y += 1
+            # skip reference grid
+            if not compact and (center - pos_x) % 16 == 0:
+                pos_x += 1
+            if not compact and (center - pos_y) % 16 == 0:
+                pos_y += 1
+        elif side == Side.right:
+            # move down
+            dx0 = 1 if not compact and (center - pos_x) % 16 == 0 else 0
+            dx1 = 2 if not compact and (center - pos_x + 1) % 16 == 0 else 1
+            positions += ((pos_y, pos_x - dx1), (pos_y, pos_x - dx0))
+            pos_y += 1
+            if num > max_num:
+                num = 2
+                side = Side.bottom
+                pos_x -= 2
+                if not compact and (center - pos_x - 1) % 16 == 0:
+                    pos_x -= 1
+                pos_y -= 1
+            # skip reference grid
+            if not compact and (center - pos_y) % 16 == 0:
+                pos_y += 1
+            if not compact and (center - pos_x) % 16 == 0:
+                pos_x -= 1
+        elif side == Side.bottom:
+            # move left
+            dy0 = 1 if not compact and (center - pos_y) % 16 == 0 else 0
+            dy1 = 2 if not compact and (center - pos_y + 1) % 16 == 0 else 1
+            positions += ((pos_y - dy1, pos_x), (pos_y - dy0, pos_x))
+            pos_x -= 1
+            if num > max_num:
+                num = 2
+                side = Side.left
+                pos_x += 1
+                pos_y -= 2
+                if not compact and (center - pos_y - 1) % 16 == 0:
+                    pos_y -= 1
+            # skip reference grid
+            if not compact and (center - pos_x) % 16 == 0:
+                pos_x -= 1
+            if not compact and (center - pos_y) % 16 == 0:
+                pos_y -= 1
+        elif side == Side.left:
+            # move up
+            dx0 = 1 if not compact and (center - pos_x) % 16 == 0 else 0
+            dx1 = 2 if not compact and (center - pos_x - 1) % 16 == 0 else 1
+            positions += ((pos_y, pos_x + dx1), (pos_y, pos_x + dx0))
+            pos_y -= 1
+            if num > max_num:
+                num = 2
+                side = Side.top
+                layer_index += 1
+            # skip reference grid
+            if not compact and (center - pos_y) % 16 == 0:
+                pos_y -= 1
+    return tuple(positions)
+
+
+@lru_cache(maxsize=None)
+def structure_template(size, compact):
+    """ Get the modules which don't depend on the data: the bulls-eye finder pattern,
+    orientation marks and (for full-size symbols) reference grid
+
+    :param size: size of matrix
+    :param compact: compactness flag
+    :return: bytes of size*size modules (0 or 1), row by row
+    """
+    modules = bytearray(size * size)
+    center = size // 2
+    ring_radius = 5 if compact else 7
+    # reference grid
+    if not compact:
+        for x in range(-center, center + 1):
+            for y in range(-center, center + 1):
+                if x % 16 == 0 or y % 16 == 0:
+                    modules[(center + y) * size + center + x] = (x + y + 1) % 2
+    # bulls-eye finder pattern
+    for x in range(-ring_radius, ring_radius):
+        for y in range(-ring_radius, ring_radius):
+            modules[(center + y) * size + center + x] = (max(abs(x), abs(y)) + 1) % 2
+    # orientation marks: left-top, right-top, right-down
+    for y, x in ((-ring_radius, -ring_radius), (-ring_radius + 1, -ring_radius), (-ring_radius, -ring_radius + 1),
+                 (-ring_radius, ring_radius), (-ring_radius + 1, ring_radius),
+                 (ring_radius - 1, ring_radius)):
+        modules[(center + y) * size + center + x] = 1
+    return bytes(modules)
+
+
+@lru_cache(maxsize=None)
+def placement_map(size, compact):
+    """ Get the source of every module of the matrix, as an index into the concatenation of the
+    structure template (size*size modules), the data bits in spiral order, and the mode message bits
+
+    :param size: size of matrix
+    :param compact: compactness flag
+    :return: tuple of size*size indices, row by row
+    """
+    n = size * size
+    sources = list(range(n))
+    positions = data_positions(size, compact)
+    for ii, (y, x) in enumerate(positions):
+        sources[y * size + x] = n + ii
+    for ii, (y, x) in enumerate(mode_message_positions(size, compact)):
+        sources[y * size + x] = n + len(positions) + ii
+    return tuple(sources)
+
+
+@lru_cache(maxsize=None)
+def _placement(size, compact):
+    """ Get a function gathering the modules of a matrix (see :py:func:`placement_map`), which
+    reads its indices without touching their reference counts """
+    return operator.itemgetter(*placement_map(size, compact))
+
+
+_bits_to_modules = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def _codeword_bits(codewords, cw_bits):
+    """ Bits of codewords (most significant first) as bytes of 0 and 1 """
+    value = 0
+    for cw in codewords:
+        value = value << cw_bits | cw
+    return format(value, '0%db' % (len(codewords) * cw_bits)).encode().translate(_bits_to_modules)
+
+
+def warmup(sizes=None, compact=None, freeze=False):
+    """ Build the tables which don't depend on the data, for the given symbol configurations
+
+    Call this in the parent process of a preforking server, before forking its
+    workers: they then share the tables (copy-on-write) instead of each
+    building them again. The Galois field tables and the large per-configuration
+    tables are compact arrays and bytes rather than many small objects, so
+    that using them doesn't write reference counts into the shared pages.
+
+    :param sizes: iterable of sizes of matrix to prepare (default: all)
+    :param compact: prepare only compact (True) or full-size (False) symbols (default: both)
+    :param freeze: collect garbage and then call :py:func:`gc.freeze`, so that the
+      garbage collector of the workers never touches (and copies) the parent's objects
+    :return: tuple of the (size, compact) configurations prepared
+    """
+    sizes = None if sizes is None else frozenset(sizes)
+    for cw_bits, pp in polynomials.items():
+        gf_tables(2 ** cw_bits, pp)
+    prepared = []
+    for size, is_compact in configs:
+        if (sizes is None or size in sizes) and (compact is None or is_compact == compact):
+            structure_template(size, is_compact)
+            _placement(size, is_compact)
+            prepared.append((size, is_compact))
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return tuple(prepared)
+
+
+def get_mode_message(compact, layers_count, data_cw_count):
+    """ Get mode message
+
+    :param compact: compactness flag
+    :param layers_count: number of layers
+    :param data_cw_count: number of data codewords
+    :return: mode message codewords
+    """
+    if compact:
+        # for compact mode - 2 bits with layers count and 6 bits with data codewords count
+        mode_word = '{0:02b}{1:06b}'.format(layers_count - 1, data_cw_count - 1)
+        # two 4 bits initial codewords with 5 Reed-Solomon check codewords
+        init_codewords = [int(mode_word[i:i + 4], 2) for i in range(0, 8, 4)]
+        total_cw_count = 7
+    else:
+        # for full mode - 5 bits with layers count and 11 bits with data codewords count
+        mode_word = '{0:05b}{1:011b}'.format(layers_count - 1, data_cw_count - 1)
+        # four 4 bits initial codewords with 6 Reed-Solomon check codewords
+        init_codewords = [int(mode_word[i:i + 4], 2) for i in range(0, 16, 4)]
+        total_cw_count = 10
+    # fill Reed-Solomon check codewords with zeros
+    init_cw_count = len(init_codewords)
+    codewords = (init_codewords + [0] * (total_cw_count - init_cw_count))[:total_cw_count]
+    # update Reed-Solomon check codewords using GF(16)
+    reed_solomon(codewords, init_cw_count, total_cw_count - init_cw_count, 16, polynomials[4])
+    return codewords
+
+
+_dark_run = re.compile(b'[^\x00]+')
+
+
+def matrix_scanlines(matrix):
+    """ Run-length encode the dark modules of each row of a matrix
+
+    :param matrix: square matrix of modules, as in :py:attr:`AztecCode.matrix`
+    :return: tuple with a tuple of (start, length) dark runs for each row
+    """
+    return tuple(tuple((m.start(), m.end() - m.start()) for m in _dark_run.finditer(bytes(line))) for line in matrix)
+
+
+def pack_scanline(runs, width, module_size=1):
+    """ Pack a scanline's dark runs into an integer of width * module_size bits, leftmost module first
+
+    :param runs: (start, length) dark runs, as in :py:attr:`AztecCode.scanlines`
+    :param width: number of modules in the scanline
+    :param module_size: number of bits per module
+    """
+    bits = 0
+    for start, length in runs:
+        bits |= ((1 << length * module_size) - 1) << ((width - start - length) * module_size)
+    return bits
+
+
+def _scanline_bytes(runs, size, border=0, width=None, invert=False):
+    """ A scanline with one byte per module: 1 for ink (dark modules, or light modules and border
+    if inverted) and 0 otherwise, padded with 0 to width. Rows of these are combined as big integers
+    and turned into text with :py:meth:`str.translate`, rather than module by module.
+    """
+    full = size + 2 * border
+    ink, blank = (b'\x00', b'\x01') if invert else (b'\x01', b'\x00')
+    row = bytearray(blank * full + bytes((width or full) - full))
+    for start, length in runs:
+        row[border + start:border + start + length] = ink * length
+    return bytes(row)
+
+
+# character cell width and height, weight of each module within the cell, and characters by code
+dense_styles = MappingProxyType({
+    'quadrant': (2, 2, ((1, 2), (4, 8)),
+                 ' \u2598\u259d\u2580\u2596\u258c\u259e\u259b\u2597\u259a\u2590\u259c\u2584\u2599\u259f\u2588'),
+    'braille': (2, 4, ((1, 8), (2, 16), (4, 32), (64, 128)),
+                ''.join(chr(0x2800 + ii) for ii in range(256))),
+})
+
+_fancy_chars = dict(enumerate('\u2588\u2580\u2584 '))
+
+
+def _png_chunks(width, height, rows, level=6, chunk_size=1 << 16):
+    """ Yield the chunks of a 1-bit grayscale PNG file, compressing row by row
+
+    :param width: width in pixels
+    :param height: height in pixels
+    :param rows: iterable of packed pixel rows (1 is white, padded to a whole byte)
+    :param level: zlib compression level
+    :param chunk_size: size of compressed data to collect in each IDAT chunk
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    yield b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0))
+    z = zlib.compressobj(level)
+    pending = []
+    npending = 0
+    for row in rows:
+        out = z.compress(b'\x00' + row)
+        if out:
+            pending.append(out)
+            npending += len(out)
+            if npending >= chunk_size:
+                yield chunk(b'IDAT', b''.join(pending))
+                pending, npending = [], 0
+    pending.append(z.flush())
+    yield chunk(b'IDAT', b''.join(pending)) + chunk(b'IEND', b'')
+
+
+def _batched(pieces, chunk_size):
+    """ Join bytes pieces into chunks of at least chunk_size bytes (except the last) """
+    pending = []
+    npending = 0
+    for piece in pieces:
+        pending.append(piece)
+        npending += len(piece)
+        if npending >= chunk_size:
+            yield b''.join(pending)
+            pending, npending = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+class RenderStream(object):
+    """
+    Byte chunks of a rendered Aztec code, produced as they are iterated over
+
+    Usable directly as a WSGI response body, or as the body messages of an ASGI response.
+    It can be iterated over only once.
+    """
+
+    def __init__(self, chunks, content_type, content_length=None):
+        """
+        :param chunks: iterator of bytes
+        :param content_type: MIME type of the output
+        :param content_length: total length in bytes, if known before rendering
+        """
+        self._chunks = chunks
+        self.content_type = content_type
+        self.content_length = content_length
+
+    def __iter__(self):
+        return self._chunks
+
+    def headers(self):
+        """ HTTP response headers for the output: a list of (name, value) """
+        headers = [('Content-Type', self.content_type)]
+        if self.content_length is not None:
+            headers.append(('Content-Length', str(self.content_length)))
+        return headers
+
 
 class AztecCode(object):
     """
     Aztec code generator
     """
 
-    def __init__(self, data, size=None, compact=None, ec_percent=23, encoding=None):
+    def __init__(self, data, size=None, compact=None, ec_percent=23, encoding=None, strategy='optimal'):
         """ Create Aztec code with given data.
         If size and compact parameters are None (by default), an
         optimal size and compactness calculated based on the data.
 
-        :param data: string or bytes to encode
+        :param data: string, or bytes-like data (bytes, bytearray, memoryview, mmap, ...) to encode, read in place
         :param size: size of matrix
         :param compact: compactness flag
         :param ec_percent: percentage of symbol capacity for error correction (default 23%)
         :param encoding:
           If set, sequence will include an initial ECI mark corresponding to the specified encoding (see :py:mod:`codecs`)
           If unset, no ECI mark will be included and string must be encodable as 'iso8859-1'
+          If 'auto' or a list of encodings, the one giving the smallest symbol is chosen (see :py:func:`select_encoding`),
+          and stored in :py:attr:`encoding`
+        :param strategy:
+          'optimal' (by default) to find the sequence with the fewest bits
+          'fast' to encode with a single scan: directly if the data fits one mode (or is mostly binary), and
+          otherwise greedily, at the cost of a few more bits
         """
         self.data = data
-        self.encoding = encoding
-        self.sequence = None
+        self.strategy = strategy
         self.ec_percent = ec_percent
-        if size is not None and compact is not None:
-            if (size, compact) in configs:
-                self.size, self.compact = size, compact
-            else:
-                raise Exception(
-                    'Given size and compact values (%s, %s) are not found in sizes table!' % (size, compact))
-        else:
-            self.size, self.compact, self.sequence = find_suitable_matrix_size(self.data, ec_percent, encoding)
-        self.__create_matrix()
-        self.__encode_data()
+        self._scanlines = None
+        planned = plan(data, size, compact, ec_percent, encoding, strategy)
+        self.encoding, self.size, self.compact = planned.encoding, planned.size, planned.compact
+        self.sequence = list(planned.sequence)
+        self.__place_codewords(*get_codewords(self.sequence, self.size, self.compact))
+
+    @classmethod
+    def from_matrix(cls, matrix, compact, data=None, ec_percent=None, encoding=None):
+        """ Create Aztec code from an already encoded matrix, without encoding anything
+
+        :param matrix: square matrix of modules (a sequence of rows of 0 and 1)
+        :param compact: compactness flag
+        :param data: data encoded in the matrix, if known
+        :param ec_percent: percentage of symbol capacity for error correction, if known
+        :param encoding: see :py:class:`AztecCode`
+        """
+        size = len(matrix)
+        if (size, compact) not in configs:
+            raise Exception(
+                'Given size and compact values (%s, %s) are not found in sizes table!' % (size, compact))
+        self = cls.__new__(cls)
+        self.data, self.encoding, self.sequence, self.ec_percent = data, encoding, None, ec_percent
+        self.strategy = None
+        self.size, self.compact = size, compact
+        self._scanlines = None
+        self.matrix = [array.array('B', line) for line in matrix]
+        return self
+
+    @classmethod
+    def from_codewords(cls, size, compact, codewords, data_cw_count, data=None, ec_percent=None, encoding=None):
+        """ Create Aztec code by placing already computed codewords (see :py:meth:`Plan.with_ec`)
 
-    def __create_matrix(self):
-        """ Create Aztec code matrix with given size """
-        self.matrix = [array.array('B', (0 for jj in range(self.size))) for ii in range(self.size)]
+        :param size: size of matrix
+        :param compact: compactness flag
+        :param codewords: all codewords of the symbol: data codewords followed by Reed-Solomon check codewords
+        :param data_cw_count: number of data codewords
+        :param data: data encoded in the codewords, if known
+        :param ec_percent: percentage of symbol capacity for error correction, if known
+        :param encoding: see :py:class:`AztecCode`
+        """
+        config = configs.get((size, compact))
+        if config is None:
+            raise Exception(
+                'Given size and compact values (%s, %s) are not found in sizes table!' % (size, compact))
+        if len(codewords) != config.codewords or not 0 < data_cw_count <= config.codewords:
+            raise ValueError('%d codewords with %d data codewords do not match a %s symbol of size %d' % (
+                len(codewords), data_cw_count, 'compact' if compact else 'full', size))
+        self = cls.__new__(cls)
+        self.data, self.encoding, self.sequence, self.ec_percent = data, encoding, None, ec_percent
+        self.strategy = None
+        self.size, self.compact = size, compact
+        self._scanlines = None
+        self.__place_codewords(codewords, data_cw_count)
+        return self
 
     def save(self, filename, module_size=2, border=0, format=None):
         """ Save matrix to image file
@@ -568,23 +1976,75 @@ class AztecCode(object):
             return self.save_svg(filename, module_size, border)
         self.image(module_size, border).save(filename, format=format)
 
+    @property
+    def scanlines(self):
+        """ Dark runs of each row of the matrix, as tuples of (start, length), shared by all renderers
+
+        They are computed once and cached; if the matrix is modified, ``del aztec_code.scanlines``
+        to recompute them.
+        """
+        if self._scanlines is None:
+            self._scanlines = matrix_scanlines(self.matrix)
+        return self._scanlines
+
+    @scanlines.deleter
+    def scanlines(self):
+        self._scanlines = None
+
     def save_svg(self, filename, module_size=2, border=0, foreground='black', background='white'):
         """ Save matrix to SVG file using horizontal run-length-encoding """
         f = filename if isinstance(filename, IOBase) else open(filename, 'wb')
-        size = (self.size+2*border)*module_size
-        f.write(
-            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}">'
-            f'<rect x="0" y="0" width="{size}" height="{size}" fill="{background}"/>'
-            f'<path stroke="{foreground}" stroke-width="{module_size}" transform="translate(0,0.5)" d="'.encode())
-        for yy, line in enumerate(self.matrix):
-            xx = 0
-            for color, group in groupby(line):
-                run = len(list(group))
-                if color:
-                    f.write(b'M%d %dh%d' % ((xx + border)*module_size, (yy + border)*module_size, run*module_size))
-                xx += run
-        f.write(b'"/></svg>')
+        f.write(b''.join(self._svg_pieces(module_size, border, foreground, background)))
 
+    def _svg_pieces(self, module_size, border, foreground, background):
+        size = (self.size+2*border)*module_size
+        yield (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}">'
+               f'<rect x="0" y="0" width="{size}" height="{size}" fill="{background}"/>'
+               f'<path stroke="{foreground}" stroke-width="{module_size}" transform="translate(0,0.5)" d="').encode()
+        for yy, runs in enumerate(self.scanlines):
+            yield b''.join(b'M%d %dh%d' % ((xx + border)*module_size, (yy + border)*module_size, run*module_size)
+                           for xx, run in runs)
+        yield b'"/></svg>'
+
+    def iter_svg(self, module_size=2, border=0, foreground='black', background='white', chunk_size=8192):
+        """ Render to SVG in chunks, as they are produced (see :py:meth:`save_svg`)
+
+        :param module_size: barcode module size in pixels
+        :param border: barcode border size in modules
+        :param chunk_size: minimum size of each chunk after the first, in bytes
+        :return: :py:class:`RenderStream`, with the content length
+        """
+        pieces = self._svg_pieces(module_size, border, foreground, background)
+        header = next(pieces)
+        # each run is 'M<x> <y>h<length>': count the digits of each coordinate without formatting it
+        digits = [len(str(v * module_size)) for v in range(self.size + 2*border + 1)]
+        length = len(header) + len(b'"/></svg>') + sum(
+            len(runs) * (3 + digits[yy + border]) + sum(digits[xx + border] + digits[run] for xx, run in runs)
+            for yy, runs in enumerate(self.scanlines))
+
+        def chunks():
+            # send the header straight away, for the first byte to go out before the path is formatted
+            yield header
+            yield from _batched(pieces, chunk_size)
+        return RenderStream(chunks(), 'image/svg+xml', length)
+
+    def _pixel_rows(self, module_size, border, dark=False):
+        """ Yield each row of pixels, packed 8 pixels per byte (first pixel most significant),
+        with 1 for white (or for black if dark), padded with white to a whole byte
+        """
+        width = (self.size+2*border) * module_size
+        stride = (width + 7) // 8
+        shift = border * module_size + 8 * stride - width
+        white = 0 if dark else (1 << 8 * stride) - 1
+        blank = white.to_bytes(stride, 'big')
+        for ii in range(module_size * border):
+            yield blank
+        for runs in self.scanlines:
+            row = (white ^ (pack_scanline(runs, self.size, module_size) << shift)).to_bytes(stride, 'big')
+            for ii in range(module_size):
+                yield row
+        for ii in range(module_size * border):
+            yield blank
 
     def image(self, module_size=2, border=0):
         """ Create PIL image
@@ -592,262 +2052,221 @@ class AztecCode(object):
         :param module_size: barcode module size in pixels.
         :param border: barcode border size in modules
         """
-        if ImageDraw is None:
+        if Image is None:
             exc = missing_pil[0](missing_pil[1])
             exc.__traceback__ = missing_pil[2]
             raise exc
-        image = Image.new('1', ((self.size+2*border) * module_size, (self.size+2*border) * module_size), 1)
-        image_draw = ImageDraw.Draw(image)
-        for y in range(self.size):
-            for x in range(self.size):
-                image_draw.rectangle(
-                    ((x+border) * module_size, (y+border) * module_size,
-                     (x+border+1) * module_size, (y+border+1) * module_size),
-                    fill=not self.matrix[y][x])
-        return image
-
-    def print_out(self, border=0):
-        """ Print out Aztec code matrix using ASCII output """
-        print('\n'.join(' '*(2*border + self.size) for ii in range(border)))
-        for line in self.matrix:
-            print(' '*border + ''.join(('#' if x else ' ') for x in line) + ' '*border)
-        print('\n'.join(' '*(2*border + self.size) for ii in range(border)))
-
-    def print_fancy(self, border=0):
-        """ Print out Aztec code matrix using Unicode box-drawing characters and ANSI colorization """
+        # pack each row of pixels straight from the scanlines (mode '1' uses 1 for white)
+        width = (self.size+2*border) * module_size
+        return Image.frombytes('1', (width, width), b''.join(self._pixel_rows(module_size, border)))
+
+    def to_array(self, module_size=1, border=0, dtype=None, colors=None, materialize=False):
+        """ Get the symbol as a numpy array, upscaled without drawing or copying pixels
+
+        Unless materialized, the result is a read-only view of shape
+        (rows, module_size, columns, module_size), plus a trailing axis for
+        colors with several channels: each module is repeated over its pixels
+        by a zero stride, so the memory and time taken grow with the number of
+        modules, not of pixels. ``materialize=True`` copies it into a
+        contiguous, writable image.
+
+        :param module_size: barcode module size in pixels
+        :param border: barcode border size in modules
+        :param dtype: numpy dtype of the array (default: uint8, unless colors need another type)
+        :param colors: (light, dark) values to map modules to, e.g. (255, 0) for 8-bit grayscale,
+          or ((255, 255, 255), (0, 0, 0)) for RGB; by default, modules are 0 for light and 1 for dark
+        :param materialize: return a contiguous (height, width[, channels]) array instead of a view
+        :return: ``numpy.ndarray``
+        """
+        if numpy is None:
+            exc = missing_numpy[0](missing_numpy[1])
+            exc.__traceback__ = missing_numpy[2]
+            raise exc
+        modules = numpy.frombuffer(b''.join(self.matrix), dtype=numpy.uint8).reshape(self.size, self.size)
+        if border:
+            modules = numpy.pad(modules, border)
+        if colors is not None:
+            palette = numpy.asarray(colors, dtype=dtype)
+            if dtype is None and palette.dtype.kind in 'iu' and 0 <= palette.min() and palette.max() <= 255:
+                palette = palette.astype(numpy.uint8)
+            modules = palette[modules]
+        elif dtype is not None:
+            modules = modules.astype(dtype, copy=False)
+        count, channels = modules.shape[0], modules.shape[2:]
+        view = numpy.broadcast_to(modules[:, None, :, None], (count, module_size, count, module_size) + channels)
+        if materialize:
+            # (reshaping the view only copies it if module_size > 1)
+            image = numpy.empty((count * module_size, count * module_size) + channels, view.dtype)
+            image.reshape(view.shape)[...] = view
+            return image
+        return view
+
+    def iter_png(self, module_size=2, border=0, chunk_size=1 << 16, level=6):
+        """ Render to a 1-bit grayscale PNG in chunks, compressing row by row (without Pillow)
+
+        :param module_size: barcode module size in pixels
+        :param border: barcode border size in modules
+        :param chunk_size: size of compressed data to collect in each chunk
+        :param level: zlib compression level
+        :return: :py:class:`RenderStream` (the content length isn't known before compressing)
+        """
+        width = (self.size+2*border) * module_size
+        return RenderStream(_png_chunks(width, width, self._pixel_rows(module_size, border), level, chunk_size),
+                            'image/png')
+
+    def _text_lines(self, border):
+        """ Yield the lines of :py:meth:`print_out` """
+        blank = ''.join(' '*(2*border + self.size) + '\n' for ii in range(border)) or '\n'
+        yield blank
+        for runs in self.scanlines:
+            line, xx = [' '*border], 0
+            for start, length in runs:
+                line += (' '*(start - xx), '#'*length)
+                xx = start + length
+            line.append(' '*(self.size - xx + border) + '\n')
+            yield ''.join(line)
+        yield blank
+
+    def print_out(self, border=0, file=None):
+        """ Print out Aztec code matrix using ASCII output
+
+        :param border: barcode border size in modules
+        :param file: text stream to print to (default: ``sys.stdout``)
+        """
+        (sys.stdout if file is None else file).write(''.join(self._text_lines(border)))
+
+    def iter_text(self, border=0, chunk_size=8192):
+        """ Render the output of :py:meth:`print_out` in chunks of ASCII bytes
+
+        :param border: barcode border size in modules
+        :param chunk_size: minimum size of each chunk (but the last), in bytes
+        :return: :py:class:`RenderStream`, with the content length
+        """
+        full = self.size + 2*border
+        length = (full + 1) * full if border else (self.size + 1) * self.size + 2
+        return RenderStream(_batched((line.encode() for line in self._text_lines(border)), chunk_size),
+                            'text/plain; charset=utf-8', length)
+
+    def print_fancy(self, border=0, file=None):
+        """ Print out Aztec code matrix using Unicode box-drawing characters and ANSI colorization
+
+        :param border: barcode border size in modules
+        :param file: text stream to print to (default: ``sys.stdout``)
+        """
+        rows = [int.from_bytes(_scanline_bytes(runs, self.size), 'big') for runs in self.scanlines]
+        out = []
         for y in range(-border, self.size+border, 2):
             last_half_row = (y==self.size + border - 1)
-            ul = '\x1b[40;37;1m' + ('\u2580' if last_half_row else '\u2588')*border
-            for x in range(0, self.size):
-                a = self.matrix[y][x] if 0 <= y < self.size else None
-                b = self.matrix[y+1][x] if -1 <= y < self.size-1 else last_half_row
-                ul += ' ' if a and b else '\u2584' if a else '\u2580' if b else '\u2588'
-            ul += ('\u2580' if last_half_row else '\u2588')*border + '\x1b[0m'
-            print(ul)
-
-    def __add_finder_pattern(self):
-        """ Add bulls-eye finder pattern """
-        center = self.size // 2
-        ring_radius = 5 if self.compact else 7
-        for x in range(-ring_radius, ring_radius):
-            for y in range(-ring_radius, ring_radius):
-                self.matrix[center + y][center + x] = (max(abs(x), abs(y)) + 1) % 2
-
-    def __add_orientation_marks(self):
-        """ Add orientation marks to matrix """
-        center = self.size // 2
-        ring_radius = 5 if self.compact else 7
-        # add orientation marks
-        # left-top
-        self.matrix[center - ring_radius][center - ring_radius] = 1
-        self.matrix[center - ring_radius + 1][center - ring_radius] = 1
-        self.matrix[center - ring_radius][center - ring_radius + 1] = 1
-        # right-top
-        self.matrix[center - ring_radius + 0][center + ring_radius + 0] = 1
-        self.matrix[center - ring_radius + 1][center + ring_radius + 0] = 1
-        # right-down
-        self.matrix[center + ring_radius - 1][center + ring_radius + 0] = 1
-
-    def __add_reference_grid(self):
-        """ Add reference grid to matrix """
-        if self.compact:
-            return
-        center = self.size // 2
-        ring_radius = 5 if self.compact else 7
-        for x in range(-center, center + 1):
-            for y in range(-center, center + 1):
-                # skip finder pattern
-                if -ring_radius <= x <= ring_radius and -ring_radius <= y <= ring_radius:
-                    continue
-                # set pixel
-                if x % 16 == 0 or y % 16 == 0:
-                    self.matrix[center + y][center + x] = (x + y + 1) % 2
+            edge = ('\u2580' if last_half_row else '\u2588')*border
+            a = rows[y] if 0 <= y < self.size else 0
+            b = rows[y+1] if -1 <= y < self.size-1 else int.from_bytes(b'\x01' * self.size, 'big') if last_half_row else 0
+            line = (2*a + b).to_bytes(self.size, 'big').decode('latin-1').translate(_fancy_chars)
+            out += ('\x1b[40;37;1m', edge, line, edge, '\x1b[0m\n')
+        (sys.stdout if file is None else file).write(''.join(out))
 
-    def __get_mode_message(self, layers_count, data_cw_count):
-        """ Get mode message
+    def print_dense(self, border=0, file=None, style='quadrant', invert=False):
+        """ Print out Aztec code matrix compactly, using Unicode quadrant blocks or braille
 
-        :param layers_count: number of layers
+        'quadrant' shows 2x2 modules per character, and 'braille' 2x4 modules (as a preview;
+        braille dots are generally too sparse to scan).
+
+        :param border: barcode border size in modules
+        :param file: text stream to print to (default: ``sys.stdout``)
+        :param style: 'quadrant' or 'braille'
+        :param invert: draw light modules instead of dark ones, for light-on-dark terminals
+        """
+        cell_w, cell_h, weights, chars = dense_styles[style]
+        full = self.size + 2*border
+        columns = -(-full // cell_w)
+        width = columns * cell_w
+        blank = _scanline_bytes((), self.size, border, width, invert)
+        rows = [blank] * border
+        rows += (_scanline_bytes(runs, self.size, border, width, invert) for runs in self.scanlines)
+        rows += [blank] * border
+        rows += [bytes(width)] * (-len(rows) % cell_h)
+        table = dict(enumerate(chars))
+        out = []
+        for y in range(0, len(rows), cell_h):
+            # each module's weight goes in its cell's byte; the weights of a cell sum to at most 255
+            codes = 0
+            for row, row_weights in zip(rows[y:y + cell_h], weights):
+                for dx, weight in enumerate(row_weights):
+                    codes += weight * int.from_bytes(row[dx::cell_w], 'big')
+            out += (codes.to_bytes(columns, 'big').decode('latin-1').translate(table), '\n')
+        (sys.stdout if file is None else file).write(''.join(out))
+
+    def __place_codewords(self, codewords, data_cw_count):
+        """ Create the matrix: the finder pattern, orientation marks and reference grid,
+        with the codewords and the mode message placed around them
+
+        :param codewords: all codewords of the symbol
         :param data_cw_count: number of data codewords
-        :return: mode message codewords
         """
-        if self.compact:
-            # for compact mode - 2 bits with layers count and 6 bits with data codewords count
-            mode_word = '{0:02b}{1:06b}'.format(layers_count - 1, data_cw_count - 1)
-            # two 4 bits initial codewords with 5 Reed-Solomon check codewords
-            init_codewords = [int(mode_word[i:i + 4], 2) for i in range(0, 8, 4)]
-            total_cw_count = 7
-        else:
-            # for full mode - 5 bits with layers count and 11 bits with data codewords count
-            mode_word = '{0:05b}{1:011b}'.format(layers_count - 1, data_cw_count - 1)
-            # four 4 bits initial codewords with 6 Reed-Solomon check codewords
-            init_codewords = [int(mode_word[i:i + 4], 2) for i in range(0, 16, 4)]
-            total_cw_count = 10
-        # fill Reed-Solomon check codewords with zeros
-        init_cw_count = len(init_codewords)
-        codewords = (init_codewords + [0] * (total_cw_count - init_cw_count))[:total_cw_count]
-        # update Reed-Solomon check codewords using GF(16)
-        reed_solomon(codewords, init_cw_count, total_cw_count - init_cw_count, 16, polynomials[4])
-        return codewords
-
-    def __add_mode_info(self, data_cw_count):
-        """ Add mode info to matrix
-
-        :param data_cw_count: number of data codewords.
+        size, compact = self.size, self.compact
+        config = configs[(size, compact)]
+        mode_data_values = get_mode_message(compact, config.layers, data_cw_count)
+        # the spiral holds the codewords' bits in reverse order
+        stacked = (structure_template(size, compact) + _codeword_bits(codewords, config.cw_bits)[::-1] +
+                   _codeword_bits(mode_data_values, 4))
+        modules = bytes(_placement(size, compact)(stacked))
+        self.matrix = [array.array('B', modules[pos:pos + size]) for pos in range(0, size * size, size)]
+
+
+class AztecRune(AztecCode):
+    """
+    Aztec Rune: an 11×11 symbol, the core of a compact symbol without any data layers,
+    which holds a value from 0 to 255 in its mode message
+
+    There are only 256 runes, so all of them are built on first use, into an immutable
+    table: ``AztecRune(value)`` returns the same shared object for a value every time,
+    so its attributes can't be set or deleted.
+    Their matrices are tuples of bytes, and they have all the renderers of :py:class:`AztecCode`.
+    """
+
+    def __new__(cls, value):
         """
-        config = configs[(self.size, self.compact)]
-        layers_count = config.layers
-        mode_data_values = self.__get_mode_message(layers_count, data_cw_count)
-        mode_data_bits = ''.join('{0:04b}'.format(v) for v in mode_data_values)
-
-        center = self.size // 2
-        ring_radius = 5 if self.compact else 7
-        side_size = 7 if self.compact else 11
-        x = 0
-        y = 0
-        index = 0
-        for bit in mode_data_bits:
-            # for full mode take a reference grid into account
-            if not self.compact:
-                if (index % side_size) == 5:
-                    index += 1
-            if 0 <= index < side_size:
-                # top
-                x = index + 2 - ring_radius
-                y = -ring_radius
-            elif side_size <= index < side_size * 2:
-                # right
-                x = ring_radius
-                y = index % side_size + 2 - ring_radius
-            elif side_size * 2 <= index < side_size * 3:
-                # bottom
-                x = ring_radius - index % side_size - 2
-                y = ring_radius
-            elif side_size * 3 <= index < side_size * 4:
-                # left
-                x = -ring_radius
-                y = ring_radius - index % side_size - 2
-            # set pixel
-            self.matrix[center + y][center + x] = (bit == '1')
-            index += 1
-
-    def __add_data(self, data, encoding):
-        """ Add data to encode to the matrix
-
-        :param data: data to encode
-        :param encoding: see :py:class:`AztecCode`
-        :return: number of data codewords
+        :param value: integer from 0 to 255
         """
-        if not self.sequence:
-            self.sequence = find_optimal_sequence(data, encoding)
-        out_bits = optimal_sequence_to_bits(self.sequence)
-        config = configs[(self.size, self.compact)]
-        layers_count = config.layers
-        cw_count = config.codewords
-        cw_bits = config.cw_bits
-
-        # calculate data codewords, and ensure data will fit
-        data_codewords = get_data_codewords(out_bits, cw_bits)
-        data_cw_count = len(data_codewords)
-        if data_cw_count > cw_count:
-            raise Exception('Data too big to fit in Aztec code with current size!')
-
-        # add Reed-Solomon codewords to init data codewords
-        codewords = (data_codewords + [0] * (cw_count - data_cw_count))[:cw_count]
-        reed_solomon(codewords, data_cw_count, cw_count - data_cw_count, 2 ** cw_bits, polynomials[cw_bits])
-
-        center = self.size // 2
-        ring_radius = 5 if self.compact else 7
-
-        num = 2
-        side = Side.top
-        layer_index = 0
-        pos_x = center - ring_radius
-        pos_y = center - ring_radius - 1
-        full_bits = ''.join(bin(cw)[2:].zfill(cw_bits) for cw in codewords)[::-1]
-        for i in range(0, len(full_bits), 2):
-            num += 1
-            max_num = ring_radius * 2 + layer_index * 4 + (4 if self.compact else 3)
-            bits_pair = [(bit == '1') for bit in full_bits[i:i + 2]]
-            if layer_index >= layers_count:
-                raise Exception('Maximum layer count for current size is exceeded!')
-            if side == Side.top:
-                # move right
-                dy0 = 1 if not self.compact and (center - pos_y) % 16 == 0 else 0
-                dy1 = 2 if not self.compact and (center - pos_y + 1) % 16 == 0 else 1
-                self.matrix[pos_y - dy0][pos_x] = bits_pair[0]
-                self.matrix[pos_y - dy1][pos_x] = bits_pair[1]
-                pos_x += 1
-                if num > max_num:
-                    num = 2
-                    side = Side.right
-                    pos_x -= 1
-                    pos_y += 1
-                # skip reference grid
-                if not self.compact and (center - pos_x) % 16 == 0:
-                    pos_x += 1
-                if not self.compact and (center - pos_y) % 16 == 0:
-                    pos_y += 1
-            elif side == Side.right:
-                # move down
-                dx0 = 1 if not self.compact and (center - pos_x) % 16 == 0 else 0
-                dx1 = 2 if not self.compact and (center - pos_x + 1) % 16 == 0 else 1
-                self.matrix[pos_y][pos_x - dx0] = bits_pair[1]
-                self.matrix[pos_y][pos_x - dx1] = bits_pair[0]
-                pos_y += 1
-                if num > max_num:
-                    num = 2
-                    side = Side.bottom
-                    pos_x -= 2
-                    if not self.compact and (center - pos_x - 1) % 16 == 0:
-                        pos_x -= 1
-                    pos_y -= 1
-                # skip reference grid
-                if not self.compact and (center - pos_y) % 16 == 0:
-                    pos_y += 1
-                if not self.compact and (center - pos_x) % 16 == 0:
-                    pos_x -= 1
-            elif side == Side.bottom:
-                # move left
-                dy0 = 1 if not self.compact and (center - pos_y) % 16 == 0 else 0
-                dy1 = 2 if not self.compact and (center - pos_y + 1) % 16 == 0 else 1
-                self.matrix[pos_y - dy0][pos_x] = bits_pair[1]
-                self.matrix[pos_y - dy1][pos_x] = bits_pair[0]
-                pos_x -= 1
-                if num > max_num:
-                    num = 2
-                    side = Side.left
-                    pos_x += 1
-                    pos_y -= 2
-                    if not self.compact and (center - pos_y - 1) % 16 == 0:
-                        pos_y -= 1
-                # skip reference grid
-                if not self.compact and (center - pos_x) % 16 == 0:
-                    pos_x -= 1
-                if not self.compact and (center - pos_y) % 16 == 0:
-                    pos_y -= 1
-            elif side == Side.left:
-                # move up
-                dx0 = 1 if not self.compact and (center - pos_x) % 16 == 0 else 0
-                dx1 = 2 if not self.compact and (center - pos_x - 1) % 16 == 0 else 1
-                self.matrix[pos_y][pos_x + dx1] = bits_pair[0]
-                self.matrix[pos_y][pos_x + dx0] = bits_pair[1]
-                pos_y -= 1
-                if num > max_num:
-                    num = 2
-                    side = Side.top
-                    layer_index += 1
-                # skip reference grid
-                if not self.compact and (center - pos_y) % 16 == 0:
-                    pos_y -= 1
-        return data_cw_count
-
-    def __encode_data(self):
-        """ Encode data """
-        self.__add_finder_pattern()
-        self.__add_orientation_marks()
-        self.__add_reference_grid()
-        data_cw_count = self.__add_data(self.data, self.encoding)
-        self.__add_mode_info(data_cw_count)
+        if not isinstance(value, numbers.Integral) or not 0 <= value <= 255:
+            raise ValueError('Aztec Rune value must be an integer from 0 to 255, not %r' % (value,))
+        return _rune_table()[value]
+
+    def __init__(self, value):
+        pass
+
+    def __reduce__(self):
+        return AztecRune, (self.value,)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Aztec Runes are shared, and cannot be modified')
+
+    def __delattr__(self, name):
+        raise AttributeError('Aztec Runes are shared, and cannot be modified')
+
+    @classmethod
+    def _build(cls, value):
+        """ Build the rune for a value: its 8 bits in the mode message of a compact symbol
+        (as the layers and data codewords counts), with every other bit inverted
+        """
+        self = object.__new__(cls)
+        size, compact = 11, True
+        modules = bytearray(structure_template(size, compact))
+        mode_data_values = get_mode_message(compact, (value >> 6) + 1, (value & 0x3f) + 1)
+        mode_data_bits = ''.join('{0:04b}'.format(v ^ 0b1010) for v in mode_data_values)
+        for bit, (y, x) in zip(mode_data_bits, mode_message_positions(size, compact)):
+            modules[y * size + x] = (bit == '1')
+        matrix = tuple(bytes(modules[pos:pos + size]) for pos in range(0, size * size, size))
+        # set the attributes directly, as __setattr__ refuses to
+        self.__dict__.update(
+            value=value, data=None, encoding=None, sequence=None, ec_percent=None, strategy=None,
+            size=size, compact=compact, matrix=matrix, _scanlines=matrix_scanlines(matrix))
+        return self
+
+
+@lru_cache(maxsize=None)
+def _rune_table():
+    """ Get all the Aztec Runes, indexed by value """
+    return tuple(AztecRune._build(value) for value in range(256))
 
 
 def main(argv):
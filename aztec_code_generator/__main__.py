@@ -0,0 +1,9 @@
+import sys
+
+from . import main
+
+if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+    from .server import main as serve
+    serve(sys.argv[2:])
+else:
+    main(sys.argv)
@@ -0,0 +1,163 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.batch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Batch encoding of many Aztec codes of the same size.
+
+    The codewords of each symbol are still computed one at a time, but the
+    modules are placed with a single gather through a cached placement map,
+    which gives, for every module of the matrix, the index of its value in the
+    concatenation of the structure template, the data bits (in spiral order)
+    and the mode message bits. With numpy, one indexing operation places all
+    the symbols into an N×size×size array; without it, each symbol is placed
+    with one ``operator.itemgetter`` call into a shared buffer.
+
+    Payloads may be given as (buffer, offset, length) records, which are read
+    in place through a ``memoryview`` (e.g. of an ``mmap`` of a record file).
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+from functools import lru_cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import (
+    configs, _config_order, _byte_view,
+    plan, get_codewords, get_mode_message,
+    placement_map, structure_template, _placement, _codeword_bits,
+    AztecCode,
+)
+
+
+@lru_cache(maxsize=None)
+def _numpy_placement(size, compact):
+    sources = numpy.array(placement_map(size, compact), dtype=numpy.intp)
+    sources.flags.writeable = False
+    template = numpy.frombuffer(structure_template(size, compact), dtype=numpy.uint8)
+    return sources, template
+
+
+def place_codewords(codewords, data_cw_counts, size, compact, use_numpy=None):
+    """ Place the codewords of many symbols of the same size
+
+    :param codewords: sequence of lists of all codewords of each symbol (see :py:func:`get_codewords`)
+    :param data_cw_counts: number of data codewords of each symbol
+    :param size: size of matrix
+    :param compact: compactness flag
+    :param use_numpy: whether to use numpy (default: if it is installed)
+    :return: N×size×size ``numpy.ndarray`` of uint8 if using numpy, otherwise
+      a ``bytearray`` of N*size*size modules, symbol by symbol and row by row
+    """
+    config = configs[(size, compact)]
+    modes = {}
+    mode_codewords = [modes.get(count) or modes.setdefault(count, get_mode_message(compact, config.layers, count))
+                      for count in data_cw_counts]
+    count = len(mode_codewords)
+    n = size * size
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        sources, template = _numpy_placement(size, compact)
+        cw = numpy.array(codewords, dtype=numpy.uint16).reshape(count, config.codewords)
+        bits = (cw[:, :, None] >> numpy.arange(config.cw_bits - 1, -1, -1, dtype=numpy.uint16)) & 1
+        mode_cw_count = 7 if compact else 10
+        mode = numpy.array(mode_codewords, dtype=numpy.uint8).reshape(count, mode_cw_count)
+        mode_bits = (mode[:, :, None] >> numpy.arange(3, -1, -1, dtype=numpy.uint8)) & 1
+        stacked = numpy.concatenate((
+            numpy.broadcast_to(template, (count, n)),
+            bits.astype(numpy.uint8).reshape(count, config.codewords * config.cw_bits)[:, ::-1],
+            mode_bits.reshape(count, mode_cw_count * 4),
+        ), axis=1)
+        return stacked[:, sources].reshape(count, size, size)
+
+    gather = _placement(size, compact)
+    template = structure_template(size, compact)
+    modules = bytearray(count * n)
+    for ii, (cws, mode) in enumerate(zip(codewords, mode_codewords)):
+        stacked = template + _codeword_bits(cws, config.cw_bits)[::-1] + _codeword_bits(mode, 4)
+        modules[ii * n:(ii + 1) * n] = bytes(gather(stacked))
+    return modules
+
+
+class SymbolBatch(object):
+    """
+    Aztec codes of the same size, placed in one buffer
+    """
+
+    def __init__(self, data, size, compact, modules, data_cw_counts, ec_percent=23, encodings=None):
+        """
+        :param data: sequence of strings or bytes-like objects encoded
+        :param size: size of matrix
+        :param compact: compactness flag
+        :param modules: modules of all symbols, from :py:func:`place_codewords`
+        :param data_cw_counts: number of data codewords of each symbol
+        :param ec_percent: percentage of symbol capacity for error correction
+        :param encodings: encoding of each symbol (see :py:class:`AztecCode`;
+          the chosen one if encoding was 'auto' or a list), or None for none of them
+        """
+        self.data, self.size, self.compact, self.modules = data, size, compact, modules
+        self.data_cw_counts, self.ec_percent = data_cw_counts, ec_percent
+        self.encodings = (None,) * len(data_cw_counts) if encodings is None else encodings
+
+    def __len__(self):
+        return len(self.data_cw_counts)
+
+    def __getitem__(self, index):
+        """ Get the modules of one symbol, without copying them
+
+        :return: size×size ``numpy.ndarray`` view, or 2-dimensional ``memoryview`` (indexed with ``[y, x]``)
+        """
+        n = self.size * self.size
+        index = range(len(self))[index]
+        if numpy is not None and isinstance(self.modules, numpy.ndarray):
+            return self.modules[index]
+        return memoryview(self.modules)[index * n:(index + 1) * n].cast('B', (self.size, self.size))
+
+    def matrix(self, index):
+        """ Get the matrix of one symbol, as a list of rows """
+        modules = self[index]
+        if isinstance(modules, memoryview):
+            return [bytes(row) for row in modules.tolist()]
+        return list(modules)
+
+    def aztec_code(self, index):
+        """ Get one symbol as an :py:class:`AztecCode` (which copies its matrix) """
+        return AztecCode.from_matrix(self.matrix(index), self.compact, self.data[index], self.ec_percent,
+                                     self.encodings[index])
+
+
+def _payload(item):
+    """ Get a payload, viewing a (buffer, offset, length) record in place """
+    if isinstance(item, tuple):
+        buffer, offset, length = item
+        return _byte_view(buffer)[offset:offset + length]
+    return item
+
+
+def encode_batch(data, size=None, compact=None, ec_percent=23, encoding=None, use_numpy=None):
+    """ Encode many payloads into symbols of the same size
+
+    :param data: sequence of strings, bytes-like objects, or (buffer, offset, length) records to encode
+    :param size: size of matrix
+    :param compact: compactness flag
+      If size and compact are None (by default), the smallest symbol which
+      all of the payloads fit in is used, and data mustn't be empty.
+    :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+    :param encoding: see :py:class:`AztecCode`; with 'auto' or a list, it is chosen for each payload
+    :param use_numpy: whether to place the symbols with numpy (default: if it is installed)
+    :return: :py:class:`SymbolBatch`
+    """
+    data = [_payload(item) for item in data]
+    plans = [plan(item, size, compact, ec_percent, encoding) for item in data]
+    if size is None or compact is None:
+        if not plans:
+            raise ValueError('Cannot choose the symbol size for an empty batch; give size and compact')
+        size, compact = max(((p.size, p.compact) for p in plans), key=_config_order.__getitem__)
+    codewords, data_cw_counts = zip(*(get_codewords(p.sequence, size, compact) for p in plans)) if plans else ((), ())
+    modules = place_codewords(codewords, data_cw_counts, size, compact, use_numpy)
+    return SymbolBatch(data, size, compact, modules, data_cw_counts, ec_percent, tuple(p.encoding for p in plans))
@@ -0,0 +1,256 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.differential
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Differential testing of the optimized encoder against the frozen
+    reference implementations in :py:mod:`aztec_code_generator.reference`.
+
+    Generates payloads (random bytes, text heavy on mode boundaries, ECI
+    strings, maximum-capacity inputs, and exhaustive short strings), and
+    checks that both produce identical sequences, bits, symbol sizes,
+    codewords and matrices, timing each stage. Size estimates are checked
+    to count the same bits, and to find the same symbol.
+
+    Run with ``python -m aztec_code_generator.differential [--count N] [--seed S]``.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import argparse
+import codecs
+import itertools
+import random
+import time
+from collections import defaultdict
+
+from . import (
+    configs, encoding_to_eci,
+    find_optimal_sequence, optimal_sequence_to_bits, find_suitable_matrix_size, estimate_symbol, get_codewords,
+    AztecCode,
+)
+from . import reference
+
+# characters on either side of mode boundaries: punctuation pairs and their halves,
+# digits with their shared punctuation, upper/lower case, MIXED controls, and binary
+boundary_chunks = [
+    b'\r\n', b'. ', b', ', b': ', b'\r', b'\n', b'.', b',', b':', b' ',
+    b'0', b'7', b'A', b'Z', b'a', b'z', b'!', b'?', b'[', b'}',
+    b'@', b'\\', b'^', b'|', b'~', b'\t', b'\x1b', b'\x7f', b'\x01',
+    b'\x00', b'\x80', b'\xe9', b'\xff',
+]
+boundary_alphabet = b'Aa0. ,:\r\n@!\x80'
+
+# a pool of characters from many scripts, for ECI strings
+eci_pool = ('AZaz09 .,:!?\r\n@\\~'
+            'éüßñçåøÆŒœ€£¥©'
+            'ąęłńśźżőűčřšž'
+            'αβγδΩ' 'жщыЯЁ' 'אבגש' 'ابتث' 'çğış'
+            '中文字日本語ひらカタ한국어')
+
+
+def random_bytes(rnd, max_len=64):
+    return bytes(rnd.randrange(256) for ii in range(rnd.randint(0, max_len)))
+
+
+def boundary_text(rnd, max_len=64):
+    """ Runs of characters that force latches, shifts and punctuation pairs """
+    out = bytearray()
+    target = rnd.randint(0, max_len)
+    while len(out) < target:
+        chunk = rnd.choice(boundary_chunks)
+        # runs of binary bytes straddling the 31/32-byte B/S length boundary
+        run = rnd.choice((1, 1, 2, 3, 4, 5)) if chunk[0] < 0x80 else rnd.choice((1, 2, 30, 31, 32, 33))
+        out += chunk * run
+    return bytes(out)
+
+
+def eci_string(rnd, max_len=32):
+    """ A random string and an encoding (from :py:data:`encoding_to_eci`) which can represent it """
+    encoding = rnd.choice(sorted(encoding_to_eci))
+    chars = [c for c in eci_pool if _encodable(c, encoding)]
+    return ''.join(rnd.choice(chars) for ii in range(rnd.randint(1, max_len))), encoding
+
+
+def _encodable(c, encoding):
+    try:
+        c.encode(encoding)
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def max_capacity(rnd, max_size=None, ec_percent=23):
+    """ The longest prefix of a random payload that still fits in a symbol of at most max_size """
+    if max_size is None:
+        max_size = rnd.choice(sorted({size for size, compact in configs}))
+    kind = rnd.choice((random_bytes, boundary_text))
+    stream = b''
+    while len(stream) < 4000:
+        stream += kind(rnd, 256)
+
+    def fits(n):
+        try:
+            return find_suitable_matrix_size(stream[:n], ec_percent)[0] <= max_size
+        except Exception:
+            return False
+    lo, hi = 0, len(stream)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return stream[:lo]
+
+
+def exhaustive(alphabet=boundary_alphabet, max_len=3):
+    """ All strings over alphabet of up to max_len bytes """
+    for n in range(1, max_len + 1):
+        for t in itertools.product(alphabet, repeat=n):
+            yield bytes(t)
+
+
+class Mismatch(AssertionError):
+    pass
+
+
+class Harness(object):
+    """ Compare optimized and reference encoders on payloads, accumulating timings """
+
+    stages = ('sequence', 'bits', 'size', 'codewords', 'matrix')
+
+    def __init__(self):
+        self.count = 0
+        self.skipped = 0
+        self.times = defaultdict(lambda: [0.0, 0.0])
+
+    def _timed(self, stage, which, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args), None
+        except Exception as exc:
+            return None, exc
+        finally:
+            self.times[stage][which] += time.perf_counter() - start
+
+    def _same(self, stage, data, ref, fast):
+        (ref_value, ref_exc), (fast_value, fast_exc) = ref, fast
+        if ref_exc or fast_exc:
+            # the optimized encoder may raise a subclass (e.g. DataTooBigError) of the reference's exception
+            if ref_exc is None or not isinstance(fast_exc, type(ref_exc)):
+                raise Mismatch('%s of %r: reference %r, optimized %r'
+                               % (stage, data, ref_exc or ref_value, fast_exc or fast_value))
+            return False
+        if ref_value != fast_value:
+            raise Mismatch('%s of %r: reference %r, optimized %r' % (stage, data, ref_value, fast_value))
+        return True
+
+    def _agrees(self, data, size, estimate, bits):
+        """ Check that a size estimate counts the same bits, and finds the same symbol """
+        (size, size_exc), (estimate, estimate_exc) = size, estimate
+        if isinstance(estimate_exc, ValueError) and not len(data):
+            # estimates refuse empty data, which AztecCode can't place either
+            return
+        if size_exc or estimate_exc:
+            if type(size_exc) is not type(estimate_exc):
+                raise Mismatch('size estimate of %r: %r, estimated %r' % (data, size_exc or size, estimate_exc or estimate))
+        elif estimate.bits != len(bits[0]) or tuple(estimate[:2]) != size:
+            raise Mismatch('size estimate of %r: %r, estimated %r' % (data, size, estimate))
+
+    def check(self, data, ec_percent=23, encoding=None):
+        """ Compare all stages of encoding data
+        Raise :py:class:`Mismatch` if they differ
+
+        :return: True if compared all the way to the matrix, or False if both
+          implementations failed at the same stage, with the same exception type
+        """
+        self.count += 1
+        sequence = self._timed('sequence', 0, reference.find_optimal_sequence, data, encoding)
+        if not self._same('sequence', data, sequence, self._timed('sequence', 1, find_optimal_sequence, data, encoding)):
+            self.skipped += 1
+            return False
+        sequence = sequence[0]
+
+        bits = self._timed('bits', 0, reference.optimal_sequence_to_bits, sequence)
+        if not self._same('bits', data, bits, self._timed('bits', 1, optimal_sequence_to_bits, sequence)):
+            self.skipped += 1
+            return False
+
+        size = self._timed('size', 0, lambda: reference.find_suitable_matrix_size(data, ec_percent, encoding)[:2])
+        fast_size = self._timed('size', 1, lambda: find_suitable_matrix_size(data, ec_percent, encoding)[:2])
+        estimate = self._timed('size', 1, estimate_symbol, data, ec_percent, encoding)
+        self._agrees(data, fast_size, estimate, bits)
+        if not self._same('size', data, size, fast_size):
+            self.skipped += 1
+            return False
+        size, compact = size[0]
+
+        codewords = self._timed('codewords', 0, _reference_codewords, bits[0], size, compact)
+        if not self._same('codewords', data, codewords, self._timed('codewords', 1, get_codewords, sequence, size, compact)):
+            self.skipped += 1
+            return False
+
+        matrix = self._timed('matrix', 0, lambda: _matrix(reference.AztecCode(data, size, compact, ec_percent, encoding)))
+        self._same('matrix', data, matrix,
+                   self._timed('matrix', 1, lambda: _matrix(AztecCode(data, size, compact, ec_percent, encoding))))
+        return True
+
+    def report(self):
+        lines = ['%d payloads compared (%d failed identically in both)' % (self.count, self.skipped),
+                 '%-10s %12s %12s %8s' % ('stage', 'reference', 'optimized', 'speedup')]
+        for stage in self.stages:
+            ref, fast = self.times[stage]
+            lines.append('%-10s %11.3fs %11.3fs %7.1fx' % (stage, ref, fast, ref / fast if fast else float('inf')))
+        return '\n'.join(lines)
+
+
+def _reference_codewords(bits, size, compact):
+    config = configs[(size, compact)]
+    data_codewords = reference.get_data_codewords(bits, config.cw_bits)
+    data_cw_count = len(data_codewords)
+    codewords = data_codewords + [0] * (config.codewords - data_cw_count)
+    reference.reed_solomon(codewords, data_cw_count, config.codewords - data_cw_count,
+                           2 ** config.cw_bits, reference.polynomials[config.cw_bits])
+    return codewords, data_cw_count
+
+
+def _matrix(aztec_code):
+    return [list(line) for line in aztec_code.matrix]
+
+
+def run(count=200, seed=0, exhaustive_len=3, max_capacity_count=4, harness=None):
+    """ Run the differential tests
+
+    :param count: number of payloads of each random kind
+    :param seed: random seed
+    :param exhaustive_len: length of exhaustive strings over :py:data:`boundary_alphabet`
+    :param max_capacity_count: number of maximum-capacity payloads
+    :return: :py:class:`Harness`
+    """
+    rnd = random.Random(seed)
+    harness = harness or Harness()
+    for ii in range(count):
+        harness.check(random_bytes(rnd), rnd.choice((0, 10, 23, 50)))
+        harness.check(boundary_text(rnd), rnd.choice((0, 10, 23, 50)))
+        data, encoding = eci_string(rnd)
+        harness.check(data, 23, codecs.lookup(encoding).name)
+    for data in exhaustive(max_len=exhaustive_len):
+        harness.check(data)
+    for ii in range(max_capacity_count):
+        harness.check(max_capacity(rnd))
+    return harness
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Compare the optimized encoder with the frozen reference implementations.')
+    p.add_argument('-n', '--count', type=int, default=200, help='random payloads of each kind (default: %(default)s)')
+    p.add_argument('-s', '--seed', type=int, default=0)
+    p.add_argument('--exhaustive-len', type=int, default=3, help='length of exhaustive strings (default: %(default)s)')
+    p.add_argument('--max-capacity', type=int, default=4, help='maximum-capacity payloads (default: %(default)s)')
+    args = p.parse_args(argv)
+    print(run(args.count, args.seed, args.exhaustive_len, args.max_capacity).report())
+
+
+if __name__ == '__main__':
+    main()
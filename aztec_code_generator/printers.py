@@ -0,0 +1,93 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.printers
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Printer-ready raster commands for label and receipt printers, bit-packed
+    straight from an Aztec code's scanlines, without an intermediate image.
+
+    - :py:func:`zpl`: a ZPL II ``^GF`` graphic field, optionally with ZPL's
+      ASCII hex compression (repeat counts, ``,``/``!`` to fill the rest of a
+      row with white/black, and ``:`` to repeat the previous row).
+    - :py:func:`escpos`: an ESC/POS ``GS v 0`` raster bit image.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import re
+import struct
+
+_hex_run = re.compile(r'(.)\1*')
+
+
+def _zpl_count(n):
+    """ ZPL repeat count: 'g' to 'z' for 20 to 400 in steps of 20, then 'G' to 'Y' for 1 to 19 """
+    out = 'z' * (n // 400)
+    if n % 400 >= 20:
+        out += chr(ord('f') + n % 400 // 20)
+    if n % 20:
+        out += chr(ord('F') + n % 20)
+    return out
+
+
+def _zpl_row(hex_row):
+    """ Compress one row of ASCII hex with ZPL compression """
+    out = []
+    runs = [(m.group(1), len(m.group(0))) for m in _hex_run.finditer(hex_row)]
+    if runs and runs[-1][0] in '0F':
+        # fill the rest of the row with white (0) or black (F)
+        out_end = ',' if runs.pop()[0] == '0' else '!'
+    else:
+        out_end = ''
+    for char, n in runs:
+        out.append(char if n == 1 else _zpl_count(n) + char)
+    out.append(out_end)
+    return ''.join(out)
+
+
+def zpl(aztec_code, module_size=4, border=0, x=0, y=0, compress=True, label=True):
+    """ Render an Aztec code as a ZPL II ``^GF`` graphic field
+
+    :param aztec_code: :py:class:`AztecCode`
+    :param module_size: barcode module size in printer dots
+    :param border: barcode border size in modules
+    :param x: horizontal position of the field on the label, in dots
+    :param y: vertical position of the field on the label, in dots
+    :param compress: use ZPL compression of the ASCII hex data
+    :param label: wrap the field in ``^XA`` ... ``^XZ``, to print it as a label by itself
+    :return: ZPL bytes (ASCII)
+    """
+    rows = list(aztec_code._pixel_rows(module_size, border, dark=True))
+    stride = len(rows[0])
+    total = stride * len(rows)
+    if compress:
+        data, previous = [], None
+        for row in rows:
+            data.append(':' if row == previous else _zpl_row(row.hex().upper()))
+            previous = row
+    else:
+        data = [row.hex().upper() for row in rows]
+    field = '^FO%d,%d^GFA,%d,%d,%d,%s^FS' % (x, y, total, total, stride, ''.join(data))
+    return ('^XA' + field + '^XZ\n' if label else field).encode('ascii')
+
+
+def escpos(aztec_code, module_size=4, border=0, band_height=None):
+    """ Render an Aztec code as ESC/POS ``GS v 0`` raster bit image commands
+
+    :param aztec_code: :py:class:`AztecCode`
+    :param module_size: barcode module size in printer dots
+    :param border: barcode border size in modules
+    :param band_height: if set, split the image into commands of at most this many dot rows
+      (for printers with a limited raster buffer)
+    :return: ESC/POS bytes
+    """
+    rows = list(aztec_code._pixel_rows(module_size, border, dark=True))
+    stride = len(rows[0])
+    band_height = band_height or len(rows)
+    out = []
+    for start in range(0, len(rows), band_height):
+        band = rows[start:start + band_height]
+        # GS v 0, normal density, width in bytes and height in dots (little-endian)
+        out.append(b'\x1dv0\x00' + struct.pack('<HH', stride, len(band)))
+        out.extend(band)
+    return b''.join(out)
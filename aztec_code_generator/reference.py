@@ -0,0 +1,644 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.reference
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Frozen reference implementations of the encoder.
+
+    These are the straightforward implementations of the mode optimisation,
+    bit conversion, bit stuffing, Reed-Solomon coding and matrix placement
+    as they stood before any of them were reworked for speed. They are
+    deliberately left alone, so that :py:mod:`aztec_code_generator.differential`
+    can check the optimized code paths against them.
+
+    The only change is that :py:func:`find_suitable_matrix_size` respects
+    the limit on data codewords in compact symbols.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import array
+import codecs
+import numbers
+
+from . import (
+    configs, encoding_to_eci, polynomials, max_data_codewords,
+    Side, Mode, Latch, Shift, Misc,
+    code_chars, punct_2_chars, E, latch_len, shift_len, char_size,
+)
+
+
+def prod(x, y, log, alog, gf):
+    """ Product x times y """
+    if not x or not y:
+        return 0
+    return alog[(log[x] + log[y]) % (gf - 1)]
+
+
+def reed_solomon(wd, nd, nc, gf, pp):
+    """ Calculate error correction codewords
+
+    Algorithm is based on Aztec Code bar code symbology specification from
+    GOST-R-ISO-MEK-24778-2010 (Russian)
+    Takes ``nd`` data codeword values in ``wd`` and adds on ``nc`` check
+    codewords, all within GF(gf) where ``gf`` is a power of 2 and ``pp``
+    is the value of its prime modulus polynomial.
+
+    :param wd: data codewords (in/out param)
+    :param nd: number of data codewords
+    :param nc: number of error correction codewords
+    :param gf: Galois Field order
+    :param pp: prime modulus polynomial value
+    """
+    # generate log and anti log tables
+    log = {0: 1 - gf}
+    alog = {0: 1}
+    for i in range(1, gf):
+        alog[i] = alog[i - 1] * 2
+        if alog[i] >= gf:
+            alog[i] ^= pp
+        log[alog[i]] = i
+    # generate polynomial coeffs
+    c = {0: 1}
+    for i in range(1, nc + 1):
+        c[i] = 0
+    for i in range(1, nc + 1):
+        c[i] = c[i - 1]
+        for j in range(i - 1, 0, -1):
+            c[j] = c[j - 1] ^ prod(c[j], alog[i], log, alog, gf)
+        c[0] = prod(c[0], alog[i], log, alog, gf)
+    # generate codewords
+    for i in range(nd, nd + nc):
+        wd[i] = 0
+    for i in range(nd):
+        assert 0 <= wd[i] < gf
+        k = wd[nd] ^ wd[i]
+        for j in range(nc):
+            wd[nd + j] = prod(k, c[nc - j - 1], log, alog, gf)
+            if j < nc - 1:
+                wd[nd + j] ^= wd[nd + j + 1]
+
+
+def find_optimal_sequence(data, encoding=None):
+    """ Find optimal sequence, i.e. with minimum number of bits to encode data.
+
+    TODO: add support of FLG(n) processing
+
+    :param data: string or bytes to encode
+    :param encoding: see :py:class:`AztecCode`
+    :return: optimal sequence
+    """
+
+    # standardize encoding name, ensure that it's valid for ECI, and encode string to bytes
+    if encoding:
+        encoding = codecs.lookup(encoding).name
+        eci = encoding_to_eci[encoding]
+    else:
+        encoding = 'iso8859-1'
+        eci = None
+    if isinstance(data, str):
+        data = data.encode(encoding)
+
+    back_to = {m: Mode.UPPER for m in Mode}
+    cur_len = {m: 0 if m==Mode.UPPER else E for m in Mode}
+    cur_seq = {m: [] for m in Mode}
+    prev_c = None
+    for c in data:
+        for x in Mode:
+            for y in Mode:
+                if cur_len[x] + latch_len[x][y] < cur_len[y]:
+                    cur_len[y] = cur_len[x] + latch_len[x][y]
+                    cur_seq[y] = cur_seq[x][:]
+                    back_to[y] = y
+                    if y == Mode.BINARY:
+                        # for binary mode use B/S instead of B/L
+                        if x in (Mode.PUNCT, Mode.DIGIT):
+                            # if changing from punct or digit to binary mode use U/L as intermediate mode
+                            # TODO: update for digit
+                            back_to[y] = Mode.UPPER
+                            cur_seq[y] += [Latch.UPPER, Shift.BINARY, Misc.SIZE]
+                        else:
+                            back_to[y] = x
+                            cur_seq[y] += [Shift.BINARY, Misc.SIZE]
+                    elif cur_seq[x]:
+                        # if changing from punct or digit mode - use U/L as intermediate mode
+                        # TODO: update for digit
+                        if x == Mode.DIGIT and y == Mode.PUNCT:
+                            cur_seq[y] += [Misc.RESUME, Latch.UPPER, Latch.MIXED, Latch.PUNCT]
+                        elif x in (Mode.PUNCT, Mode.DIGIT) and y != Mode.UPPER:
+                            cur_seq[y] += [Misc.RESUME, Latch.UPPER, Latch[y.name]]
+                        elif x == Mode.LOWER and y == Mode.UPPER:
+                            cur_seq[y] += [Latch.DIGIT, Latch.UPPER]
+                        elif x in (Mode.UPPER, Mode.LOWER) and y == Mode.PUNCT:
+                            cur_seq[y] += [Latch.MIXED, Latch[y.name]]
+                        elif x == Mode.MIXED and y != Mode.UPPER:
+                            if y == Mode.PUNCT:
+                                cur_seq[y] += [Latch.PUNCT]
+                                back_to[y] = Mode.PUNCT
+                            else:
+                                cur_seq[y] += [Latch.UPPER, Latch.DIGIT]
+                                back_to[y] = Mode.DIGIT
+                            continue
+                        elif x == Mode.BINARY:
+                            # TODO: review this
+                            # Reviewed by jravallec
+                            if y == back_to[x]:
+                                # when return from binary to previous mode, skip mode change
+                                cur_seq[y] += [Misc.RESUME]
+                            elif y == Mode.UPPER:
+                                if back_to[x] == Mode.LOWER:
+                                    cur_seq[y] += [Misc.RESUME, Latch.DIGIT, Latch.UPPER]
+                                if back_to[x] == Mode.MIXED:
+                                    cur_seq[y] += [Misc.RESUME, Latch.UPPER]
+                            elif y == Mode.LOWER:
+                                cur_seq[y] += [Misc.RESUME, Latch.LOWER]
+                            elif y == Mode.MIXED:
+                                cur_seq[y] += [Misc.RESUME, Latch.MIXED]
+                            elif y == Mode.PUNCT:
+                                if back_to[x] == Mode.MIXED:
+                                    cur_seq[y] += [Misc.RESUME, Latch.PUNCT]
+                                else:
+                                    cur_seq[y] += [Misc.RESUME, Latch.MIXED, Latch.PUNCT]
+                            elif y == Mode.DIGIT:
+                                if back_to[x] == Mode.MIXED:
+                                    cur_seq[y] += [Misc.RESUME, Latch.UPPER, Latch.DIGIT]
+                                else:
+                                    cur_seq[y] += [Misc.RESUME, Latch.DIGIT]
+                        else:
+                            cur_seq[y] += [Misc.RESUME, Latch[y.name]]
+                    else:
+                        # if changing from punct or digit mode - use U/L as intermediate mode
+                        # TODO: update for digit
+                        if x in (Mode.PUNCT, Mode.DIGIT):
+                            cur_seq[y] = [Latch.UPPER, Latch[y.name]]
+                        elif x == Mode.LOWER and y == Mode.UPPER:
+                            cur_seq[y] = [Latch.DIGIT, Latch.UPPER]
+                        elif x in (Mode.BINARY, Mode.UPPER, Mode.LOWER) and y == Mode.PUNCT:
+                            cur_seq[y] = [Latch.MIXED, Latch[y.name]]
+                        else:
+                            cur_seq[y] = [Latch[y.name]]
+        next_len = {m:E for m in Mode}
+        next_seq = {m:[] for m in Mode}
+        possible_modes = [m for m in Mode if m == Mode.BINARY or c in code_chars[m]]
+        for x in possible_modes:
+            # TODO: review this!
+            if back_to[x] == Mode.DIGIT and x == Mode.LOWER:
+                cur_seq[x] += [Latch.UPPER, Latch.LOWER]
+                cur_len[x] += latch_len[back_to[x]][x]
+                back_to[x] = Mode.LOWER
+            # add char to current sequence
+            if cur_len[x] + char_size[x] < next_len[x]:
+                next_len[x] = cur_len[x] + char_size[x]
+                next_seq[x] = cur_seq[x] + [c]
+            for y in Mode:
+                if (y, x) in shift_len and cur_len[y] + shift_len[(y, x)] + char_size[x] < next_len[y]:
+                    next_len[y] = cur_len[y] + shift_len[y, x] + char_size[x]
+                    next_seq[y] = cur_seq[y] + [Shift[x.name], c]
+        # TODO: review this!!!
+        if prev_c and bytes((prev_c, c)) in punct_2_chars:
+            for x in Mode:
+                # Will never StopIteration because we must have one S/L already since prev_c is PUNCT
+                last_mode = next(s.value for s in reversed(cur_seq[x]) if isinstance(s, Latch) or isinstance(s, Shift))
+                if last_mode == Mode.PUNCT:
+                    last_c = cur_seq[x][-1]
+                    if isinstance(last_c, int) and bytes((last_c, c)) in punct_2_chars:
+                        if x != Mode.MIXED:  # we need to avoid this because it contains '\r', '\n' individually, but not combined
+                            if cur_len[x] < next_len[x]:
+                                next_len[x] = cur_len[x]
+                                next_seq[x] = cur_seq[x][:-1] + [ bytes((last_c, c)) ]
+        if len(next_seq[Mode.BINARY]) - 2 == 32:
+            next_len[Mode.BINARY] += 11
+        cur_len = next_len.copy()
+        cur_seq = next_seq.copy()
+        prev_c = c
+    # sort in ascending order and get shortest sequence
+    result_seq = []
+    sorted_cur_len = sorted(cur_len, key=cur_len.__getitem__)
+    if sorted_cur_len:
+        min_length = sorted_cur_len[0]
+        result_seq = cur_seq[min_length]
+    # update binary sequences' sizes
+    sizes = {}
+    result_seq_len = len(result_seq)
+    reset_pos = result_seq_len - 1
+    for i, c in enumerate(reversed(result_seq)):
+        if c == Misc.SIZE:
+            sizes[i] = reset_pos - (result_seq_len - i - 1)
+            reset_pos = result_seq_len - i
+        elif c == Misc.RESUME:
+            reset_pos = result_seq_len - i - 2
+    for size_pos in sizes:
+        result_seq[len(result_seq) - size_pos - 1] = sizes[size_pos]
+    # remove 'resume' tokens
+    result_seq = [x for x in result_seq if x != Misc.RESUME]
+    # update binary sequences' extra sizes
+    updated_result_seq = []
+    is_binary_length = False
+    for i, c in enumerate(result_seq):
+        if is_binary_length:
+            if c > 31:
+                updated_result_seq.append(0)
+                updated_result_seq.append(c - 31)
+            else:
+                updated_result_seq.append(c)
+            is_binary_length = False
+        else:
+            updated_result_seq.append(c)
+
+        if c == Shift.BINARY:
+            is_binary_length = True
+
+    if eci is not None:
+        updated_result_seq = [ Shift.PUNCT, Misc.FLG, len(str(eci)), eci ] + updated_result_seq
+
+    return updated_result_seq
+
+
+def optimal_sequence_to_bits(optimal_sequence):
+    """ Convert optimal sequence to bits
+
+    :param optimal_sequence: input optimal sequence
+    :return: string with bits
+    """
+    out_bits = ''
+    mode = prev_mode = Mode.UPPER
+    shift = False
+    sequence = optimal_sequence[:]
+    while sequence:
+        # read one item from sequence
+        ch = sequence.pop(0)
+        index = code_chars[mode].index(ch)
+        out_bits += bin(index)[2:].zfill(char_size[mode])
+        # resume previous mode for shift
+        if shift:
+            mode = prev_mode
+            shift = False
+        # get mode from sequence character
+        if isinstance(ch, Latch):
+            mode = ch.value
+        # handle FLG(n)
+        elif ch == Misc.FLG:
+            if not sequence:
+                raise Exception('Expected FLG(n) value')
+            flg_n = sequence.pop(0)
+            if not isinstance(flg_n, numbers.Number) or not 0 <= flg_n <= 7:
+                raise Exception('FLG(n) value must be a number from 0 to 7')
+            if flg_n == 7:
+                raise Exception('FLG(7) is reserved and currently illegal')
+
+            out_bits += bin(flg_n)[2:].zfill(3)
+            if flg_n >= 1:
+                # ECI
+                if not sequence:
+                    raise Exception('Expected FLG({}) to be followed by ECI code'.format(flg_n))
+                eci_code = sequence.pop(0)
+                if not isinstance(eci_code, numbers.Number) or not 0 <= eci_code < (10**flg_n):
+                    raise Exception('Expected FLG({}) ECI code to be a number from 0 to {}'.format(flg_n, (10**flg_n) - 1))
+                out_digits = str(eci_code).zfill(flg_n).encode()
+                for ch in out_digits:
+                    index = code_chars[Mode.DIGIT].index(ch)
+                    out_bits += bin(index)[2:].zfill(char_size[Mode.DIGIT])
+        # handle binary run
+        elif ch == Shift.BINARY:
+            if not sequence:
+                raise Exception('Expected binary sequence length')
+            # followed by a 5 bit length
+            seq_len = sequence.pop(0)
+            if not isinstance(seq_len, numbers.Number):
+                raise Exception('Binary sequence length must be a number')
+            out_bits += bin(seq_len)[2:].zfill(5)
+            # if length is zero - 11 additional length bits are used for length
+            if not seq_len:
+                seq_len = sequence.pop(0)
+                if not isinstance(seq_len, numbers.Number):
+                    raise Exception('Binary sequence length must be a number')
+                out_bits += bin(seq_len)[2:].zfill(11)
+                seq_len += 31
+            for binary_index in range(seq_len):
+                ch = sequence.pop(0)
+                out_bits += bin(ch)[2:].zfill(char_size[Mode.BINARY])
+        # handle other shift
+        elif isinstance(ch, Shift):
+            mode, prev_mode = ch.value, mode
+            shift = True
+    return out_bits
+
+
+def get_data_codewords(bits, codeword_size):
+    """ Get codewords stream from data bits sequence
+
+    Bit stuffing and padding are used to avoid all-zero and all-ones codewords
+
+    :param bits: input data bits
+    :param codeword_size: codeword size in bits
+    :return: data codewords
+    """
+    codewords = []
+    sub_bits = ''
+    for bit in bits:
+        sub_bits += bit
+        # if first bits of sub sequence are zeros add 1 as a last bit
+        if len(sub_bits) == codeword_size - 1 and sub_bits.find('1') < 0:
+            sub_bits += '1'
+        # if first bits of sub sequence are ones add 0 as a last bit
+        if len(sub_bits) == codeword_size - 1 and sub_bits.find('0') < 0:
+            sub_bits += '0'
+        # convert bits to decimal int and add to result codewords
+        if len(sub_bits) >= codeword_size:
+            codewords.append(int(sub_bits, 2))
+            sub_bits = ''
+    if sub_bits:
+        # update and add final bits
+        sub_bits = sub_bits.ljust(codeword_size, '1')
+        # change final bit to zero if all bits are ones
+        if sub_bits.find('0') < 0:
+            sub_bits = sub_bits[:-1] + '0'
+        codewords.append(int(sub_bits, 2))
+    return codewords
+
+
+def find_suitable_matrix_size(data, ec_percent=23, encoding=None):
+    """ Find suitable matrix size
+    Raise an exception if suitable size is not found
+
+    :param data: string or bytes to encode
+    :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+    :param encoding: see :py:class:`AztecCode`
+    :return: (size, compact) tuple
+    """
+    optimal_sequence = find_optimal_sequence(data, encoding)
+    out_bits = optimal_sequence_to_bits(optimal_sequence)
+    for (size, compact), config in configs.items():
+        # calculate data codewords
+        data_codewords = get_data_codewords(out_bits, config.cw_bits)
+        data_cw_count = len(data_codewords)
+
+        # calculate minimum required number of codewords to reach
+        # the desired level of error-correction
+        required_cw_count = (data_cw_count + 3) * 100.0 / (100 - ec_percent)
+
+        # if they fit in this size symbol, we're done
+        if required_cw_count < config.codewords and data_cw_count <= max_data_codewords[compact]:
+            return size, compact, optimal_sequence
+    raise Exception('Data too big to fit in one Aztec code!')
+
+class AztecCode(object):
+    """
+    Reference Aztec code matrix builder (without renderers)
+    """
+
+    def __init__(self, data, size=None, compact=None, ec_percent=23, encoding=None):
+        """ Create Aztec code with given data.
+        If size and compact parameters are None (by default), an
+        optimal size and compactness calculated based on the data.
+
+        :param data: string or bytes to encode
+        :param size: size of matrix
+        :param compact: compactness flag
+        :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+        :param encoding:
+          If set, sequence will include an initial ECI mark corresponding to the specified encoding (see :py:mod:`codecs`)
+          If unset, no ECI mark will be included and string must be encodable as 'iso8859-1'
+        """
+        self.data = data
+        self.encoding = encoding
+        self.sequence = None
+        self.ec_percent = ec_percent
+        if size is not None and compact is not None:
+            if (size, compact) in configs:
+                self.size, self.compact = size, compact
+            else:
+                raise Exception(
+                    'Given size and compact values (%s, %s) are not found in sizes table!' % (size, compact))
+        else:
+            self.size, self.compact, self.sequence = find_suitable_matrix_size(self.data, ec_percent, encoding)
+        self.__create_matrix()
+        self.__encode_data()
+
+    def __create_matrix(self):
+        """ Create Aztec code matrix with given size """
+        self.matrix = [array.array('B', (0 for jj in range(self.size))) for ii in range(self.size)]
+
+    def __add_finder_pattern(self):
+        """ Add bulls-eye finder pattern """
+        center = self.size // 2
+        ring_radius = 5 if self.compact else 7
+        for x in range(-ring_radius, ring_radius):
+            for y in range(-ring_radius, ring_radius):
+                self.matrix[center + y][center + x] = (max(abs(x), abs(y)) + 1) % 2
+
+    def __add_orientation_marks(self):
+        """ Add orientation marks to matrix """
+        center = self.size // 2
+        ring_radius = 5 if self.compact else 7
+        # add orientation marks
+        # left-top
+        self.matrix[center - ring_radius][center - ring_radius] = 1
+        self.matrix[center - ring_radius + 1][center - ring_radius] = 1
+        self.matrix[center - ring_radius][center - ring_radius + 1] = 1
+        # right-top
+        self.matrix[center - ring_radius + 0][center + ring_radius + 0] = 1
+        self.matrix[center - ring_radius + 1][center + ring_radius + 0] = 1
+        # right-down
+        self.matrix[center + ring_radius - 1][center + ring_radius + 0] = 1
+
+    def __add_reference_grid(self):
+        """ Add reference grid to matrix """
+        if self.compact:
+            return
+        center = self.size // 2
+        ring_radius = 5 if self.compact else 7
+        for x in range(-center, center + 1):
+            for y in range(-center, center + 1):
+                # skip finder pattern
+                if -ring_radius <= x <= ring_radius and -ring_radius <= y <= ring_radius:
+                    continue
+                # set pixel
+                if x % 16 == 0 or y % 16 == 0:
+                    self.matrix[center + y][center + x] = (x + y + 1) % 2
+
+    def __get_mode_message(self, layers_count, data_cw_count):
+        """ Get mode message
+
+        :param layers_count: number of layers
+        :param data_cw_count: number of data codewords
+        :return: mode message codewords
+        """
+        if self.compact:
+            # for compact mode - 2 bits with layers count and 6 bits with data codewords count
+            mode_word = '{0:02b}{1:06b}'.format(layers_count - 1, data_cw_count - 1)
+            # two 4 bits initial codewords with 5 Reed-Solomon check codewords
+            init_codewords = [int(mode_word[i:i + 4], 2) for i in range(0, 8, 4)]
+            total_cw_count = 7
+        else:
+            # for full mode - 5 bits with layers count and 11 bits with data codewords count
+            mode_word = '{0:05b}{1:011b}'.format(layers_count - 1, data_cw_count - 1)
+            # four 4 bits initial codewords with 6 Reed-Solomon check codewords
+            init_codewords = [int(mode_word[i:i + 4], 2) for i in range(0, 16, 4)]
+            total_cw_count = 10
+        # fill Reed-Solomon check codewords with zeros
+        init_cw_count = len(init_codewords)
+        codewords = (init_codewords + [0] * (total_cw_count - init_cw_count))[:total_cw_count]
+        # update Reed-Solomon check codewords using GF(16)
+        reed_solomon(codewords, init_cw_count, total_cw_count - init_cw_count, 16, polynomials[4])
+        return codewords
+
+    def __add_mode_info(self, data_cw_count):
+        """ Add mode info to matrix
+
+        :param data_cw_count: number of data codewords.
+        """
+        config = configs[(self.size, self.compact)]
+        layers_count = config.layers
+        mode_data_values = self.__get_mode_message(layers_count, data_cw_count)
+        mode_data_bits = ''.join('{0:04b}'.format(v) for v in mode_data_values)
+
+        center = self.size // 2
+        ring_radius = 5 if self.compact else 7
+        side_size = 7 if self.compact else 11
+        x = 0
+        y = 0
+        index = 0
+        for bit in mode_data_bits:
+            # for full mode take a reference grid into account
+            if not self.compact:
+                if (index % side_size) == 5:
+                    index += 1
+            if 0 <= index < side_size:
+                # top
+                x = index + 2 - ring_radius
+                y = -ring_radius
+            elif side_size <= index < side_size * 2:
+                # right
+                x = ring_radius
+                y = index % side_size + 2 - ring_radius
+            elif side_size * 2 <= index < side_size * 3:
+                # bottom
+                x = ring_radius - index % side_size - 2
+                y = ring_radius
+            elif side_size * 3 <= index < side_size * 4:
+                # left
+                x = -ring_radius
+                y = ring_radius - index % side_size - 2
+            # set pixel
+            self.matrix[center + y][center + x] = (bit == '1')
+            index += 1
+
+    def __add_data(self, data, encoding):
+        """ Add data to encode to the matrix
+
+        :param data: data to encode
+        :param encoding: see :py:class:`AztecCode`
+        :return: number of data codewords
+        """
+        if not self.sequence:
+            self.sequence = find_optimal_sequence(data, encoding)
+        out_bits = optimal_sequence_to_bits(self.sequence)
+        config = configs[(self.size, self.compact)]
+        layers_count = config.layers
+        cw_count = config.codewords
+        cw_bits = config.cw_bits
+
+        # calculate data codewords, and ensure data will fit
+        data_codewords = get_data_codewords(out_bits, cw_bits)
+        data_cw_count = len(data_codewords)
+        if data_cw_count > cw_count:
+            raise Exception('Data too big to fit in Aztec code with current size!')
+
+        # add Reed-Solomon codewords to init data codewords
+        codewords = (data_codewords + [0] * (cw_count - data_cw_count))[:cw_count]
+        reed_solomon(codewords, data_cw_count, cw_count - data_cw_count, 2 ** cw_bits, polynomials[cw_bits])
+
+        center = self.size // 2
+        ring_radius = 5 if self.compact else 7
+
+        num = 2
+        side = Side.top
+        layer_index = 0
+        pos_x = center - ring_radius
+        pos_y = center - ring_radius - 1
+        full_bits = ''.join(bin(cw)[2:].zfill(cw_bits) for cw in codewords)[::-1]
+        for i in range(0, len(full_bits), 2):
+            num += 1
+            max_num = ring_radius * 2 + layer_index * 4 + (4 if self.compact else 3)
+            bits_pair = [(bit == '1') for bit in full_bits[i:i + 2]]
+            if layer_index >= layers_count:
+                raise Exception('Maximum layer count for current size is exceeded!')
+            if side == Side.top:
+                # move right
+                dy0 = 1 if not self.compact and (center - pos_y) % 16 == 0 else 0
+                dy1 = 2 if not self.compact and (center - pos_y + 1) % 16 == 0 else 1
+                self.matrix[pos_y - dy0][pos_x] = bits_pair[0]
+                self.matrix[pos_y - dy1][pos_x] = bits_pair[1]
+                pos_x += 1
+                if num > max_num:
+                    num = 2
+                    side = Side.right
+                    pos_x -= 1
+                    pos_y += 1
+                # skip reference grid
+                if not self.compact and (center - pos_x) % 16 == 0:
+                    pos_x += 1
+                if not self.compact and (center - pos_y) % 16 == 0:
+                    pos_y += 1
+            elif side == Side.right:
+                # move down
+                dx0 = 1 if not self.compact and (center - pos_x) % 16 == 0 else 0
+                dx1 = 2 if not self.compact and (center - pos_x + 1) % 16 == 0 else 1
+                self.matrix[pos_y][pos_x - dx0] = bits_pair[1]
+                self.matrix[pos_y][pos_x - dx1] = bits_pair[0]
+                pos_y += 1
+                if num > max_num:
+                    num = 2
+                    side = Side.bottom
+                    pos_x -= 2
+                    if not self.compact and (center - pos_x - 1) % 16 == 0:
+                        pos_x -= 1
+                    pos_y -= 1
+                # skip reference grid
+                if not self.compact and (center - pos_y) % 16 == 0:
+                    pos_y += 1
+                if not self.compact and (center - pos_x) % 16 == 0:
+                    pos_x -= 1
+            elif side == Side.bottom:
+                # move left
+                dy0 = 1 if not self.compact and (center - pos_y) % 16 == 0 else 0
+                dy1 = 2 if not self.compact and (center - pos_y + 1) % 16 == 0 else 1
+                self.matrix[pos_y - dy0][pos_x] = bits_pair[1]
+                self.matrix[pos_y - dy1][pos_x] = bits_pair[0]
+                pos_x -= 1
+                if num > max_num:
+                    num = 2
+                    side = Side.left
+                    pos_x += 1
+                    pos_y -= 2
+                    if not self.compact and (center - pos_y - 1) % 16 == 0:
+                        pos_y -= 1
+                # skip reference grid
+                if not self.compact and (center - pos_x) % 16 == 0:
+                    pos_x -= 1
+                if not self.compact and (center - pos_y) % 16 == 0:
+                    pos_y -= 1
+            elif side == Side.left:
+                # move up
+                dx0 = 1 if not self.compact and (center - pos_x) % 16 == 0 else 0
+                dx1 = 2 if not self.compact and (center - pos_x - 1) % 16 == 0 else 1
+                self.matrix[pos_y][pos_x + dx1] = bits_pair[0]
+                self.matrix[pos_y][pos_x + dx0] = bits_pair[1]
+                pos_y -= 1
+                if num > max_num:
+                    num = 2
+                    side = Side.top
+                    layer_index += 1
+                # skip reference grid
+                if not self.compact and (center - pos_y) % 16 == 0:
+                    pos_y -= 1
+        return data_cw_count
+
+    def __encode_data(self):
+        """ Encode data """
+        self.__add_finder_pattern()
+        self.__add_orientation_marks()
+        self.__add_reference_grid()
+        data_cw_count = self.__add_data(self.data, self.encoding)
+        self.__add_mode_info(data_cw_count)
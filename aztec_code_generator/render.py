@@ -0,0 +1,46 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.render
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Rendering encoded Aztec codes to PNG, SVG or text, whole or in chunks,
+    for the HTTP service and the worker processes of the shared memory transport.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+from io import BytesIO, StringIO
+
+
+def render_code(aztec_code, format='png', module_size=2, border=0):
+    """ Render an already encoded Aztec code to bytes
+
+    :param aztec_code: :py:class:`AztecCode`
+    :param format: one of ``png``, ``svg`` or ``txt``
+    :param module_size: barcode module size in pixels (ignored for ``txt``)
+    :param border: barcode border size in modules
+    :return: rendered bytes
+    """
+    if format == 'txt':
+        f = StringIO()
+        aztec_code.print_out(border=border, file=f)
+        return f.getvalue().encode()
+    f = BytesIO()
+    aztec_code.save(f, module_size=module_size, border=border, format=format.upper())
+    return f.getvalue()
+
+
+def render_stream(aztec_code, format='png', module_size=2, border=0):
+    """ Render an Aztec code in chunks
+
+    :param aztec_code: :py:class:`AztecCode`
+    :param format: one of ``png``, ``svg`` or ``txt``
+    :param module_size: barcode module size in pixels (ignored for ``txt``)
+    :param border: barcode border size in modules
+    :return: :py:class:`RenderStream`
+    """
+    if format == 'txt':
+        return aztec_code.iter_text(border)
+    if format == 'svg':
+        return aztec_code.iter_svg(module_size, border)
+    return aztec_code.iter_png(module_size, border)
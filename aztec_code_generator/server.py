@@ -0,0 +1,343 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.server
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Local HTTP rendering service for Aztec codes, using only the standard library.
+
+    Run with ``python -m aztec_code_generator serve [--port PORT] ...``.
+
+    ``GET /render?data=...`` or ``POST /render`` (payload in the request body)
+    renders a symbol. Optional query parameters are ``format`` (``png``,
+    ``svg`` or ``txt``), ``module_size``, ``border``, ``ec_percent`` and
+    ``encoding``. ``GET /metrics`` returns plain-text counters.
+
+    Workers only encode symbols; the cache holds bit-packed matrices, and
+    responses are rendered in chunks as they are sent (see
+    :py:class:`RenderStream`), so no whole rendered output is ever held in memory.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import argparse
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from . import AztecCode, DataTooBigError, check_admission
+from .render import render_stream
+from .store import pack_matrix, unpack_matrix
+
+content_types = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'txt': 'text/plain; charset=utf-8',
+}
+
+
+def encode(data, ec_percent=23, encoding=None):
+    """ Encode an Aztec code to a compact form for the cache
+
+    This is the unit of work run in the server's worker pool.
+
+    :return: bytes holding the symbol size, compactness flag and bit-packed matrix
+    """
+    aztec_code = AztecCode(data, ec_percent=ec_percent, encoding=encoding)
+    return bytes((aztec_code.size, aztec_code.compact)) + pack_matrix(aztec_code.matrix)
+
+
+def decode(encoded):
+    """ Get the :py:class:`AztecCode` from the output of :py:func:`encode` """
+    return AztecCode.from_matrix(unpack_matrix(encoded[2:], encoded[0]), bool(encoded[1]))
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_params(query, body=None):
+    """ Parse and validate render parameters
+
+    :param query: URL query string
+    :param body: request body, which replaces the ``data`` query parameter if given
+    :return: dict of the data and render parameters
+    """
+    qs = parse_qs(query, keep_blank_values=True)
+
+    def get(name, default=None):
+        values = qs.get(name)
+        return values[-1] if values else default
+
+    try:
+        params = dict(
+            format=get('format', 'png').lower(),
+            module_size=int(get('module_size', 2)),
+            border=int(get('border', 0)),
+            ec_percent=int(get('ec_percent', 23)),
+            encoding=get('encoding') or None,
+        )
+    except ValueError as exc:
+        raise BadRequest(str(exc))
+    if params['format'] not in content_types:
+        raise BadRequest('format must be one of: ' + ', '.join(content_types))
+    if not 1 <= params['module_size'] <= 64:
+        raise BadRequest('module_size must be from 1 to 64')
+    if not 0 <= params['border'] <= 64:
+        raise BadRequest('border must be from 0 to 64')
+    if not 0 <= params['ec_percent'] < 100:
+        raise BadRequest('ec_percent must be from 0 to 99')
+    if body is not None:
+        params['data'] = body
+    elif 'data' in qs:
+        params['data'] = get('data')
+    else:
+        raise BadRequest('missing data')
+    return params
+
+
+def etag(params):
+    """ Compute the ETag for a set of render parameters """
+    h = hashlib.sha256()
+    for key in sorted(params):
+        value = params[key]
+        if key == 'data':
+            h.update(b'b' if isinstance(value, bytes) else b's')
+            value = value if isinstance(value, bytes) else value.encode('utf-8', 'surrogatepass')
+        else:
+            value = repr(value).encode()
+        h.update(key.encode() + b'=%d:' % len(value) + value)
+    return '"%s"' % h.hexdigest()[:32]
+
+
+class Metrics(object):
+    """ Thread-safe request counters """
+
+    names = ('requests', 'rendered', 'cache_hits', 'not_modified', 'rejected', 'too_big', 'errors')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.names, 0)
+        self.render_seconds = 0.0
+
+    def incr(self, name, render_seconds=0.0):
+        with self._lock:
+            self.counts[name] += 1
+            self.render_seconds += render_seconds
+
+    def text(self, **extra):
+        with self._lock:
+            lines = ['aztec_%s_total %d' % kv for kv in self.counts.items()]
+            lines.append('aztec_render_seconds_total %.6f' % self.render_seconds)
+        lines.extend('aztec_%s %d' % kv for kv in extra.items())
+        return '\n'.join(lines) + '\n'
+
+
+class LRUCache(object):
+    """ Thread-safe least-recently-used cache of encoded symbols, bounded by total size """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._items[key] = value
+            self.nbytes += len(value)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class AztecHTTPServer(ThreadingHTTPServer):
+    """ HTTP server rendering Aztec codes in a bounded worker pool
+
+    :param address: (host, port) to listen on
+    :param workers: number of worker processes (or threads)
+    :param queue_size: maximum number of renders queued or running; further requests get 503
+    :param cache_bytes: size of the cache of encoded symbols
+    :param threads: use a thread pool instead of a process pool
+    :param max_body: maximum POST body size in bytes
+    :param quiet: don't log requests
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, queue_size=64, cache_bytes=32 << 20, threads=False, max_body=1 << 16,
+                 quiet=False):
+        super().__init__(address, AztecRequestHandler)
+        self.executor = (ThreadPoolExecutor if threads else ProcessPoolExecutor)(workers)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.cache = LRUCache(cache_bytes)
+        self.metrics = Metrics()
+        self.max_body = max_body
+        self.quiet = quiet
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class AztecRequestHandler(BaseHTTPRequestHandler):
+    """ Request handler for :py:class:`AztecHTTPServer`, with keep-alive """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'aztec_code_generator'
+    # headers and body are written separately; don't let Nagle delay the body on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            text = self.server.metrics.text(cache_entries=len(self.server.cache), cache_bytes=self.server.cache.nbytes)
+            self.send_body(HTTPStatus.OK, text.encode(), 'text/plain; charset=utf-8')
+        elif url.path == '/render':
+            self.render(url.query)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            return self.send_error(HTTPStatus.NOT_FOUND)
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return self.send_error(HTTPStatus.LENGTH_REQUIRED)
+        if length < 0:
+            self.close_connection = True
+            return self.send_error(HTTPStatus.BAD_REQUEST, 'Content-Length must not be negative')
+        if length > self.server.max_body:
+            self.close_connection = True
+            return self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        self.render(url.query, self.rfile.read(length))
+
+    def render(self, query, body=None):
+        server = self.server
+        server.metrics.incr('requests')
+        try:
+            params = parse_params(query, body)
+        except BadRequest as exc:
+            server.metrics.incr('errors')
+            return self.send_error(HTTPStatus.BAD_REQUEST, str(exc))
+
+        # answer conditional requests and repeats without re-encoding
+        tag = etag(params)
+        if tag in (t.strip() for t in self.headers.get('If-None-Match', '').split(',')):
+            server.metrics.incr('not_modified')
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', tag)
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        # symbols are cached once for all output formats and sizes
+        key = etag({name: params[name] for name in ('data', 'ec_percent', 'encoding')})
+        encoded = server.cache.get(key)
+        if encoded is not None:
+            server.metrics.incr('cache_hits')
+            return self.send_stream(params, encoded, tag)
+
+        # refuse payloads which certainly can't fit, before they take a worker
+        try:
+            check_admission(params['data'], params['ec_percent'], params['encoding'])
+        except DataTooBigError as exc:
+            server.metrics.incr('too_big')
+            return self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, str(exc))
+        except Exception as exc:
+            server.metrics.incr('errors')
+            return self.send_error(HTTPStatus.BAD_REQUEST, str(exc))
+
+        # bounded queue: shed load rather than piling up work
+        if not server.slots.acquire(blocking=False):
+            server.metrics.incr('rejected')
+            self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        try:
+            start = time.perf_counter()
+            encoded = server.executor.submit(encode, params['data'], params['ec_percent'], params['encoding']).result()
+        except DataTooBigError as exc:
+            server.metrics.incr('too_big')
+            return self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, str(exc))
+        except Exception as exc:
+            server.metrics.incr('errors')
+            return self.send_error(HTTPStatus.BAD_REQUEST, str(exc))
+        finally:
+            server.slots.release()
+        server.metrics.incr('rendered', time.perf_counter() - start)
+        server.cache.put(key, encoded)
+        self.send_stream(params, encoded, tag)
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, params, encoded, tag):
+        """ Render an encoded symbol as it is sent, with chunked transfer encoding if its length isn't known """
+        stream = render_stream(decode(encoded), params['format'], params['module_size'], params['border'])
+        self.send_response(HTTPStatus.OK)
+        for name, value in stream.headers():
+            self.send_header(name, value)
+        chunked = stream.content_length is None
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('ETag', tag)
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.end_headers()
+        for chunk in stream:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='python -m aztec_code_generator serve',
+                                description='Serve Aztec codes as PNG, SVG or text over HTTP.')
+    p.add_argument('--host', default='127.0.0.1', help='address to listen on (default: %(default)s)')
+    p.add_argument('--port', type=int, default=8080, help='port to listen on (default: %(default)s)')
+    p.add_argument('--workers', type=int, help='number of worker processes (default: CPU count)')
+    p.add_argument('--threads', action='store_true', help='use worker threads instead of processes')
+    p.add_argument('--queue-size', type=int, default=64, help='maximum renders in flight (default: %(default)s)')
+    p.add_argument('--cache-mb', type=int, default=32, help='rendered-output cache size (default: %(default)s MiB)')
+    p.add_argument('--max-body', type=int, default=1 << 16, help='maximum POST body size (default: %(default)s bytes)')
+    p.add_argument('-q', '--quiet', action='store_true', help="don't log requests")
+    args = p.parse_args(argv)
+
+    server = AztecHTTPServer((args.host, args.port), workers=args.workers, queue_size=args.queue_size,
+                             cache_bytes=args.cache_mb << 20, threads=args.threads, max_body=args.max_body,
+                             quiet=args.quiet)
+    print('Serving Aztec codes on http://{}:{}/render'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,198 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.sheet
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Label sheets: many Aztec codes laid out in a grid on one bilevel raster.
+
+    Modules are written straight into a single packed 1-bit buffer (which may
+    be backed by a memory-mapped file, for sheets larger than RAM), and the
+    buffer is written out as PBM, PNG or TIFF without any intermediate image
+    objects.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import math
+import mmap
+import struct
+from io import IOBase
+from pathlib import Path
+
+from . import pack_scanline, _png_chunks
+
+# PBM and TIFF (WhiteIsZero) use 1 for black; PNG grayscale uses 0 for black
+_invert = bytes(255 - ii for ii in range(256))
+
+
+class Sheet(object):
+    """
+    Bilevel raster holding a grid of Aztec codes
+    """
+
+    def __init__(self, rows, columns, cell_size, module_size=2, border=0, gutter=0, backing_file=None):
+        """ Create an empty (white) sheet.
+
+        :param rows: number of rows of symbols
+        :param columns: number of columns of symbols
+        :param cell_size: size of each cell in modules (the largest symbol size to be placed)
+        :param module_size: barcode module size in pixels
+        :param border: border around each symbol, in modules
+        :param gutter: extra space between cells, in pixels
+        :param backing_file: if set, path of a file to hold the raster, which is memory-mapped
+          instead of allocated in RAM (the file is created or overwritten)
+        """
+        self.rows, self.columns = rows, columns
+        self.cell_size, self.module_size, self.border, self.gutter = cell_size, module_size, border, gutter
+        self.cell_pixels = (cell_size + 2 * border) * module_size
+        self.width = columns * self.cell_pixels + (columns - 1) * gutter
+        self.height = rows * self.cell_pixels + (rows - 1) * gutter
+        self.stride = (self.width + 7) // 8
+        nbytes = self.stride * self.height
+        if backing_file is None:
+            self._file = None
+            self.buffer = bytearray(nbytes)
+        else:
+            self._file = open(backing_file, 'w+b')
+            self._file.truncate(nbytes)
+            self.buffer = mmap.mmap(self._file.fileno(), nbytes)
+
+    def close(self):
+        """ Release the raster buffer, and close its backing file """
+        if self._file is not None:
+            self.buffer.close()
+            self._file.close()
+            self._file = None
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def place(self, row, column, aztec_code):
+        """ Draw an Aztec code into a cell, centered
+
+        :param row: row of the cell
+        :param column: column of the cell
+        :param aztec_code: :py:class:`AztecCode` (or anything with ``size`` and ``scanlines``)
+        """
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            raise IndexError('Cell (%d, %d) is outside the %dx%d sheet' % (row, column, self.rows, self.columns))
+        if aztec_code.size > self.cell_size:
+            raise ValueError('Symbol size %d is larger than the cell size %d' % (aztec_code.size, self.cell_size))
+        ms = self.module_size
+        offset = ((self.cell_size - aztec_code.size) // 2 + self.border) * ms
+        x0 = column * (self.cell_pixels + self.gutter) + offset
+        y0 = row * (self.cell_pixels + self.gutter) + offset
+
+        # byte span of each pixel row of the symbol, and its bit alignment within that span
+        width = aztec_code.size * ms
+        first = x0 // 8
+        nbytes = (x0 + width + 7) // 8 - first
+        shift = 8 * nbytes - (x0 % 8) - width
+        buf, stride = self.buffer, self.stride
+        for yy, runs in enumerate(aztec_code.scanlines):
+            packed = (pack_scanline(runs, aztec_code.size, ms) << shift).to_bytes(nbytes, 'big')
+            start = (y0 + yy * ms) * stride + first
+            for pos in range(start, start + ms * stride, stride):
+                # edge bytes may be shared with neighbouring cells
+                buf[pos] |= packed[0]
+                if nbytes > 1:
+                    buf[pos + 1:pos + nbytes - 1] = packed[1:-1]
+                    buf[pos + nbytes - 1] |= packed[-1]
+
+    def _rows(self):
+        """ Yield each packed pixel row (1 is black, padded to a whole byte) """
+        buf, stride = self.buffer, self.stride
+        for pos in range(0, stride * self.height, stride):
+            yield buf[pos:pos + stride]
+
+    def save(self, filename, format=None):
+        """ Save the sheet to an image file
+
+        :param filename: output image filename (or file object, with format)
+        :param format: 'PBM', 'PNG' or 'TIFF'; if unspecified, taken from the filename extension
+        """
+        if format is None:
+            format = Path(filename).suffix[1:]
+        writers = {'PBM': self.save_pbm, 'PNG': self.save_png, 'TIF': self.save_tiff, 'TIFF': self.save_tiff}
+        writer = writers.get(format.upper())
+        if writer is None:
+            raise ValueError('Unsupported sheet format %r' % format)
+        return writer(filename)
+
+    def _write(self, filename, chunks):
+        f = filename if isinstance(filename, IOBase) else open(filename, 'wb')
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+        finally:
+            if f is not filename:
+                f.close()
+
+    def save_pbm(self, filename):
+        """ Save the sheet as a binary PBM (P4) file """
+        def chunks():
+            yield b'P4\n%d %d\n' % (self.width, self.height)
+            yield from self._rows()
+        self._write(filename, chunks())
+
+    def save_png(self, filename, level=6):
+        """ Save the sheet as a 1-bit grayscale PNG file, compressing row by row """
+        rows = (row.translate(_invert) for row in self._rows())
+        self._write(filename, _png_chunks(self.width, self.height, rows, level))
+
+    def save_tiff(self, filename):
+        """ Save the sheet as an uncompressed bilevel TIFF file """
+        nbytes = self.stride * self.height
+        if nbytes + 256 >= 1 << 32:
+            raise ValueError('Sheet is too large for a TIFF file')
+
+        def chunks():
+            ifd_offset = 8 + nbytes + (nbytes & 1)
+            resolution_offset = ifd_offset + 2 + 12 * 12 + 4
+            entries = (
+                (256, 4, self.width),               # ImageWidth
+                (257, 4, self.height),              # ImageLength
+                (258, 3, 1),                        # BitsPerSample
+                (259, 3, 1),                        # Compression: none
+                (262, 3, 0),                        # PhotometricInterpretation: WhiteIsZero
+                (273, 4, 8),                        # StripOffsets
+                (277, 3, 1),                        # SamplesPerPixel
+                (278, 4, self.height),              # RowsPerStrip
+                (279, 4, nbytes),                   # StripByteCounts
+                (282, 5, resolution_offset),        # XResolution
+                (283, 5, resolution_offset + 8),    # YResolution
+                (296, 3, 1),                        # ResolutionUnit: none
+            )
+            yield b'II*\x00' + struct.pack('<I', ifd_offset)
+            yield from self._rows()
+            if nbytes & 1:
+                yield b'\x00'
+            yield struct.pack('<H', len(entries))
+            for tag, kind, value in entries:
+                yield struct.pack('<HHIHH' if kind == 3 else '<HHII', tag, kind, 1, value, *((0,) if kind == 3 else ()))
+            yield struct.pack('<I', 0)
+            yield struct.pack('<IIII', 1, 1, 1, 1)
+        self._write(filename, chunks())
+
+
+def render_sheet(codes, columns, module_size=2, border=0, gutter=0, backing_file=None):
+    """ Lay out Aztec codes in rows on a single sheet
+
+    :param codes: sequence of :py:class:`AztecCode`, placed left to right, top to bottom
+    :param columns: number of columns of symbols
+    :param module_size: barcode module size in pixels
+    :param border: border around each symbol, in modules
+    :param gutter: extra space between cells, in pixels
+    :param backing_file: see :py:class:`Sheet`
+    :return: :py:class:`Sheet`
+    """
+    rows = max(1, math.ceil(len(codes) / columns))
+    cell_size = max((code.size for code in codes), default=0)
+    sheet = Sheet(rows, columns, cell_size, module_size, border, gutter, backing_file)
+    for ii, code in enumerate(codes):
+        sheet.place(*divmod(ii, columns), code)
+    return sheet
@@ -0,0 +1,260 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.store
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Persistent, content-addressed store of encoded Aztec codes, shared by processes.
+
+    A store is a directory holding two append-only files: ``symbols.dat``, a
+    sequence of records each holding a bit-packed matrix (and the name of the
+    encoding used, which may have been chosen by the encoder), and ``symbols.idx``,
+    a hash index of (key, offset) entries. Readers ``mmap`` the data file, so
+    any number of processes can read the same symbols without copying them.
+    Appends and compaction are serialized with an exclusive ``flock`` on
+    ``symbols.lock``; compaction replaces both files, and readers holding the
+    old ones notice (by inode at each lookup, or by a record whose key doesn't
+    match) and reopen.
+
+    Keys are hashes of the encoding parameters, so a store should be emptied
+    (or a new directory used) when upgrading to an encoder that produces
+    different symbols.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking (e.g. on Windows): only one process may append at a time
+    fcntl = None
+
+from . import AztecCode, _byte_view
+
+_record = struct.Struct('<16sBBHB')  # key, size, compact, number of packed bytes, length of encoding name
+_entry = struct.Struct('<16sQ')      # key, offset of record in data file
+_bits_to_modules = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def symbol_key(data, size=None, compact=None, ec_percent=23, encoding=None, strategy='optimal'):
+    """ Compute the store key for the parameters of :py:class:`AztecCode`
+
+    :return: 16-byte digest
+    """
+    h = hashlib.blake2b(digest_size=16, person=b'aztec-store-2')
+    raw = data.encode('utf-8', 'surrogatepass') if isinstance(data, str) else _byte_view(data)
+    h.update(b's' if isinstance(data, str) else b'b')
+    h.update(struct.pack('<Q', len(raw)) + raw)
+    h.update(repr((size, compact, ec_percent, encoding, strategy)).encode())
+    return h.digest()
+
+
+def pack_matrix(matrix):
+    """ Pack a square matrix into bytes, row by row, 8 modules per byte (first module most significant) """
+    size = len(matrix)
+    bits = int(''.join('1' if m else '0' for line in matrix for m in line) or '0', 2)
+    nbytes = (size * size + 7) // 8
+    return (bits << (8 * nbytes - size * size)).to_bytes(nbytes, 'big')
+
+
+def unpack_matrix(packed, size):
+    """ Unpack bytes from :py:func:`pack_matrix` into a list of ``array('B')`` rows """
+    modules = format(int.from_bytes(packed, 'big'), '0%db' % (8 * len(packed))).encode().translate(_bits_to_modules)
+    return [array.array('B', modules[pos:pos + size]) for pos in range(0, size * size, size)]
+
+
+class SymbolStore(object):
+    """
+    Persistent store of encoded Aztec codes, safe to share between threads and processes
+    """
+
+    def __init__(self, directory):
+        """ Open (or create) a store
+
+        :param directory: directory holding the store files (created if it doesn't exist)
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data_path = os.path.join(directory, 'symbols.dat')
+        self.index_path = os.path.join(directory, 'symbols.idx')
+        self._lock_file = open(os.path.join(directory, 'symbols.lock'), 'a+b')
+        self._lock = threading.RLock()
+        self._data = self._index = self._map = None
+        self.hits = self.misses = 0
+        self._open()
+
+    def _open(self):
+        """ (Re)open the store files, and read the whole index """
+        self._close_files()
+        self._index = open(self.index_path, 'a+b')
+        self._data = open(self.data_path, 'a+b')
+        self._map = None
+        self._offsets = {}
+        self._index_read = 0
+        self._refresh()
+
+    def _close_files(self):
+        for f in (self._index, self._data):
+            if f is not None:
+                f.close()
+        # an mmap with exported memoryviews stays alive until they are released
+        self._map = None
+
+    def close(self):
+        """ Close the store files """
+        with self._lock:
+            self._close_files()
+            self._index = self._data = None
+            self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def _exclusive(self):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """ Read index entries appended (by any process) since the last refresh """
+        if os.stat(self.index_path).st_ino != os.fstat(self._index.fileno()).st_ino:
+            return self._open()
+        end = os.fstat(self._index.fileno()).st_size
+        end -= (end - self._index_read) % _entry.size  # ignore a partially written entry
+        if end > self._index_read:
+            self._index.seek(self._index_read)
+            new = self._index.read(end - self._index_read)
+            for key, offset in _entry.iter_unpack(new):
+                self._offsets[key] = offset
+            self._index_read = end
+
+    def _record(self, key, offset):
+        """ Read the record for key at offset: (size, compact, memoryview of the packed matrix, encoding),
+        or None if the record there isn't for that key (the files were replaced by compaction)
+        """
+        if self._map is None or offset + _record.size > len(self._map):
+            if not os.fstat(self._data.fileno()).st_size:
+                return None
+            self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+        if offset + _record.size > len(self._map):
+            return None
+        found, size, compact, nbytes, name_length = _record.unpack_from(self._map, offset)
+        start = offset + _record.size
+        if found != key or start + nbytes + name_length > len(self._map):
+            return None
+        encoding = self._map[start + nbytes:start + nbytes + name_length].decode('ascii') or None
+        return size, bool(compact), memoryview(self._map)[start:start + nbytes], encoding
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    def get_packed(self, key):
+        """ Look up a symbol by key, without copying it
+
+        :param key: key from :py:func:`symbol_key`
+        :return: (size, compact, memoryview of the bytes from :py:func:`pack_matrix`, encoding), or None
+        """
+        with self._lock:
+            self._refresh()
+            offset = self._offsets.get(key)
+            if offset is not None:
+                found = self._record(key, offset)
+                if found is None:
+                    self._open()
+                    offset = self._offsets.get(key)
+                    found = None if offset is None else self._record(key, offset)
+                return found
+
+    def put_packed(self, key, size, compact, packed, encoding=None):
+        """ Append a symbol to the store
+
+        :param key: key from :py:func:`symbol_key`
+        :param size: size of matrix
+        :param compact: compactness flag
+        :param packed: bytes from :py:func:`pack_matrix`
+        :param encoding: name of the encoding used (see :py:class:`AztecCode`), or None
+        """
+        name = (encoding or '').encode('ascii')
+        with self._exclusive():
+            if key in self._offsets:
+                return
+            # drop an index entry left partially written by a crashed process
+            if os.fstat(self._index.fileno()).st_size > self._index_read:
+                self._index.truncate(self._index_read)
+            # write the record before its index entry, so that readers never see an incomplete record
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(_record.pack(key, size, compact, len(packed), len(name)) + bytes(packed) + name)
+            self._data.flush()
+            self._index.seek(0, os.SEEK_END)
+            self._index.write(_entry.pack(key, offset))
+            self._index.flush()
+            self._offsets[key] = offset
+            self._index_read = self._index.tell()
+
+    def aztec_code(self, data, size=None, compact=None, ec_percent=23, encoding=None, strategy='optimal'):
+        """ Get an Aztec code from the store, or encode it and add it to the store
+
+        Takes the same parameters as :py:class:`AztecCode`. Its ``encoding``
+        is the one used, chosen by the encoder if encoding was 'auto' or a list.
+
+        :return: :py:class:`AztecCode`
+        """
+        key = symbol_key(data, size, compact, ec_percent, encoding, strategy)
+        found = self.get_packed(key)
+        if found is not None:
+            with self._lock:
+                self.hits += 1
+            found_size, found_compact, packed, found_encoding = found
+            code = AztecCode.from_matrix(unpack_matrix(packed, found_size), found_compact, data, ec_percent, found_encoding)
+            code.strategy = strategy
+            return code
+        with self._lock:
+            self.misses += 1
+        code = AztecCode(data, size, compact, ec_percent, encoding, strategy)
+        self.put_packed(key, code.size, code.compact, pack_matrix(code.matrix), code.encoding)
+        return code
+
+    def compact(self, keep=None):
+        """ Rewrite the store without unindexed records (left by crashed processes), and optionally evict symbols
+
+        Other processes switch to the new files at their next lookup or append.
+
+        :param keep: if set, a function of a key (see :py:func:`symbol_key`) returning whether to keep its symbol
+        """
+        with self._exclusive():
+            data_tmp, index_tmp = self.data_path + '.tmp', self.index_path + '.tmp'
+            with open(data_tmp, 'wb') as data, open(index_tmp, 'wb') as index:
+                for key, offset in sorted(self._offsets.items(), key=lambda kv: kv[1]):
+                    if keep is not None and not keep(key):
+                        continue
+                    found = self._record(key, offset)
+                    if found is None:
+                        continue
+                    size, compact, packed, encoding = found
+                    name = (encoding or '').encode('ascii')
+                    index.write(_entry.pack(key, data.tell()))
+                    data.write(_record.pack(key, size, compact, len(packed), len(name)) + packed + name)
+                    packed.release()
+            os.replace(data_tmp, self.data_path)
+            os.replace(index_tmp, self.index_path)
+            self._open()
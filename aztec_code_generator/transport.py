@@ -0,0 +1,254 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.transport
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Returning results from worker processes through shared memory.
+
+    Pickling matrices or rendered images back through a process pool's pipes
+    costs more than encoding them once there are enough workers. Instead,
+    workers write bit-packed matrices (or rendered bytes) into a ring buffer
+    in a :py:class:`multiprocessing.shared_memory.SharedMemory` block, and
+    send back only a small :py:data:`Descriptor`. The parent reads results in
+    place, and reclaims their space explicitly with :py:meth:`SharedRing.release`.
+
+    The ring's head (where workers allocate) and tail (up to which the parent
+    has released) live in a header at the start of the block, and are updated
+    under a :py:class:`multiprocessing.Lock`. Allocations are numbered, so
+    that the tail only moves past results released in allocation order. A
+    worker which finds the ring full (because the parent holds on to too many
+    results) sends its result inline in the descriptor instead. To keep that
+    rare, :py:meth:`SharedMemoryPool.map` only sends the workers as many
+    payloads as their results are expected to fit in the ring.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import itertools
+import multiprocessing
+import os
+import struct
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from . import AztecCode
+from .render import render_code
+from .store import pack_matrix, unpack_matrix
+
+# offset and length of a result in the ring, symbol size, compactness and encoding used, the allocation's
+# number and end position (to release it), or the result itself if it was sent inline
+Descriptor = namedtuple('Descriptor', ('offset', 'length', 'size', 'compact', 'encoding', 'seq', 'end', 'inline'))
+
+_header = struct.Struct('<QQQ')  # head, next allocation number, tail (positions count bytes ever allocated)
+_header_size = 64
+
+
+class SharedRing(object):
+    """
+    Ring buffer in shared memory, written by worker processes and released by the parent
+    """
+
+    def __init__(self, capacity=64 << 20, name=None, lock=None):
+        """ Create a ring buffer, or attach to an existing one
+
+        :param capacity: size of the ring in bytes (ignored when attaching)
+        :param name: name of an existing ring's shared memory block to attach to
+        :param lock: :py:class:`multiprocessing.Lock` shared by all users of the ring (created if not given)
+        """
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=_header_size + capacity)
+            _header.pack_into(self.shm.buf, 0, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.capacity = self.shm.size - _header_size
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        self._released = {}   # allocation number: end position, of results released out of order
+        self._next_release = 0
+
+    def put(self, payload, size=None, compact=None, encoding=None):
+        """ Write a result into the ring
+
+        :param payload: bytes-like result
+        :param size: size of matrix, recorded in the descriptor
+        :param compact: compactness flag, recorded in the descriptor
+        :param encoding: name of the encoding used (see :py:class:`AztecCode`), recorded in the descriptor
+        :return: :py:data:`Descriptor`; its ``inline`` field holds the payload if the ring was full
+        """
+        length = len(payload)
+        with self.lock:
+            head, seq, tail = _header.unpack_from(self.shm.buf, 0)
+            start = head
+            if start % self.capacity + length > self.capacity:
+                # don't split results: skip to the start of the ring
+                start += self.capacity - start % self.capacity
+            if length > self.capacity or start + length - tail > self.capacity:
+                return Descriptor(None, length, size, compact, encoding, None, None, bytes(payload))
+            _header.pack_into(self.shm.buf, 0, start + length, seq + 1, tail)
+        offset = start % self.capacity
+        self.shm.buf[_header_size + offset:_header_size + offset + length] = payload
+        return Descriptor(offset, length, size, compact, encoding, seq, start + length, None)
+
+    def read(self, descriptor):
+        """ Get a result without copying it
+
+        The returned ``memoryview`` must be released before the ring is closed.
+
+        :param descriptor: :py:data:`Descriptor` from :py:meth:`put`
+        :return: ``memoryview`` (or bytes, for an inline result)
+        """
+        if descriptor.inline is not None:
+            return descriptor.inline
+        start = _header_size + descriptor.offset
+        return self.shm.buf[start:start + descriptor.length]
+
+    def release(self, descriptor):
+        """ Reclaim the space of a result; only the parent may release results
+
+        :param descriptor: :py:data:`Descriptor` from :py:meth:`put`
+        """
+        if descriptor.inline is not None:
+            return
+        self._released[descriptor.seq] = descriptor.end
+        tail = None
+        while self._next_release in self._released:
+            tail = self._released.pop(self._next_release)
+            self._next_release += 1
+        if tail is not None:
+            with self.lock:
+                head, seq, _ = _header.unpack_from(self.shm.buf, 0)
+                _header.pack_into(self.shm.buf, 0, head, seq, tail)
+
+    def in_use(self):
+        """ Number of bytes of the ring not yet released """
+        with self.lock:
+            head, seq, tail = _header.unpack_from(self.shm.buf, 0)
+        return head - tail
+
+    def close(self):
+        """ Detach from the ring, and free it if this is the ring's creator """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_ring = None
+
+
+def _attach(name, lock):
+    global _ring
+    _ring = SharedRing(name=name, lock=lock)
+
+
+def _encode(job):
+    data, format, module_size, border, ec_percent, encoding = job
+    aztec_code = AztecCode(data, ec_percent=ec_percent, encoding=encoding)
+    payload = pack_matrix(aztec_code.matrix) if format == 'matrix' else render_code(aztec_code, format, module_size, border)
+    return _ring.put(payload, aztec_code.size, aztec_code.compact, aztec_code.encoding)
+
+
+def _encode_chunk(jobs):
+    return [_encode(job) for job in jobs]
+
+
+class SharedMemoryPool(object):
+    """
+    Process pool which encodes (and optionally renders) Aztec codes, returning
+    results through a :py:class:`SharedRing`
+    """
+
+    def __init__(self, processes=None, capacity=64 << 20):
+        """
+        :param processes: number of worker processes (default: number of CPUs)
+        :param capacity: size of the ring in bytes
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.ring = SharedRing(capacity)
+        self.executor = ProcessPoolExecutor(self.processes, initializer=_attach, initargs=(self.ring.name, self.ring.lock))
+
+    def map(self, data, format='matrix', module_size=2, border=0, ec_percent=23, encoding=None, chunksize=16):
+        """ Encode payloads in the worker processes
+
+        Payloads are sent to the workers a chunk at a time. Until the first results
+        come back there is a chunk for each worker; after that, only as many as the
+        free space of the ring is expected to hold, going by the mean length of the
+        results so far. Results held by the caller use up that space, so release them
+        as they are consumed.
+
+        :param data: iterable of strings or bytes to encode
+        :param format: ``matrix`` for bit-packed matrices (see :py:meth:`aztec_code`), or
+          ``png``, ``svg`` or ``txt`` for rendered bytes (see :py:meth:`read`)
+        :param module_size: barcode module size in pixels (ignored for ``matrix`` and ``txt``)
+        :param border: barcode border size in modules (ignored for ``matrix``)
+        :param ec_percent: percentage of symbol capacity for error correction (default 23%)
+        :param encoding: see :py:class:`AztecCode`
+        :param chunksize: number of payloads sent to a worker at a time
+        :return: iterator of :py:data:`Descriptor`, in the order of data
+        """
+        jobs = ((item, format, module_size, border, ec_percent, encoding) for item in data)
+        return self._map(iter(lambda: list(itertools.islice(jobs, chunksize)), []), chunksize)
+
+    def _map(self, chunks, chunksize):
+        pending = deque()
+        count = nbytes = 0   # results received, and their total length
+        try:
+            while True:
+                # send another chunk if the free space holds its results and those of the pending chunks,
+                # plus up to one result's space skipped at the end of the ring (results aren't split)
+                while not pending or (len(pending) < self.processes if not count else
+                                      ((len(pending) + 1) * chunksize + 1) * nbytes // count + self.ring.in_use()
+                                      <= self.ring.capacity):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append(self.executor.submit(_encode_chunk, chunk))
+                if not pending:
+                    return
+                descriptors = pending.popleft().result()
+                count += len(descriptors)
+                nbytes += sum(descriptor.length for descriptor in descriptors)
+                yield from descriptors
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def read(self, descriptor):
+        """ See :py:meth:`SharedRing.read` """
+        return self.ring.read(descriptor)
+
+    def release(self, descriptor):
+        """ See :py:meth:`SharedRing.release` """
+        self.ring.release(descriptor)
+
+    def aztec_code(self, descriptor, data=None, ec_percent=None):
+        """ Get a matrix result as an :py:class:`AztecCode` (which copies it) and release it
+
+        Its ``encoding`` is the one the worker used, chosen by the encoder if encoding was 'auto' or a list.
+        """
+        packed = self.read(descriptor)
+        try:
+            matrix = unpack_matrix(packed, descriptor.size)
+        finally:
+            if isinstance(packed, memoryview):
+                packed.release()
+        self.release(descriptor)
+        return AztecCode.from_matrix(matrix, descriptor.compact, data, ec_percent, descriptor.encoding)
+
+    def close(self):
+        """ Stop the workers and free the ring """
+        self.executor.shutdown(wait=True)
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
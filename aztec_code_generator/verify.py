@@ -0,0 +1,259 @@
+#-*- coding: utf-8 -*-
+"""
+    aztec_code_generator.verify
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Matrix-level self-verification of generated Aztec codes.
+
+    Reads the mode message and data layers straight from
+    :py:attr:`AztecCode.matrix`, checks their Reed-Solomon syndromes
+    (optionally correcting errors), and decodes the data bits back to bytes,
+    without rasterizing or scanning an image.
+
+    :license: The MIT License (MIT), see LICENSE for more details.
+"""
+
+import codecs
+from collections import namedtuple
+
+from . import (
+    configs, polynomials, code_chars, char_size, encoding_to_eci,
+    Mode, Latch, Shift, Misc,
+    gf_tables, mode_message_positions, data_positions,
+)
+
+DecodeResult = namedtuple('DecodeResult', ('data', 'eci', 'layers', 'data_cw_count', 'corrected'))
+
+
+class VerificationError(Exception):
+    pass
+
+
+def _syndromes(codewords, nc, log, alog):
+    """ Evaluate the codeword polynomial at alpha**1 ... alpha**nc (all zero if there are no errors) """
+    syndromes = []
+    for j in range(1, nc + 1):
+        s = 0
+        for cw in codewords:
+            s = (alog[log[s] + j] if s else 0) ^ cw
+        syndromes.append(s)
+    return syndromes
+
+
+def _correct(codewords, syndromes, gf, log, alog):
+    """ Correct errors in codewords in place, using Berlekamp-Massey, Chien search and Forney
+
+    :return: number of corrected codewords
+    """
+    def mul(x, y):
+        return alog[log[x] + log[y]] if x and y else 0
+
+    def div(x, y):
+        return alog[log[x] + gf - 1 - log[y]] if x else 0
+
+    def evaluate(poly, x):
+        # poly is lowest degree first
+        result = 0
+        for coeff in reversed(poly):
+            result = mul(result, x) ^ coeff
+        return result
+
+    # error locator polynomial (Berlekamp-Massey)
+    nc = len(syndromes)
+    locator, prev, length, m, b = [1], [1], 0, 1, 1
+    for n in range(nc):
+        d = syndromes[n]
+        for i in range(1, length + 1):
+            d ^= mul(locator[i], syndromes[n - i])
+        if d == 0:
+            m += 1
+            continue
+        coeff = div(d, b)
+        update = locator + [0] * max(0, len(prev) + m - len(locator))
+        for i, p in enumerate(prev):
+            update[i + m] ^= mul(coeff, p)
+        if 2 * length <= n:
+            prev, length, b, m = locator, n + 1 - length, d, 1
+        else:
+            m += 1
+        locator = update
+    while len(locator) > 1 and not locator[-1]:
+        locator.pop()
+    if len(locator) - 1 != length or 2 * length > nc:
+        raise VerificationError('Too many errors to correct')
+
+    # error evaluator polynomial, and formal derivative of the locator
+    evaluator = [0] * nc
+    for i, s in enumerate(syndromes):
+        for j, l in enumerate(locator[:nc - i]):
+            evaluator[i + j] ^= mul(s, l)
+    derivative = [c if i % 2 == 0 else 0 for i, c in enumerate(locator[1:])]
+
+    # find error positions (Chien search) and values (Forney)
+    n = len(codewords)
+    corrected = 0
+    for k in range(n):
+        degree = n - 1 - k
+        x_inv = alog[(gf - 1 - degree) % (gf - 1)]
+        if evaluate(locator, x_inv) == 0:
+            denominator = evaluate(derivative, x_inv)
+            if not denominator:
+                raise VerificationError('Too many errors to correct')
+            codewords[k] ^= div(evaluate(evaluator, x_inv), denominator)
+            corrected += 1
+    if corrected != length:
+        raise VerificationError('Too many errors to correct')
+    return corrected
+
+
+def _check(codewords, nd, cw_bits, pp, correct, what):
+    gf = 1 << cw_bits
+    log, alog = gf_tables(gf, pp)
+    syndromes = _syndromes(codewords, len(codewords) - nd, log, alog)
+    if not any(syndromes):
+        return 0
+    if not correct:
+        raise VerificationError('Reed-Solomon check of %s failed' % what)
+    corrected = _correct(codewords, syndromes, gf, log, alog)
+    if any(_syndromes(codewords, len(codewords) - nd, log, alog)):
+        raise VerificationError('Reed-Solomon correction of %s failed' % what)
+    return corrected
+
+
+def _read_codewords(matrix, positions, cw_bits, count):
+    bits = ''.join('1' if matrix[y][x] else '0' for y, x in positions)
+    return [int(bits[i:i + cw_bits], 2) for i in range(0, count * cw_bits, cw_bits)]
+
+
+def _destuff(data_codewords, cw_bits):
+    """ Remove stuffed bits from data codewords, returning a bit string """
+    k = cw_bits - 1
+    all_ones = (1 << cw_bits) - 1
+    out = []
+    for cw in data_codewords:
+        if cw == 0 or cw == all_ones:
+            raise VerificationError('Invalid all-zeros or all-ones data codeword')
+        head = cw >> 1
+        if head == 0 or head == all_ones >> 1:
+            out.append(format(head, '0%db' % k))
+        else:
+            out.append(format(cw, '0%db' % cw_bits))
+    return ''.join(out)
+
+
+def decode_bits(bits):
+    """ Decode a data bit string to bytes
+
+    Decoding stops when the remaining bits are too few for the next
+    character (i.e. at the final codeword's padding).
+
+    :param bits: string of '0' and '1'
+    :return: (data bytes, ECI number or None) tuple
+    """
+    out = bytearray()
+    eci = None
+    mode = shifted = Mode.UPPER
+    pos, nbits = 0, len(bits)
+
+    def read(n):
+        nonlocal pos
+        if pos + n > nbits:
+            raise EOFError
+        pos += n
+        return int(bits[pos - n:pos], 2)
+
+    try:
+        while True:
+            ch = code_chars[shifted][read(char_size[shifted])]
+            shifting, shifted = shifted != mode, mode
+            if isinstance(ch, int):
+                out.append(ch)
+            elif isinstance(ch, bytes):
+                out += ch
+            elif isinstance(ch, Latch):
+                mode = shifted = ch.value
+            elif ch == Shift.BINARY:
+                length = read(5) or read(11) + 31
+                for ii in range(length):
+                    out.append(read(8))
+            elif isinstance(ch, Shift):
+                if shifting:
+                    raise VerificationError('Shift of a shifted character')
+                shifted = ch.value
+            elif ch == Misc.FLG:
+                flg_n = read(3)
+                if flg_n == 7:
+                    raise VerificationError('FLG(7) is reserved')
+                elif flg_n:
+                    digits = [code_chars[Mode.DIGIT][read(4)] for ii in range(flg_n)]
+                    if not all(isinstance(d, int) and 0x30 <= d <= 0x39 for d in digits):
+                        raise VerificationError('FLG(%d) must be followed by digits' % flg_n)
+                    eci = int(bytes(digits))
+    except EOFError:
+        pass
+    return bytes(out), eci
+
+
+def decode(matrix, compact, correct=False):
+    """ Decode an Aztec code matrix
+
+    :param matrix: square matrix of modules, as in :py:attr:`AztecCode.matrix`
+    :param compact: compactness flag
+    :param correct: if set, correct Reed-Solomon errors instead of failing on them
+    :return: :py:class:`DecodeResult`
+    """
+    size = len(matrix)
+    config = configs.get((size, compact))
+    if config is None:
+        raise VerificationError('No %s Aztec code configuration with size %d' % ('compact' if compact else 'full', size))
+
+    # mode message: 4-bit codewords, with 2 (or 4) data codewords
+    mode_positions = mode_message_positions(size, compact)
+    mode_codewords = _read_codewords(matrix, mode_positions, 4, len(mode_positions) // 4)
+    nd = 2 if compact else 4
+    corrected = _check(mode_codewords, nd, 4, polynomials[4], correct, 'mode message')
+    mode_word = 0
+    for cw in mode_codewords[:nd]:
+        mode_word = (mode_word << 4) | cw
+    if compact:
+        layers, data_cw_count = (mode_word >> 6) + 1, (mode_word & 0x3f) + 1
+    else:
+        layers, data_cw_count = (mode_word >> 11) + 1, (mode_word & 0x7ff) + 1
+    if layers != config.layers:
+        raise VerificationError('Mode message has %d layers; expected %d' % (layers, config.layers))
+    if data_cw_count > config.codewords:
+        raise VerificationError('Mode message has %d data codewords; only %d fit' % (data_cw_count, config.codewords))
+
+    # data layers: the spiral holds the codewords' bits in reverse order
+    cw_bits = config.cw_bits
+    positions = data_positions(size, compact)[::-1]
+    codewords = _read_codewords(matrix, positions, cw_bits, config.codewords)
+    corrected += _check(codewords, data_cw_count, cw_bits, polynomials[cw_bits], correct, 'data')
+
+    data, eci = decode_bits(_destuff(codewords[:data_cw_count], cw_bits))
+    return DecodeResult(data, eci, layers, data_cw_count, corrected)
+
+
+def verify(aztec_code, correct=False):
+    """ Verify that an Aztec code's matrix decodes to its input data
+    Raise :py:class:`VerificationError` if it does not
+
+    :param aztec_code: :py:class:`AztecCode`
+    :param correct: if set, tolerate (and correct) Reed-Solomon errors
+    :return: :py:class:`DecodeResult`
+    """
+    result = decode(aztec_code.matrix, aztec_code.compact, correct)
+    data, encoding = aztec_code.data, aztec_code.encoding
+    if encoding:
+        encoding = codecs.lookup(encoding).name
+        expected_eci = encoding_to_eci[encoding]
+    else:
+        encoding = 'iso8859-1'
+        expected_eci = None
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    if result.eci != expected_eci:
+        raise VerificationError('Decoded ECI %r; expected %r' % (result.eci, expected_eci))
+    if result.data != bytes(data):
+        raise VerificationError('Decoded %r; expected %r' % (result.data, data))
+    return result
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""
+Batch encoding benchmark.
+
+Encodes a batch of same-size payloads one symbol at a time with AztecCode and
+with encode_batch(), and times the placement stage of encode_batch() on its
+own, with and (if installed) without numpy. Every batch symbol is compared
+with the AztecCode matrix.
+"""
+
+import argparse
+import time
+
+from aztec_code_generator import AztecCode, find_optimal_sequence, get_codewords
+from aztec_code_generator.batch import encode_batch, place_codewords, numpy
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-n', '--count', type=int, default=2000, help='symbols per batch (default: %(default)s)')
+    p.add_argument('--length', type=int, default=100, help='payload length (default: %(default)s)')
+    args = p.parse_args()
+
+    data = [('Ticket #%08d ' % ii * args.length)[:args.length] for ii in range(args.count)]
+    elapsed, batch = timed(encode_batch, data)
+    size, compact = batch.size, batch.compact
+    single, codes = timed(lambda: [AztecCode(item, size, compact) for item in data])
+    for ii, code in enumerate(codes):
+        if [bytes(line) for line in batch.matrix(ii)] != [bytes(line) for line in code.matrix]:
+            raise SystemExit('batch symbol {} differs from AztecCode'.format(ii))
+
+    print('{} symbols of {} bytes, size {}{}'.format(args.count, args.length, size, ' compact' if compact else ''))
+    print('{:<28} {:>12}'.format('', 'symbols/s'))
+    print('{:<28} {:>12.0f}'.format('AztecCode', args.count / single))
+    print('{:<28} {:>12.0f}'.format('encode_batch', args.count / elapsed))
+    codewords, data_cw_counts = zip(*(get_codewords(find_optimal_sequence(item), size, compact) for item in data))
+    for use_numpy in ((False, True) if numpy is not None else (False,)):
+        elapsed, modules = timed(place_codewords, codewords, data_cw_counts, size, compact, use_numpy)
+        print('{:<28} {:>12.0f}'.format('place_codewords ({})'.format('numpy' if use_numpy else 'python'),
+                                        args.count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""
+Load test for the local rendering service (``python -m aztec_code_generator serve``).
+
+Each client thread holds one keep-alive connection and sends requests
+back-to-back. Reports requests/s and latency percentiles. Use ``--distinct``
+to control how many different payloads are requested (and thus how often
+the server's cache and ETags can answer without re-encoding).
+"""
+
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlencode
+
+
+def client(host, port, paths, n, latencies, statuses, etags):
+    conn = http.client.HTTPConnection(host, port)
+    for ii in range(n):
+        path = paths[ii % len(paths)]
+        headers = {'If-None-Match': etags[path]} if etags and path in etags else {}
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        latencies.append(time.perf_counter() - start)
+        statuses[resp.status] = statuses.get(resp.status, 0) + 1
+        if etags is not None and resp.getheader('ETag'):
+            etags[path] = resp.getheader('ETag')
+    conn.close()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8080)
+    p.add_argument('-c', '--concurrency', type=int, default=8, help='client threads (default: %(default)s)')
+    p.add_argument('-n', '--requests', type=int, default=2000, help='total requests (default: %(default)s)')
+    p.add_argument('--distinct', type=int, default=100, help='number of distinct payloads (default: %(default)s)')
+    p.add_argument('--format', default='svg', choices=('png', 'svg', 'txt'))
+    p.add_argument('--conditional', action='store_true', help='revalidate with If-None-Match')
+    args = p.parse_args()
+
+    paths = ['/render?' + urlencode(dict(data='Ticket #%08d Aztec load test' % ii, format=args.format))
+             for ii in range(args.distinct)]
+    latencies, statuses = [], {}
+    etags = {} if args.conditional else None
+    per_client = args.requests // args.concurrency
+    threads = [threading.Thread(target=client, args=(args.host, args.port, paths, per_client, latencies, statuses, etags))
+               for ii in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    if not latencies:
+        raise SystemExit("no requests completed")
+    print('{} requests in {:.2f}s: {:.0f} requests/s'.format(len(latencies), elapsed, len(latencies) / elapsed))
+    print('statuses: ' + ', '.join('{}={}'.format(*kv) for kv in sorted(statuses.items())))
+    print('latency ms: ' + ', '.join('p{}={:.2f}'.format(pp, 1000 * percentile(latencies, pp)) for pp in (50, 90, 99, 100)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""
+Encoding strategy benchmark.
+
+Finds sequences for several kinds of payload with the default ('optimal')
+and the 'fast' strategy, and reports the time taken by each, and how many
+more bits the fast strategy's sequences take (negative when it finds a
+shorter one than the mode optimisation, which is heuristic around binary runs).
+"""
+
+import argparse
+import base64
+import random
+import time
+
+from aztec_code_generator import find_optimal_sequence, optimal_sequence_to_bits
+
+
+def payloads(rng, count, length):
+    text = b'Ticket #%08d Seat %d%c, Row: %d. Gate B%d\r\n'
+    return {
+        'digits': [str(rng.getrandbits(4 * length)).encode()[:length] for _ in range(count)],
+        'upper': [bytes(rng.choice(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ ') for _ in range(length)) for _ in range(count)],
+        'lower': [bytes(rng.choice(b'abcdefghijklmnopqrstuvwxyz ') for _ in range(length)) for _ in range(count)],
+        'text': [(text % (ii, rng.randrange(40), rng.choice(b'ABCDEF'), rng.randrange(40), rng.randrange(40)) * length)[:length]
+                 for ii in range(count)],
+        'base64': [base64.b64encode(rng.randbytes(length))[:length] for _ in range(count)],
+        'binary': [rng.randbytes(length) for _ in range(count)],
+        'mixed': [bytes(rng.choice(b'Aa0. ,:\r\n@!#\x80\x1bzZ9-') for _ in range(length)) for _ in range(count)],
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-n', '--count', type=int, default=200, help='payloads of each kind (default: %(default)s)')
+    p.add_argument('--length', type=int, default=100, help='payload length (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    args = p.parse_args()
+
+    print('{:<10} {:>12} {:>10} {:>9} {:>12} {:>8} {:>10}'.format(
+        'payload', 'optimal µs', 'fast µs', 'speedup', 'extra bits', 'extra %', 'extra max'))
+    for kind, data in payloads(random.Random(args.seed), args.count, args.length).items():
+        times, bits = {}, {}
+        for strategy in ('optimal', 'fast'):
+            start = time.perf_counter()
+            sequences = [find_optimal_sequence(item, strategy=strategy) for item in data]
+            times[strategy] = (time.perf_counter() - start) / len(data)
+            bits[strategy] = [len(optimal_sequence_to_bits(sequence)) for sequence in sequences]
+        extra = [fast - optimal for fast, optimal in zip(bits['fast'], bits['optimal'])]
+        print('{:<10} {:>12.1f} {:>10.1f} {:>8.0f}x {:>12.1f} {:>7.1f}% {:>10d}'.format(
+            kind, times['optimal'] * 1e6, times['fast'] * 1e6, times['optimal'] / times['fast'],
+            sum(extra) / len(extra), 100 * sum(extra) / sum(bits['optimal']), max(extra)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""
+Thread scaling benchmark for encoding and rendering Aztec codes.
+
+Encodes (and renders) the same batch of payloads in a thread pool of 1, 2, 4
+and 8 threads, and optionally a process pool for comparison, and reports
+symbols/s and speedup over one worker. Every output is compared with a serial
+run, so races would show up as mismatches. Run it on both a standard and a
+free-threaded (``python3.13t``) interpreter to choose an executor.
+"""
+
+import argparse
+import sys
+import sysconfig
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from aztec_code_generator import AztecCode
+from aztec_code_generator.render import render_code
+
+
+def work(args):
+    data, format = args
+    if format == 'matrix':
+        return b''.join(AztecCode(data).matrix)
+    return render_code(AztecCode(data), format)
+
+
+def run(executor_class, workers, jobs):
+    with executor_class(workers) as executor:
+        # start the workers (and import the module in each process) before timing
+        list(executor.map(work, jobs[:workers]))
+        start = time.perf_counter()
+        results = list(executor.map(work, jobs, chunksize=1 if executor_class is ThreadPoolExecutor else 16))
+        return time.perf_counter() - start, results
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-n', '--count', type=int, default=400, help='symbols per run (default: %(default)s)')
+    p.add_argument('--length', type=int, default=200, help='payload length (default: %(default)s)')
+    p.add_argument('--format', default='matrix', choices=('matrix', 'svg', 'txt', 'png'),
+                   help='encode only, or encode and render (default: %(default)s)')
+    p.add_argument('-t', '--threads', type=int, nargs='+', default=[1, 2, 4, 8],
+                   help='thread counts (default: %(default)s)')
+    p.add_argument('--processes', action='store_true', help='also measure a process pool')
+    args = p.parse_args()
+
+    jobs = [(('Ticket #%08d ' % ii * args.length)[:args.length], args.format) for ii in range(args.count)]
+    expected = [work(job) for job in jobs]
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('Python {} ({}free-threaded build, GIL {})'.format(
+        sys.version.split()[0], '' if sysconfig.get_config_var('Py_GIL_DISABLED') else 'not a ',
+        'enabled' if gil else 'disabled'))
+    print('{} symbols of {} bytes, {}'.format(args.count, args.length, args.format))
+    print('{:<10} {:>8} {:>12} {:>8}'.format('executor', 'workers', 'symbols/s', 'speedup'))
+    kinds = [('thread', ThreadPoolExecutor)] + ([('process', ProcessPoolExecutor)] if args.processes else [])
+    for name, executor_class in kinds:
+        base = None
+        for workers in args.threads:
+            elapsed, results = run(executor_class, workers, jobs)
+            if results != expected:
+                raise SystemExit('{} pool with {} workers produced different output'.format(name, workers))
+            rate = args.count / elapsed
+            base = base or rate
+            print('{:<10} {:>8} {:>12.0f} {:>7.2f}x'.format(name, workers, rate, rate / base))
+
+
+if __name__ == '__main__':
+    main()
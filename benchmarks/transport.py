@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""
+Result transport benchmark for process pools.
+
+Encodes (and optionally renders) the same batch of payloads in a process pool
+that pickles results back through its pipes, and in a SharedMemoryPool whose
+workers write results into a shared memory ring buffer and send back only
+descriptors, and reports symbols/s for each.
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from aztec_code_generator import AztecCode
+from aztec_code_generator.render import render_code
+from aztec_code_generator.transport import SharedMemoryPool
+
+
+def pickled(args):
+    data, format = args
+    if format == 'matrix':
+        return AztecCode(data).matrix
+    return render_code(AztecCode(data), format)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-n', '--count', type=int, default=2000, help='symbols per run (default: %(default)s)')
+    p.add_argument('--length', type=int, default=200, help='payload length (default: %(default)s)')
+    p.add_argument('--format', default='matrix', choices=('matrix', 'svg', 'txt', 'png'),
+                   help='encode only, or encode and render (default: %(default)s)')
+    p.add_argument('-p', '--processes', type=int, default=None, help='worker processes (default: number of CPUs)')
+    args = p.parse_args()
+
+    data = [('Ticket #%08d ' % ii * args.length)[:args.length] for ii in range(args.count)]
+    print('{} symbols of {} bytes, {}'.format(args.count, args.length, args.format))
+
+    with ProcessPoolExecutor(args.processes) as executor:
+        list(executor.map(pickled, [(data[0], args.format)] * 64))
+        start = time.perf_counter()
+        for result in executor.map(pickled, ((item, args.format) for item in data), chunksize=16):
+            pass
+        print('{:<16} {:>10.0f} symbols/s'.format('pickled', args.count / (time.perf_counter() - start)))
+
+    with SharedMemoryPool(args.processes) as pool:
+        for descriptor in pool.map(data[:64], args.format):
+            pool.release(descriptor)
+        start = time.perf_counter()
+        inline = 0
+        for descriptor in pool.map(data, args.format):
+            inline += descriptor.inline is not None
+            result = pool.read(descriptor)
+            if isinstance(result, memoryview):
+                result.release()
+            pool.release(descriptor)
+        print('{:<16} {:>10.0f} symbols/s ({} sent inline)'.format(
+            'shared memory', args.count / (time.perf_counter() - start), inline))
+
+
+if __name__ == '__main__':
+    main()
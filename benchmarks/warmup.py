@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""
+Preforking warm-up benchmark (Linux).
+
+Forks worker processes which each encode symbols of every size, as the
+workers of a preforking server would, from a parent which did nothing,
+which called warmup(), or which called warmup(freeze=True), and reports
+each worker's resident memory (RSS), the part of it which is private to
+the worker (i.e. not shared copy-on-write with the parent), and the time
+taken by its first and by all of its symbols. Each variant runs in a fresh
+interpreter.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import aztec_code_generator
+from aztec_code_generator import AztecCode
+
+variants = {'cold': {}, 'warmup': {'freeze': False}, 'warmup+freeze': {'freeze': True}}
+
+
+def memory():
+    """ Resident and private memory of this process, in kB """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[key] = int(value.split()[0])
+    return fields['Rss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def payloads(seed):
+    """ Payloads giving symbols of (nearly) every size """
+    rng = random.Random(seed)
+    lengths = sorted({int(8 * 1.15 ** k) for k in range(40) if 8 * 1.15 ** k < 1800})
+    return [''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ') for _ in range(n)) for n in lengths]
+
+
+def worker(data, fd):
+    start = time.perf_counter()
+    AztecCode(data[0])
+    first = time.perf_counter() - start
+    for item in data[1:]:
+        AztecCode(item)
+    total = time.perf_counter() - start
+    rss, private = memory()
+    os.write(fd, (json.dumps([rss, private, first, total]) + '\n').encode())
+    os._exit(0)
+
+
+def run(variant, workers, seed):
+    """ Fork workers from this process, and print their results as JSON """
+    data = payloads(seed)
+    if variant != 'cold':
+        aztec_code_generator.warmup(**variants[variant])
+    read_fd, write_fd = os.pipe()
+    pids = []
+    for ii in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            worker(data, write_fd)
+        pids.append(pid)
+    os.close(write_fd)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as f:
+        print(json.dumps([json.loads(line) for line in f]))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-w', '--workers', type=int, default=4, help='worker processes (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    p.add_argument('--variant', choices=variants, help=argparse.SUPPRESS)
+    args = p.parse_args()
+    if args.variant:
+        return run(args.variant, args.workers, args.seed)
+
+    print('{} workers, {} symbols each'.format(args.workers, len(payloads(args.seed))))
+    print('{:<16} {:>12} {:>14} {:>14} {:>12}'.format('parent', 'RSS kB', 'private kB', 'first ms', 'all ms'))
+    for variant in variants:
+        out = subprocess.run([sys.executable, __file__, '--variant', variant, '-w', str(args.workers),
+                              '--seed', str(args.seed)], check=True, capture_output=True, text=True).stdout
+        results = json.loads(out)
+        mean = [sum(column) / len(column) for column in zip(*results)]
+        print('{:<16} {:>12.0f} {:>14.0f} {:>14.2f} {:>12.1f}'.format(
+            variant, mean[0], mean[1], mean[2] * 1e3, mean[3] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
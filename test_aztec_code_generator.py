@@ -4,17 +4,32 @@
 import unittest
 from aztec_code_generator import (
     reed_solomon, find_optimal_sequence, optimal_sequence_to_bits, get_data_codewords, encoding_to_eci,
+    count_data_codewords, find_suitable_matrix_size, estimate_symbol, FeasibilityTable,
+    check_admission, DataTooBigError, plan, Plan, SymbolCodewords,
     configs,
     Mode, Latch, Shift, Misc,
     AztecCode,
 )
 
 import codecs
+import http.client
+import random
+import threading
+from io import BytesIO, StringIO
 from tempfile import NamedTemporaryFile
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     import cairosvg
-    from io import BytesIO
 except ImportError:
     cairosvg = None
 
@@ -212,6 +227,651 @@ class Test(unittest.TestCase):
         self.assertEqual(get_data_codewords('111111', 6), [0b111110, 0b111110])
         self.assertEqual(get_data_codewords('111101111101', 6), [0b111101, 0b111101])
 
+    def test_count_data_codewords(self):
+        """ Test count_data_codewords function against get_data_codewords """
+        for bits in ('', '0', '000010', '111110', '000000', '111111', '111101111101', '1'*40, '0'*41, '0110'*13):
+            for cw_bits in (6, 8, 10, 12):
+                self.assertEqual(count_data_codewords(int(bits or '0', 2), len(bits), cw_bits),
+                                 len(get_data_codewords(bits, cw_bits)), (bits, cw_bits))
+
+    def test_estimate_symbol(self):
+        """ Test that estimate_symbol counts the bits exactly, and agrees with find_suitable_matrix_size """
+        from aztec_code_generator import _optimal_bits
+        for data in ('ABC', 'Wikipedia, the free encyclopedia', b'\xff'*212, b'\0'*212, 'x'*1000, '0123456789'*150):
+            bits = optimal_sequence_to_bits(find_optimal_sequence(data))
+            for ec_percent in (0, 23, 95):
+                try:
+                    size, compact, _ = find_suitable_matrix_size(data, ec_percent)
+                except Exception:
+                    self.assertRaises(Exception, estimate_symbol, data, ec_percent)
+                    continue
+                estimate = estimate_symbol(data, ec_percent)
+                self.assertEqual((estimate.size, estimate.compact), (size, compact))
+                self.assertEqual(estimate.bits, len(bits))
+                config = configs[(estimate.size, estimate.compact)]
+                cw_count = len(get_data_codewords(bits, config.cw_bits))
+                self.assertLess((cw_count + estimate.spare_codewords + 3) * 100.0 / (100 - ec_percent), config.codewords)
+        self.assertEqual(estimate_symbol('ABC'), FeasibilityTable('ABC').smallest_symbol())
+        self.assertEqual(estimate_symbol('Hello', encoding='utf-8').bits, len(optimal_sequence_to_bits(find_optimal_sequence('Hello', 'utf-8'))))
+        self.assertEqual(estimate_symbol('0123456789' * 10, strategy='fast')[:2], find_suitable_matrix_size('0123456789' * 10)[:2])
+        # the data might fit the largest symbol: it's encoded to find out
+        data = b'\xff' * 1914
+        self.assertEqual(estimate_symbol(data, 0)[:2], find_suitable_matrix_size(data, 0)[:2])
+        rnd = random.Random(2)
+        for ii in range(100):
+            data = ''.join(rnd.choice('abcxyzABCXYZ0123456789 .,:/-') for _ in range(rnd.randrange(1, 1500)))
+            ec_percent = rnd.choice((0, 23, 50))
+            try:
+                expected = find_suitable_matrix_size(data, ec_percent)[:2]
+            except Exception as e:
+                self.assertRaises(type(e), estimate_symbol, data, ec_percent)
+                continue
+            self.assertEqual(estimate_symbol(data, ec_percent)[:2], expected)
+        self.assertRaises(ValueError, estimate_symbol, '')
+        self.assertRaises(ValueError, AztecCode, '')
+
+        # the bits are counted exactly, including when the optimal sequence can't be encoded
+        rnd = random.Random(1)
+        alphabet = b'abcABC0123.,: \r\n|~{}@\\\xff\x00'
+        for data in [b':. ', b'a9', b'\xff:'] + [bytes(rnd.choice(alphabet) for _ in range(rnd.randrange(1, 100)))
+                                                 for _ in range(200)]:
+            try:
+                nbits = len(optimal_sequence_to_bits(find_optimal_sequence(data)))
+            except ValueError:
+                self.assertRaises(ValueError, _optimal_bits, data)
+                continue
+            self.assertEqual(_optimal_bits(data), nbits)
+
+    def test_scanlines(self):
+        """ Test the cached run-length scanlines, and the text renderers built on them """
+        code = AztecCode('Hello')
+        self.assertEqual(code.scanlines[0], ((2, 1), (5, 1), (7, 1), (9, 3), (13, 2)))
+        for y, runs in enumerate(code.scanlines):
+            self.assertEqual([x for start, length in runs for x in range(start, start + length)],
+                             [x for x, m in enumerate(code.matrix[y]) if m])
+        code.matrix[0][3] = 1
+        self.assertEqual(code.scanlines[0][0], (2, 1))
+        del code.scanlines
+        self.assertEqual(code.scanlines[0][0], (2, 2))
+
+        f = StringIO()
+        code.print_out(border=1, file=f)
+        lines = f.getvalue().split('\n')
+        self.assertEqual(lines[0], ' ' * 17)
+        self.assertEqual(lines[1], '   ## # # ### ## ')
+
+        f = StringIO()
+        code.print_dense(border=1, file=f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(len(lines), 9)
+        self.assertEqual(lines[0], ' \u2597\u2596\u2596\u2596\u2584\u2596\u2584 ')
+        f = StringIO()
+        code.print_dense(file=f, style='braille', invert=True)
+        lines = f.getvalue().splitlines()
+        self.assertEqual((len(lines), len(lines[0])), (4, 8))
+        self.assertEqual(lines[0][0], '\u282f')
+
+    @unittest.skipUnless(Image, reason='Python module PIL cannot be imported; cannot test images.')
+    def test_image_border(self):
+        """ Test that images have clean, white borders """
+        code = AztecCode('Hello')
+        image = code.image(module_size=3, border=2)
+        self.assertEqual(image.size, (3 * 19, 3 * 19))
+        self.assertEqual(image.crop((6, 6, 51, 51)).tobytes(), code.image(module_size=3).tobytes())
+        for box in ((0, 0, 57, 6), (0, 51, 57, 57), (0, 0, 6, 57), (51, 0, 57, 57)):
+            self.assertEqual(image.crop(box).getextrema(), (255, 255))
+
+    @unittest.skipUnless(numpy, reason='Python module numpy cannot be imported; cannot test arrays.')
+    def test_to_array(self):
+        """ Test that arrays are upscaled views of the matrix, matching the images """
+        code = AztecCode('Hello')
+        view = code.to_array(module_size=4, border=2)
+        self.assertEqual(view.shape, (19, 4, 19, 4))
+        self.assertEqual(view.strides[1::2], (0, 0))
+        self.assertFalse(view.flags.writeable)
+        self.assertEqual(view[2:-2, 0, 2:-2, 0].tolist(), [list(line) for line in code.matrix])
+        self.assertEqual(view.reshape(76, 76).tolist(), code.to_array(4, 2, materialize=True).tolist())
+        self.assertEqual(code.to_array(dtype=bool).dtype, bool)
+        for module_size in (1, 2):
+            image = code.to_array(module_size, materialize=True)
+            self.assertTrue(image.flags.writeable and image.flags.c_contiguous)
+            image[:] = 0
+            self.assertEqual(code.to_array(module_size)[0, 0, 2, 0], 1)
+
+        rgb = code.to_array(3, 1, colors=((255, 255, 255), (0, 0, 0)), materialize=True)
+        self.assertEqual((rgb.shape, rgb.dtype), ((51, 51, 3), numpy.uint8))
+        self.assertTrue(rgb.flags.c_contiguous)
+        if Image:
+            gray = code.to_array(3, 1, colors=(255, 0), materialize=True)
+            self.assertEqual(gray.tobytes(), code.image(3, 1).convert('L').tobytes())
+            self.assertEqual(rgb.tobytes(), code.image(3, 1).convert('RGB').tobytes())
+
+    def test_select_encoding(self):
+        """ Test automatic choice of the encoding giving the smallest symbol """
+        from aztec_code_generator import select_encoding
+        from aztec_code_generator.verify import verify
+        for data, expected in (
+            ('Hello', None),
+            ('Привет, мир! Как дела? ' * 4, 'iso8859-5'),
+            ('こんにちは世界、元気ですか' * 3, 'shift_jis'),
+        ):
+            code = AztecCode(data, encoding='auto')
+            self.assertEqual(code.encoding, expected)
+            self.assertEqual(verify(code).eci, encoding_to_eci.get(expected))
+            self.assertLessEqual(code.size, AztecCode(data, encoding='utf-8').size)
+            self.assertEqual(estimate_symbol(data, encoding='auto')[:2], (code.size, code.compact))
+        self.assertEqual(select_encoding('Ωmega', ['utf-8', 'cp1252', 'utf-16-be'])[0], 'utf-8')
+        self.assertEqual(select_encoding(b'\xff\x00', ['utf-8', None])[0], None)
+        self.assertRaises(ValueError, select_encoding, '\u263a', ['iso8859-1', 'cp1252'])
+
+    def test_feasibility_table(self):
+        """ Test that the feasibility table agrees with per-level size estimates """
+        from aztec_code_generator import _fits
+        for data in ('Hello', 'Wikipedia, the free encyclopedia', b'\xff\x00' * 300, 'A' * 900):
+            table = FeasibilityTable(data)
+            for ec_percent, estimate in table.smallest_symbols(range(0, 100, 3)).items():
+                try:
+                    expected = find_suitable_matrix_size(data, ec_percent)[:2]
+                except Exception:
+                    expected = None
+                self.assertEqual(estimate and estimate[:2], expected)
+                if estimate:
+                    self.assertEqual(estimate_symbol(data, ec_percent)[:2], expected)
+            for (size, compact), ec_percent in table.max_ec_percents().items():
+                config = configs[(size, compact)]
+                data_cw_count = table.data_cw_counts[config.cw_bits]
+                if ec_percent is None:
+                    self.assertFalse(_fits(data_cw_count, compact, config, 0))
+                else:
+                    self.assertTrue(_fits(data_cw_count, compact, config, ec_percent))
+                    if ec_percent < 99:
+                        self.assertFalse(_fits(data_cw_count, compact, config, ec_percent + 1))
+        self.assertEqual(FeasibilityTable('Hello').max_ec_percent(15, True), 52)
+
+    def test_iter_renderers(self):
+        """ Test that chunked renderers produce the same output as the file renderers """
+        for data in ('Hello', 'x' * 1500):
+            code = AztecCode(data)
+            for module_size, border in ((1, 0), (3, 2)):
+                stream = code.iter_svg(module_size, border, chunk_size=1000)
+                chunks = list(stream)
+                f = BytesIO()
+                code.save_svg(f, module_size, border)
+                self.assertEqual(b''.join(chunks), f.getvalue())
+                self.assertEqual(stream.content_length, len(f.getvalue()))
+                self.assertEqual(('Content-Length', str(len(f.getvalue()))), stream.headers()[1])
+
+                stream = code.iter_text(border, chunk_size=100)
+                f = StringIO()
+                code.print_out(border, file=f)
+                self.assertEqual(b''.join(stream).decode(), f.getvalue())
+                self.assertEqual(stream.content_length, len(f.getvalue()))
+
+                stream = code.iter_png(module_size, border)
+                self.assertIsNone(stream.content_length)
+                png = b''.join(stream)
+                self.assertTrue(png.startswith(b'\x89PNG'))
+                if Image:
+                    self.assertEqual(Image.open(BytesIO(png)).convert('1').tobytes(),
+                                     code.image(module_size, border).tobytes())
+
+    def test_printers(self):
+        """ Test ZPL and ESC/POS raster output against the rendered image rows """
+        from aztec_code_generator.printers import zpl, escpos
+
+        def zpl_rows(field, stride):
+            # decode ZPL compressed ASCII hex into rows of bytes
+            rows, row, count = [], '', 0
+            for c in field:
+                if 'G' <= c <= 'Y':
+                    count += ord(c) - ord('F')
+                elif 'g' <= c <= 'z':
+                    count += 20 * (ord(c) - ord('f'))
+                elif c in ',!:':
+                    row = rows[-1] if c == ':' else row + ('0' if c == ',' else 'F') * (2 * stride - len(row))
+                else:
+                    row += c * (count or 1)
+                    count = 0
+                if len(row) == 2 * stride:
+                    rows.append(row)
+                    row = ''
+            return [bytes.fromhex(row) for row in rows]
+
+        for data in ('Hello', 'x' * 1500):
+            code = AztecCode(data)
+            for module_size, border in ((1, 0), (4, 2), (5, 1)):
+                width = (code.size + 2 * border) * module_size
+                stride = (width + 7) // 8
+                # expected rows: 1 is black, padded with white
+                image_rows = [bytes(255 - b for b in row) for row in code._pixel_rows(module_size, border)]
+                for compress in (False, True):
+                    out = zpl(code, module_size, border, x=10, y=20, compress=compress).decode()
+                    prefix = '^XA^FO10,20^GFA,%d,%d,%d,' % (stride * width, stride * width, stride)
+                    self.assertTrue(out.startswith(prefix))
+                    self.assertTrue(out.endswith('^FS^XZ\n'))
+                    self.assertEqual(zpl_rows(out[len(prefix):-len('^FS^XZ\n')], stride), image_rows)
+                raster = escpos(code, module_size, border, band_height=100)
+                pos, rows = 0, []
+                while pos < len(raster):
+                    self.assertEqual(raster[pos:pos + 4], b'\x1dv0\x00')
+                    x_bytes, height = raster[pos + 4] + 256 * raster[pos + 5], raster[pos + 6] + 256 * raster[pos + 7]
+                    self.assertEqual(x_bytes, stride)
+                    self.assertLessEqual(height, 100)
+                    pos += 8
+                    rows += [raster[pos + ii * stride:pos + (ii + 1) * stride] for ii in range(height)]
+                    pos += height * stride
+                self.assertEqual(rows, image_rows)
+
+    def test_check_admission(self):
+        """ Test that admission bounds agree with the encoder, and that oversized data is refused early """
+        for data in ('Hello', 'Wikipedia, the free encyclopedia', '0123456789' * 20, '. , : ' * 40,
+                     b'\xff\x00' * 300, bytes(range(256)) * 3, '\r\n' * 500):
+            admission = check_admission(data)
+            nbits = len(optimal_sequence_to_bits(find_optimal_sequence(data)))
+            self.assertLessEqual(admission.min_bits, nbits)
+            self.assertLessEqual(nbits, admission.max_bits)
+            size, compact = estimate_symbol(data)[:2]
+            symbols = list(configs)
+            self.assertLessEqual(symbols.index(admission.min_symbol), symbols.index((size, compact)))
+            self.assertLessEqual(symbols.index((size, compact)), symbols.index(admission.max_symbol))
+        self.assertEqual(check_admission('Hello', encoding='utf-8').min_bits, 13 + 4 * 2 + 5 * 5)
+        # the mode optimisation can be longer than encoding everything in binary
+        rnd = random.Random(0)
+        alphabet = b'abcABC0123.,: \r\n|~{}@\\\xff\x00'
+        for data in ['0a|5Tf.l', '~Fxlb"I4', b'\xff:'] + [bytes(rnd.choice(alphabet) for _ in range(rnd.randrange(1, 300)))
+                                                       for _ in range(100)]:
+            try:
+                nbits = len(optimal_sequence_to_bits(find_optimal_sequence(data)))
+            except ValueError:
+                # (the mode optimisation occasionally produces a sequence which can't be encoded)
+                continue
+            self.assertLessEqual(nbits, check_admission(data).max_bits)
+
+        with self.assertRaises(DataTooBigError) as cm:
+            check_admission(b'\xff' * 5000)
+        self.assertGreater(cm.exception.bits, cm.exception.capacity)
+        with self.assertRaises(DataTooBigError):
+            AztecCode('A' * 5000)
+        with self.assertRaises(DataTooBigError):
+            check_admission('Hello', max_bytes=4)
+        self.assertTrue(issubclass(DataTooBigError, Exception))
+
+    def test_fast_strategy(self):
+        """ Test that the fast strategy encodes correctly, directly for single-mode or binary data """
+        from aztec_code_generator.verify import verify
+        self.assertEqual(find_optimal_sequence('HELLO WORLD', strategy='fast'), b(*'HELLO WORLD'))
+        self.assertEqual(find_optimal_sequence('12, 34.5', strategy='fast'), b(Latch.DIGIT, *'12, 34.5'))
+        self.assertEqual(find_optimal_sequence('hello world', strategy='fast'), b(Latch.LOWER, *'hello world'))
+        self.assertEqual(find_optimal_sequence(b'\xff\x00\x80', strategy='fast'), b(Shift.BINARY, 3, 0xff, 0, 0x80))
+        self.assertEqual(find_optimal_sequence('Hello', 'utf-8', strategy='fast')[:4], [Shift.PUNCT, Misc.FLG, 2, 26])
+
+        rng = random.Random(41)
+        payloads = ['Wikipedia, the free encyclopedia', 'Ticket #00012345 Seat 12A, Row: 4.\r\nGate B17',
+                    'https://example.com/path?id=12345&token=abcDEF', 'x' * 40 + '\xff' * 3 + 'y' * 40]
+        payloads += [bytes(rng.choice(b'Aa0. ,:\r\n@!#\x80\x1bzZ9-') for _ in range(rng.randint(1, 200)))
+                     for _ in range(50)]
+        for data in payloads:
+            raw = data.encode('iso8859-1') if isinstance(data, str) else data
+            nbits = len(optimal_sequence_to_bits(find_optimal_sequence(data, strategy='fast')))
+            self.assertLessEqual(nbits, 8 * len(raw) + (10 if len(raw) <= 31 else 21))
+            verify(AztecCode(data, strategy='fast'))
+        self.assertEqual(AztecCode('Hello', strategy='fast').strategy, 'fast')
+        self.assertEqual(find_suitable_matrix_size('0123456789' * 10, strategy='fast')[:2],
+                         find_suitable_matrix_size('0123456789' * 10)[:2])
+        with self.assertRaises(ValueError):
+            AztecCode('Hello', strategy='greedy')
+
+    def test_plan(self):
+        """ Test the staged pipeline: plan, codewords, Reed-Solomon, and placement """
+        import pickle
+        for data, kwargs in (('Hello', {}), ('Wikipedia, the free encyclopedia', {'ec_percent': 50}),
+                             ('Привет', {'encoding': 'auto'}), (b'\xff' * 100, {}), ('Hello', {'size': 23, 'compact': False})):
+            planned = plan(data, **kwargs)
+            self.assertIsInstance(planned, Plan)
+            aztec_code = AztecCode(data, **kwargs)
+            self.assertEqual((planned.size, planned.compact, planned.encoding, list(planned.sequence)),
+                             (aztec_code.size, aztec_code.compact, aztec_code.encoding, aztec_code.sequence))
+            self.assertEqual(planned.bits(), optimal_sequence_to_bits(aztec_code.sequence))
+            codewords = planned.with_ec()
+            self.assertEqual(codewords.codewords[:codewords.data_cw_count], planned.codewords())
+            self.assertEqual(len(codewords.codewords), configs[planned.size, planned.compact].codewords)
+
+            # stages are hashable and serializable
+            self.assertEqual(pickle.loads(pickle.dumps(planned)), planned)
+            self.assertEqual(hash(plan(data, **kwargs)), hash(planned))
+            self.assertEqual(SymbolCodewords.from_bytes(codewords.to_bytes()), codewords)
+            placed = AztecCode.from_codewords(*SymbolCodewords.from_bytes(codewords.to_bytes()))
+            self.assertEqual(placed.matrix, aztec_code.matrix)
+            self.assertEqual(codewords.aztec_code().matrix, aztec_code.matrix)
+
+        with self.assertRaises(DataTooBigError):
+            plan('Hello' * 10, size=15, compact=True).codewords()
+        with self.assertRaises(ValueError):
+            AztecCode.from_codewords(15, True, (0,) * 10, 5)
+
+    def test_aztec_rune(self):
+        """ Test that Aztec Runes hold their value in the inverted mode message, and are shared """
+        import pickle
+        from aztec_code_generator import AztecRune, mode_message_positions, reed_solomon
+        for value in (0, 1, 17, 128, 255):
+            rune = AztecRune(value)
+            self.assertIs(AztecRune(value), rune)
+            self.assertIs(pickle.loads(pickle.dumps(rune)), rune)
+            self.assertEqual((rune.size, rune.compact, len(rune.matrix)), (11, True, 11))
+            self.assertIsInstance(rune.matrix, tuple)
+            bits = ''.join(str(rune.matrix[y][x]) for y, x in mode_message_positions(11, True))
+            codewords = [int(bits[ii:ii + 4], 2) ^ 0b1010 for ii in range(0, 28, 4)]
+            self.assertEqual(codewords[0] << 4 | codewords[1], value)
+            check = codewords[:2] + [0] * 5
+            reed_solomon(check, 2, 5, 16, 19)
+            self.assertEqual(check, codewords)
+        self.assertNotEqual(AztecRune(0).matrix, AztecRune(1).matrix)
+
+        # same renderers as AztecCode
+        rune = AztecRune(42)
+        out = StringIO()
+        rune.print_out(border=1, file=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 13)
+        self.assertTrue(b''.join(rune.iter_svg()).startswith(b'<svg'))
+        self.assertTrue(b''.join(rune.iter_png()).startswith(b'\x89PNG'))
+        for value in (-1, 256, 1.5, '1'):
+            with self.assertRaises(ValueError):
+                AztecRune(value)
+        # shared runes can't be changed for later callers
+        with self.assertRaises(AttributeError):
+            rune.data = 'x'
+        with self.assertRaises(AttributeError):
+            del rune.scanlines
+        self.assertEqual((AztecRune(42).data, AztecRune(42).scanlines), (None, rune.scanlines))
+
+    def test_warmup(self):
+        """ Test that warmup prepares the requested configurations in compact, read-only tables """
+        import gc
+        from aztec_code_generator import warmup, gf_tables, placement_map
+        self.assertEqual(warmup(sizes=(15, 19), compact=True), ((15, True), (19, True)))
+        self.assertEqual(len(warmup()), len(configs))
+        log, alog = gf_tables(64, 67)
+        self.assertTrue(log.readonly and alog.readonly)
+        self.assertEqual((len(log), len(alog), alog[0], alog[63], log[1], log[2]), (64, 128, 1, 1, 0, 1))
+        # every data and mode message bit is placed
+        self.assertLessEqual(set(range(225, 225 + 17 * 6 + 28)), set(placement_map(15, True)))
+        try:
+            warmup(sizes=(), freeze=True)
+            self.assertGreater(gc.get_freeze_count(), 0)
+        finally:
+            gc.unfreeze()
+        self.assertEqual(AztecCode('Hello').matrix, AztecCode.from_matrix(AztecCode('Hello').matrix, True).matrix)
+
+    def test_buffer_input(self):
+        """ Test that bytes-like data is encoded in place, like the equivalent bytes """
+        import array
+        import mmap
+        from aztec_code_generator.batch import encode_batch
+        from aztec_code_generator.verify import verify
+        records = b'#Hello, World!\r\n\xff\x00Wikipedia, the free encyclopedia 0123456789'
+        with mmap.mmap(-1, len(records)) as mapped:
+            mapped[:] = records
+            view = memoryview(mapped)
+            for data in (bytearray(b'Hello World'), view[1:16], view[16:], array.array('B', b'ABC')):
+                for encoding in (None, 'utf-8', 'auto'):
+                    for strategy in ('optimal', 'fast'):
+                        aztec_code = AztecCode(data, encoding=encoding, strategy=strategy)
+                        verify(aztec_code)
+                        self.assertEqual(aztec_code.matrix, AztecCode(bytes(data), encoding=encoding, strategy=strategy).matrix)
+                self.assertEqual(check_admission(data), check_admission(bytes(data)))
+
+            batch = encode_batch([(mapped, 1, 15), (mapped, 16, len(records) - 16), 'Hello'])
+            self.assertIsInstance(batch.data[0], memoryview)
+            for ii, data in enumerate((records[1:16], records[16:], 'Hello')):
+                self.assertEqual([bytes(line) for line in batch.matrix(ii)],
+                                 [bytes(line) for line in AztecCode(data, batch.size, batch.compact).matrix])
+            del batch, aztec_code, data
+            view.release()
+
+    def test_server(self):
+        """ Test the HTTP rendering service, including conditional requests """
+        from aztec_code_generator.server import AztecHTTPServer
+        server = AztecHTTPServer(('127.0.0.1', 0), workers=1, threads=True, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            conn = http.client.HTTPConnection(*server.server_address)
+            conn.request('GET', '/render?data=Hello&format=txt&border=1')
+            resp = conn.getresponse()
+            self.assertEqual(resp.status, 200)
+            expected = StringIO()
+            AztecCode('Hello').print_out(border=1, file=expected)
+            self.assertEqual(resp.read().decode(), expected.getvalue())
+            tag = resp.getheader('ETag')
+
+            # same connection (keep-alive), answered without re-encoding
+            conn.request('GET', '/render?format=txt&border=1&data=Hello', headers={'If-None-Match': tag})
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 304)
+            conn.request('POST', '/render?format=svg', body=b'Hello')
+            resp = conn.getresponse()
+            self.assertEqual(resp.status, 200)
+            self.assertTrue(resp.read().startswith(b'<svg'))
+            self.assertNotEqual(resp.getheader('ETag'), tag)
+            conn.request('GET', '/render?format=gif&data=Hello')
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 400)
+            conn.request('GET', '/render?data=Hello&format=png&module_size=3')
+            resp = conn.getresponse()
+            self.assertEqual(resp.getheader('Transfer-Encoding'), 'chunked')
+            png = resp.read()
+            if Image:
+                self.assertEqual(Image.open(BytesIO(png)).convert('1').tobytes(), AztecCode('Hello').image(3).tobytes())
+            conn.request('POST', '/render', body=b'\xff' * 5000)
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 413)
+            # a negative length would block reading the body
+            conn.putrequest('POST', '/render')
+            conn.putheader('Content-Length', '-1')
+            conn.endheaders()
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 400)
+            conn.close()
+
+            conn.request('GET', '/metrics')
+            metrics = dict(line.split() for line in conn.getresponse().read().decode().splitlines())
+            self.assertEqual(metrics['aztec_requests_total'], '6')
+            self.assertEqual(metrics['aztec_cache_hits_total'], '1')
+            self.assertEqual(metrics['aztec_too_big_total'], '1')
+            self.assertEqual(metrics['aztec_rendered_total'], '2')
+            self.assertEqual(metrics['aztec_not_modified_total'], '1')
+            conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_sheet(self):
+        """ Test that label sheets place each symbol's modules in its cell """
+        from aztec_code_generator.sheet import render_sheet
+        codes = [AztecCode('Label %d' % ii * (ii + 1)) for ii in range(5)]
+        with NamedTemporaryFile() as backing:
+            for backing_file in (None, backing.name):
+                with render_sheet(codes, 2, module_size=3, border=1, gutter=5, backing_file=backing_file) as sheet:
+                    pbm = BytesIO()
+                    sheet.save(pbm, format='PBM')
+                    header = b'P4\n%d %d\n' % (sheet.width, sheet.height)
+                    self.assertTrue(pbm.getvalue().startswith(header))
+                    pixels = pbm.getvalue()[len(header):]
+                    self.assertEqual(len(pixels), sheet.stride * sheet.height)
+                    for ii, code in enumerate(codes):
+                        row, column = divmod(ii, 2)
+                        offset = ((sheet.cell_size - code.size) // 2 + 1) * 3
+                        for y in range(code.size * 3):
+                            for x in range(code.size * 3):
+                                px = column * (sheet.cell_pixels + 5) + offset + x
+                                py = row * (sheet.cell_pixels + 5) + offset + y
+                                bit = pixels[py * sheet.stride + px // 8] >> (7 - px % 8) & 1
+                                self.assertEqual(bit, code.matrix[y // 3][x // 3])
+                    self.assertEqual(sum(bin(byte).count('1') for byte in pixels),
+                                     9 * sum(sum(line) for code in codes for line in code.matrix))
+
+                    if Image:
+                        for format in ('PNG', 'TIFF'):
+                            f = BytesIO()
+                            sheet.save(f, format=format)
+                            image = Image.open(BytesIO(f.getvalue())).convert('1')
+                            self.assertEqual(image.size, (sheet.width, sheet.height))
+                            pbm_image = Image.open(BytesIO(pbm.getvalue())).convert('1')
+                            self.assertEqual(image.tobytes(), pbm_image.tobytes(), format)
+
+    def test_batch(self):
+        """ Test that batch placement produces the same matrices as AztecCode """
+        from aztec_code_generator.batch import encode_batch, numpy
+        data = ['Ticket #%d' % ii * (ii % 7 + 1) for ii in range(40)] + [b'\xff' * 10]
+        for use_numpy in ((False, True) if numpy is not None else (False,)):
+            batch = encode_batch(data, use_numpy=use_numpy)
+            self.assertEqual(len(batch), len(data))
+            self.assertEqual((batch.size, batch.compact), max(
+                (find_suitable_matrix_size(item)[:2] for item in data), key=list(configs).index))
+            for ii, item in enumerate(data):
+                code = AztecCode(item, batch.size, batch.compact)
+                self.assertEqual([bytes(line) for line in batch.matrix(ii)], [bytes(line) for line in code.matrix])
+                self.assertEqual(batch[ii][3, 4], code.matrix[3][4])
+                self.assertEqual(batch.aztec_code(ii).matrix, code.matrix)
+            batch = encode_batch(data[:3], 45, False, use_numpy=use_numpy)
+            self.assertEqual(batch.aztec_code(2).matrix, AztecCode(data[2], 45, False).matrix)
+            self.assertEqual(len(encode_batch([], 15, True, use_numpy=use_numpy)), 0)
+            self.assertRaises(ValueError, encode_batch, [], use_numpy=use_numpy)
+
+            texts = ['Привет, мир!', 'Hello', 'こんにちは']
+            batch = encode_batch(texts, encoding='auto', use_numpy=use_numpy)
+            self.assertEqual(batch.encodings, ('iso8859-5', None, 'shift_jis'))
+            for ii, text in enumerate(texts):
+                code = AztecCode(text, batch.size, batch.compact, encoding='auto')
+                self.assertEqual(batch.aztec_code(ii).encoding, code.encoding)
+                self.assertEqual(batch.aztec_code(ii).matrix, code.matrix)
+
+    def test_shared_memory_transport(self):
+        """ Test the shared memory ring buffer, and a pool returning results through it """
+        from aztec_code_generator.transport import SharedRing, SharedMemoryPool
+        with SharedRing(100) as ring:
+            first, second = ring.put(b'a' * 40), ring.put(b'b' * 40)
+            self.assertEqual(ring.put(b'c' * 40).inline, b'c' * 40)   # full
+            ring.release(second)
+            self.assertEqual(ring.in_use(), 80)   # released out of order: space not reclaimed yet
+            ring.release(first)
+            self.assertEqual(ring.in_use(), 0)
+            third = ring.put(b'd' * 30, 19, True)
+            self.assertEqual((third.offset, third.size, third.compact), (0, 19, True))   # wrapped around
+            view = ring.read(third)
+            self.assertEqual(bytes(view), b'd' * 30)
+            view.release()
+
+        data = ['Ticket #%d' % ii * (ii % 5 + 1) for ii in range(20)]
+        with SharedMemoryPool(1, capacity=1024) as pool:
+            for item, descriptor in zip(data, pool.map(data, chunksize=4)):
+                self.assertEqual(pool.aztec_code(descriptor).matrix, AztecCode(item).matrix)
+            self.assertEqual(pool.ring.in_use(), 0)
+            descriptor, = pool.map(['Hello'], format='txt')
+            expected = StringIO()
+            AztecCode('Hello').print_out(file=expected)
+            view = pool.read(descriptor)
+            self.assertEqual(bytes(view).decode(), expected.getvalue())
+            view.release()
+            pool.release(descriptor)
+            # the encoding chosen by 'auto' comes back with the result
+            descriptor, = pool.map(['Привет, мир! Как дела?'], encoding='auto')
+            self.assertEqual(pool.aztec_code(descriptor).encoding, 'iso8859-5')
+
+        # the workers are only sent as many payloads as the ring is expected to hold
+        with SharedMemoryPool(2, capacity=1024) as pool:
+            for descriptor in pool.map(['Ticket #%03d' % ii for ii in range(200)], chunksize=4):
+                self.assertIsNone(descriptor.inline)
+                pool.release(descriptor)
+
+    def test_store(self):
+        """ Test the persistent symbol store """
+        from tempfile import TemporaryDirectory
+        from aztec_code_generator.store import SymbolStore, symbol_key, pack_matrix, unpack_matrix
+        code = AztecCode('Staff badge 0042', ec_percent=50)
+        self.assertEqual(unpack_matrix(pack_matrix(code.matrix), code.size), code.matrix)
+        with TemporaryDirectory() as directory:
+            with SymbolStore(directory) as store, SymbolStore(directory) as other:
+                for ii in range(2):
+                    stored = store.aztec_code('Staff badge 0042', ec_percent=50)
+                    self.assertEqual((stored.size, stored.compact, stored.matrix), (code.size, code.compact, code.matrix))
+                self.assertEqual((store.hits, store.misses), (1, 1))
+                store.aztec_code(b'Season pass \xff')
+                # appended by another instance (as if by another process)
+                self.assertEqual(other.aztec_code('Staff badge 0042', ec_percent=50).matrix, code.matrix)
+                self.assertEqual((other.hits, other.misses, len(other)), (1, 0, 2))
+
+                store.compact(keep=lambda key: key != symbol_key(b'Season pass \xff'))
+                self.assertEqual(len(store), 1)
+                self.assertIsNone(other.get_packed(symbol_key(b'Season pass \xff')))
+                self.assertEqual(other.aztec_code('Staff badge 0042', ec_percent=50).matrix, code.matrix)
+                other.aztec_code(b'Season pass \xff')
+                self.assertEqual(len(store), 2)
+
+                # the encoding chosen by 'auto' is recorded, so hits and misses agree
+                for ii in range(2):
+                    self.assertEqual(store.aztec_code('Привет', encoding='auto').encoding, 'iso8859-5')
+                self.assertNotEqual(symbol_key('Привет', strategy='fast'), symbol_key('Привет'))
+                fast = AztecCode(b'\t<\r\nAA. : , \xff\x00' * 20, strategy='fast')
+                for ii in range(2):
+                    stored = store.aztec_code(b'\t<\r\nAA. : , \xff\x00' * 20, strategy='fast')
+                    self.assertEqual((stored.matrix, stored.strategy), (fast.matrix, 'fast'))
+
+    def test_verify(self):
+        """ Test matrix-level verification of encoded symbols """
+        from aztec_code_generator.verify import verify
+        for data, kwargs in (
+            ('Wikipedia, the free encyclopedia', dict(ec_percent=0)),
+            ('Wow. Much error. Very correction. Amaze', dict(ec_percent=95)),
+            ('¿Cuánto cuesta?', {}),
+            ('The price is €4', dict(encoding='utf-8')),
+            ('אין לי מושג', dict(encoding='iso8859-8')),
+            (b'\t<\r\nAA. : , \xff\x00' * 20, {}),
+            (b'\xff' * 212, dict(ec_percent=10)),
+            ('Aztec Code 2D :)', dict(size=45, compact=False)),
+        ):
+            result = verify(AztecCode(data, **kwargs))
+            self.assertEqual(result.eci, encoding_to_eci.get(kwargs.get('encoding')))
+
+    def test_verify_errors(self):
+        """ Test that verification detects, and optionally corrects, damaged modules """
+        from aztec_code_generator.verify import verify, VerificationError
+        from aztec_code_generator import data_positions
+        code = AztecCode('Wow. Much error. Very correction. Amaze', ec_percent=50)
+        for y, x in data_positions(code.size, code.compact)[::37][:6]:
+            code.matrix[y][x] ^= 1
+        self.assertRaises(VerificationError, verify, code)
+        self.assertEqual(verify(code, correct=True).corrected, 6)
+
+    def test_thread_safety(self):
+        """ Test that module tables are read-only, and that concurrent encoding matches serial encoding """
+        from concurrent.futures import ThreadPoolExecutor
+        import operator
+        from aztec_code_generator import code_chars, latch_len
+        self.assertRaises(TypeError, operator.setitem, configs, (15, True), None)
+        self.assertRaises(TypeError, operator.setitem, latch_len[Mode.UPPER], Mode.LOWER, 0)
+        self.assertIsInstance(code_chars[Mode.UPPER], tuple)
+
+        payloads = ['Thread %d. ' % ii * (ii % 20 + 1) for ii in range(64)]
+        def encode(data):
+            f = StringIO()
+            code = AztecCode(data)
+            code.print_out(file=f)
+            code.save_svg(BytesIO())
+            return [bytes(line) for line in code.matrix], f.getvalue()
+        expected = [encode(data) for data in payloads]
+        with ThreadPoolExecutor(8) as executor:
+            self.assertEqual(list(executor.map(encode, payloads)), expected)
+
+    def test_differential(self):
+        """ Test that the optimized encoder matches the frozen reference implementations """
+        from aztec_code_generator.differential import run
+        harness = run(count=10, seed=1, exhaustive_len=2, max_capacity_count=1)
+        self.assertGreater(harness.count - harness.skipped, 0)
+
     def _encode_and_decode(self, data, *args, **kwargs):
         with NamedTemporaryFile(suffix='.png') as f:
             code = AztecCode(data, *args, **kwargs)
@@ -291,5 +951,17 @@ class Test(unittest.TestCase):
         """
         AztecCode(b'\0'*212, ec_percent=10)
 
+    def test_compact_data_codeword_limit(self):
+        """ Demonstrate a now-fixed bug in find_suitable_matrix_size
+
+        The compact mode message holds the number of data codewords in 6 bits, so a compact
+        27x27 symbol (76 codewords) can't hold more than 64 data codewords, but it was chosen
+        for up to 72 data codewords with ec_percent=0.
+        """
+        from aztec_code_generator.verify import verify
+        for length in range(56, 72):
+            verify(AztecCode(b'\x80' * length, ec_percent=0))
+        self.assertRaises(Exception, AztecCode, b'\x80' * 70, size=27, compact=True, ec_percent=0)
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)